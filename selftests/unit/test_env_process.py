@@ -1,11 +1,17 @@
+import logging
 import re
+import shutil
 import sys
+import tempfile
+import threading
+import time
 
 if sys.version_info[:2] == (2, 6):
     import unittest2 as unittest
 else:
     import unittest
 
+from virttest import env_process, utils_env, utils_params
 from virttest.env_process import QEMU_VERSION_RE
 
 
@@ -34,3 +40,227 @@ class QEMUVersion(unittest.TestCase):
         for version, expected in list(versions_expected.items()):
             match = re.match(QEMU_VERSION_RE, version)
             self.assertEqual(match.groups(), expected)
+
+
+class FakeVM(object):
+    def __init__(self, name):
+        self.name = name
+        self.params = utils_params.Params({"kill_timeout": "1"})
+        self.dead = False
+        self.destroyed = []
+
+    def is_dead(self):
+        return self.dead
+
+    def get_pid(self):
+        return 0
+
+    def graceful_shutdown(self, timeout=60):
+        time.sleep(timeout)
+
+    def destroy(self, gracefully=True, free_mac_addresses=True):
+        self.destroyed.append(gracefully)
+        self.dead = True
+
+
+class DestroyVMs(unittest.TestCase):
+    """Kill the VMs of a test all at once"""
+
+    def test_destroy(self):
+        vms = dict((name, FakeVM(name)) for name in ("vm1", "vm2", "vm3"))
+        env = utils_env.Env()
+        for name, vm in vms.items():
+            env.register_vm(name, vm)
+        params = utils_params.Params(
+            {
+                "vms": "vm1 vm2 vm3",
+                "kill_vm": "yes",
+                "kill_vm_gracefully": "yes",
+                "kill_vm_vm2": "no",
+                "kill_vm_gracefully_vm3": "no",
+                "vm_type": "fake",
+            }
+        )
+        start = time.time()
+        env_process._postprocess_vms_destroy(None, params, env, ["vm1", "vm2", "vm3"])
+        self.assertLess(time.time() - start, 2.5)
+        self.assertEqual(vms["vm1"].destroyed, [False])
+        self.assertEqual(vms["vm2"].destroyed, [])
+        self.assertEqual(vms["vm3"].destroyed, [False])
+
+
+class ProcessVMs(unittest.TestCase):
+    """Concurrent processing of VMs"""
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+
+    def vm_func(self, test, params, env, name):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.events.append(("start", name))
+        time.sleep(0.2)
+        logging.getLogger("avocado.test").info("processing")
+        with self.lock:
+            self.running -= 1
+            self.events.append(("end", name))
+        if params.get("fail") == "yes":
+            raise ValueError("%s failed" % name)
+
+    def process(self, **extra):
+        params = {
+            "vms": "vm1 vm2 vm3 vm4",
+            "vms_process_parallel": "yes",
+            "skip_image_processing": "yes",
+        }
+        params.update(extra)
+        env_process.process(
+            None,
+            utils_params.Params(params),
+            {},
+            None,
+            self.vm_func,
+        )
+
+    def test_parallel(self):
+        start = time.time()
+        self.process(vms_process_max_threads="2", vm_process_after_vm4="vm1 vm3")
+        self.assertLess(time.time() - start, 0.7)
+        self.assertEqual(self.max_running, 2)
+        self.assertEqual(len(self.events), 8)
+        for name in ("vm1", "vm3"):
+            self.assertLess(
+                self.events.index(("end", name)), self.events.index(("start", "vm4"))
+            )
+
+    def test_failures(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "vm2 failed",
+            self.process,
+            fail_vm2="yes",
+            fail_vm3="yes",
+            vm_process_after_vm1="vm2",
+        )
+        # vm1 depends on the failed vm2, vm3 and vm4 were processed anyway
+        started = [_[1] for _ in self.events if _[0] == "start"]
+        self.assertEqual(sorted(started), ["vm2", "vm3", "vm4"])
+
+    def test_cycle(self):
+        self.assertRaises(
+            env_process.exceptions.TestError,
+            self.process,
+            vm_process_after_vm1="vm2",
+            vm_process_after_vm2="vm1",
+        )
+        self.assertEqual(self.events, [])
+
+    def test_log_prefix(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: records.append(record.getMessage())
+        logger = logging.getLogger("avocado.test")
+        level = logger.level
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        try:
+            self.process()
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        self.assertEqual(
+            sorted(_ for _ in records if _.endswith("processing")),
+            ["[vm%d] processing" % i for i in range(1, 5)],
+        )
+        self.assertEqual(handler.filters, [])
+
+
+class ProcessImages(unittest.TestCase):
+    """Image processing using a shared work queue"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_images")
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+        self.running = {}
+        self.max_running = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def image_func(self, test, params, image_name, vm_process_status=None):
+        storage = params.get("enable_nbd", "local")
+        with self.lock:
+            self.started.append(image_name)
+            self.running[storage] = self.running.get(storage, 0) + 1
+            self.max_running[storage] = max(
+                self.max_running.get(storage, 0), self.running[storage]
+            )
+        time.sleep(float(params.get("duration", 0.1)))
+        with self.lock:
+            self.running[storage] -= 1
+            self.finished.append(image_name)
+        if params.get("fail") == "yes":
+            raise ValueError("%s failed" % image_name)
+
+    def process(self, **extra):
+        params = {
+            "images": " ".join("image%d" % i for i in range(6)),
+            "images_base_dir": self.tmpdir,
+        }
+        params.update(extra)
+        env_process.process_images(self.image_func, None, utils_params.Params(params))
+
+    def test_serial(self):
+        self.process()
+        self.assertEqual(self.started, ["image%d" % i for i in range(6)])
+        self.assertEqual(self.max_running, {"local": 1})
+
+    def test_queue(self):
+        start = time.time()
+        # Fixed chunks would process image0 and image2 in the same thread
+        self.process(images_process_threads="2", duration_image0="0.5")
+        self.assertLess(time.time() - start, 0.75)
+        self.assertEqual(self.max_running, {"local": 2})
+
+    def test_per_storage(self):
+        self.process(
+            images_process_threads="4",
+            images_process_threads_per_storage="1",
+            enable_nbd_image3="yes",
+            enable_nbd_image4="yes",
+            enable_nbd_image5="yes",
+        )
+        self.assertEqual(sorted(self.started), ["image%d" % i for i in range(6)])
+        self.assertEqual(self.max_running, {"local": 1, "yes": 1})
+
+    def test_chain(self):
+        self.process(
+            images_process_threads="3",
+            duration_image0="0.3",
+            image_chain_image2="image0 image2",
+            image_chain_image4="image0 image2 image4",
+        )
+        self.assertEqual(sorted(self.started), ["image%d" % i for i in range(6)])
+        # The snapshots were started once their backing image was done
+        chain = [_ for _ in self.started if _ in ("image0", "image2", "image4")]
+        self.assertEqual(chain, ["image0", "image2", "image4"])
+        self.assertLess(self.finished.index("image0"), self.started.index("image2"))
+
+    def test_failure(self):
+        self.assertRaisesRegex(
+            ValueError,
+            "image0 failed",
+            self.process,
+            images_process_threads="2",
+            fail_image1="yes",
+            fail_image0="yes",
+            duration_image0="0.3",
+        )
+        # No more images are started after the failure
+        self.assertEqual(sorted(self.started), ["image0", "image1"])
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from virttest import ip_sniffing
+
+
+class AddrCacheTest(unittest.TestCase):
+    def test_wait_for(self):
+        cache = ip_sniffing.AddrCache()
+        self.assertIsNone(cache.wait_for("9A:00:00:00:00:01", 0.1))
+        timer = threading.Timer(
+            0.2, cache.__setitem__, ("9a:00:00:00:00:01", "1.2.3.4")
+        )
+        timer.start()
+        start = time.time()
+        self.assertEqual(cache.wait_for("9A:00:00:00:00:01", 10), "1.2.3.4")
+        self.assertLess(time.time() - start, 5)
+        timer.join()
+        # Known address is returned at once, unless a new one is requested
+        self.assertEqual(cache.wait_for("9a:00:00:00:00:01", 0), "1.2.3.4")
+        self.assertIsNone(cache.wait_for("9a:00:00:00:00:01", 0.1, "1.2.3.4"))
+
+    def test_pickle(self):
+        cache = ip_sniffing.AddrCache()
+        cache["9a:00:00:00:00:01"] = "1.2.3.4"
+        state = cache.__getstate__()
+        other = ip_sniffing.AddrCache.__new__(ip_sniffing.AddrCache)
+        other.__setstate__(state)
+        self.assertEqual(other.wait_for("9a:00:00:00:00:01", 0), "1.2.3.4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,8 +8,12 @@ This is a unittest for qemu_devices library.
 __author__ = """Lukas Doktor (ldoktor@redhat.com)"""
 
 import os
+import pickle
 import re
+import shutil
 import sys
+import tempfile
+import time
 import unittest
 
 # simple magic for using scripts within a source tree
@@ -18,6 +22,7 @@ if os.path.isdir(os.path.join(basedir, "virttest")):
     sys.path.append(basedir)
 
 import six
+from avocado.utils import process
 from six.moves import xrange
 
 from virttest import qemu_monitor
@@ -66,6 +71,53 @@ class MockHMPMonitor(qemu_monitor.HumanMonitor):
         pass
 
 
+class MockQMPMonitor(qemu_monitor.QMPMonitor):
+    """Dummy QMP monitor simulating qemu devices and block nodes"""
+
+    def __init__(self):  # pylint: disable=W0231
+        self.debug_log = False
+        self.devices = set()
+        self.nodes = set()
+        self.fail = set()  # ids of devices which fail to (un)plug
+        self.batches = []  # number of commands sent at once
+        self._events = []
+
+    def __del__(self):
+        pass
+
+    def _execute(self, cmd, args):
+        qid = args.get("id", args.get("node-name"))
+        if qid in self.fail:
+            return qemu_monitor.QMPCmdError(cmd, args, {"class": "GenericError"})
+        if cmd == "device_add":
+            self.devices.add(qid)
+        elif cmd == "device_del":
+            self.devices.remove(qid)
+            self._events.append({"event": "DEVICE_DELETED", "data": {"device": qid}})
+        elif cmd == "blockdev-add":
+            self.nodes.add(qid)
+        elif cmd == "blockdev-del":
+            self.nodes.remove(qid)
+        return {}
+
+    def cmd_many(self, cmds, timeout=None, debug=True):
+        self.batches.append(len(cmds))
+        return [self._execute(cmd, args) for cmd, args in cmds]
+
+    def cmd(self, cmd, args=None, timeout=None, debug=True, fd=None):
+        if cmd == "qom-list":
+            return [{"name": _, "type": "child<dev>"} for _ in self.devices]
+        if cmd == "query-named-block-nodes":
+            return [{"node-name": _} for _ in self.nodes]
+        raise NotImplementedError(cmd)
+
+    def _pop_event(self, names, match=None):
+        for event in self._events:
+            if event["event"] in names and (match is None or match(event)):
+                self._events.remove(event)
+                return event
+
+
 class Devices(unittest.TestCase):
     """set of qemu devices tests"""
 
@@ -146,6 +198,57 @@ class Devices(unittest.TestCase):
         out = str(qdevice.hotplug_qmp())
         self.assertEqual(out, exp, "QMP command corrupted:\n%s\n%s" % (out, exp))
 
+    def test_cmdline_cache(self):
+        """Rendered cmdline follows params modifications"""
+        qdevice = qdevices.QDevice("ahci", {"addr": "0x7"})
+        self.assertEqual(qdevice.cmdline(), "-device ahci,addr=0x7")
+        qdevice.set_param("id", "ahci1")
+        self.assertEqual(qdevice.cmdline(), "-device ahci,addr=0x7,id=ahci1")
+        qdevice.params["addr"] = "0x8"
+        self.assertEqual(qdevice.cmdline(), "-device ahci,addr=0x8,id=ahci1")
+        del qdevice.params["id"]
+        self.assertEqual(qdevice.cmdline(), "-device ahci,addr=0x8")
+        qdevice.set_param("addr", "0x9", dynamic=True)
+        self.assertEqual(qdevice.cmdline_nd(), "-device ahci,addr=DYN")
+        qdevice.set_param("addr", "0x9")
+        self.assertEqual(qdevice.cmdline_nd(), "-device ahci,addr=0x9")
+        qdevice.params = {"driver": "ahci", "addr": "0xa"}
+        self.assertEqual(qdevice.cmdline(), "-device ahci,addr=0xa")
+
+    def test_pickle(self):
+        """Devices use __slots__ and pickle their state"""
+        qdevice = qdevices.QDevice("virtio-scsi-pci", {"addr": "0x7"})
+        qdevice.set_param("id", "scsi0", dynamic=True)
+        qdevice.add_child_bus(
+            qdevices.QSCSIBus("scsi0.0", "SCSI", [8, 16384], atype="virtio-scsi-pci")
+        )
+        self.assertEqual(qdevice.__dict__, {})
+        self.assertEqual(qdevice.child_bus[0].__dict__, {})
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            out = pickle.loads(pickle.dumps(qdevice, protocol))
+            self.assertEqual(out.cmdline(), qdevice.cmdline())
+            self.assertEqual(out.cmdline_nd(), qdevice.cmdline_nd())
+            self.assertIs(out.child_bus[0].get_device(), out)
+            out["addr"] = "0x8"
+            self.assertEqual(out.cmdline(), "-device virtio-scsi-pci,addr=0x8,id=scsi0")
+        # State pickled before __slots__ were introduced
+        out = qdevices.QDevice.__new__(qdevices.QDevice)
+        out.__setstate__(
+            {
+                "aid": None,
+                "type": "device",
+                "aobject": None,
+                "parent_bus": (),
+                "child_bus": [],
+                "dynamic_params": [],
+                "params": qdevices.OrderedDict([("driver", "ahci")]),
+                "cmdline_format": "raw",
+                "_QCustomDevice__backend": "driver",
+            }
+        )
+        self.assertEqual(out.cmdline(), "-device ahci")
+        self.assertIsInstance(out.params, qdevices.QParams)
+
 
 class Buses(unittest.TestCase):
     """Set of bus-representation tests"""
@@ -671,67 +774,52 @@ class Container(unittest.TestCase):
 
     def setUp(self):
         self.god = mock.mock_god(ut=self)
-        self.god.stub_function(qcontainer.process, "system_output")
+        self.god.stub_with(qcontainer.utils_qemu, "CAPS_CACHE_ENABLED", False)
+        self.god.stub_with(qcontainer.process, "run", self._run_qemu)
 
     def tearDown(self):
         self.god.unstub_all()
 
+    @staticmethod
+    def _run_qemu(cmd, *args, **kwargs):
+        """Pretend to run the qemu-1.5.0 probes"""
+        if "help\nquit" in cmd:
+            output = QEMU_HMP
+        elif "-vnc none" in cmd and "RAND91" in cmd:
+            output = QEMU_QMP
+        elif cmd.endswith(" -help 2>&1"):
+            output = QEMU_HELP
+        elif "-device \\?" in cmd:
+            output = QEMU_DEVICES
+        elif cmd.endswith("-machine help"):
+            output = QEMU_MACHINE
+        elif cmd.endswith("-version"):
+            output = "QEMU emulator version 1.5.0"
+        else:
+            output = ""
+        return process.CmdResult(cmd, output.encode(), b"", 0)
+
     def create_qdev(self, vm_name="vm1", strict_mode="no", allow_hotplugged_vm="yes"):
         """:return: Initialized qcontainer.DevContainer object"""
         qemu_cmd = "/usr/bin/qemu_kvm"
-        qcontainer.process.system_output.expect_call(
-            "%s -help" % qemu_cmd,
-            timeout=10,
-            ignore_status=True,
-            shell=True,
-            verbose=False,
-        ).and_return(QEMU_HELP)
-        qcontainer.process.system_output.expect_call(
-            "%s -device \? 2>&1" % qemu_cmd,
-            timeout=10,
-            ignore_status=True,
-            shell=True,
-            verbose=False,
-        ).and_return(QEMU_DEVICES)
-        qcontainer.process.system_output.expect_call(
-            "%s -M \?" % qemu_cmd,
-            timeout=10,
-            ignore_status=True,
-            shell=True,
-            verbose=False,
-        ).and_return(QEMU_MACHINE)
-        cmd = "echo -e 'help\nquit' | %s -monitor stdio -vnc none" % qemu_cmd
-        qcontainer.process.system_output.expect_call(
-            cmd, timeout=10, ignore_status=True, shell=True, verbose=False
-        ).and_return(QEMU_HMP)
-        cmd = (
-            'echo -e \'{ "execute": "qmp_capabilities" }\n'
-            '{ "execute": "query-commands", "id": "RAND91" }\n'
-            '{ "execute": "quit" }\''
-            "| %s -qmp stdio -vnc none | grep return |"
-            " grep RAND91" % qemu_cmd
-        )
-        qcontainer.process.system_output.expect_call(
-            cmd, timeout=10, ignore_status=True, shell=True, verbose=False
-        ).and_return("")
-
-        cmd = (
-            'echo -e \'{ "execute": "qmp_capabilities" }\n'
-            '{ "execute": "query-commands", "id": "RAND91" }\n'
-            '{ "execute": "quit" }\' | (sleep 1; cat )'
-            "| %s -qmp stdio -vnc none | grep return |"
-            " grep RAND91" % qemu_cmd
-        )
-        qcontainer.process.system_output.expect_call(
-            cmd, timeout=10, ignore_status=True, shell=True, verbose=False
-        ).and_return(QEMU_QMP)
-
-        qdev = qcontainer.DevContainer(
+        return qcontainer.DevContainer(
             qemu_cmd, vm_name, strict_mode, "no", allow_hotplugged_vm
         )
 
-        self.god.check_playback()
-        return qdev
+    def test_pickle_caps_cache(self):
+        """Containers using the capabilities cache can be pickled"""
+        tmpdir = tempfile.mkdtemp(prefix="avocado_vt_caps_cache")
+        self.addCleanup(shutil.rmtree, tmpdir)
+        qemu_cmd = os.path.join(tmpdir, "qemu_kvm")
+        shutil.copy("/bin/true", qemu_cmd)
+        self.god.stub_with(qcontainer.utils_qemu, "CAPS_CACHE_ENABLED", True)
+        self.god.stub_with(qcontainer.utils_qemu, "CAPS_CACHE_DIR", tmpdir)
+        qdev = qcontainer.DevContainer(qemu_cmd, "vm1", "no", "no", "yes")
+        cache = qdev._DevContainer__caps_cache
+        self.assertIsNotNone(cache)
+        qdev2 = pickle.loads(pickle.dumps(qdev))
+        self.assertIs(qdev2._DevContainer__caps_cache, cache)
+        self.assertEqual(qdev2.execute_qemu("-help"), qdev.execute_qemu("-help"))
 
     def test_qdev_functional(self):
         """Test basic qdev workflow"""
@@ -1355,6 +1443,136 @@ fdc
         out = qdev.cmdline()
         assert out == exp, (out, exp)
 
+    def test_indexes(self):
+        """Lookups stay consistent with the devices and buses"""
+        qdev = self.create_qdev("vm1")
+        qdev.insert(qdev.machine_by_params(ParamsDict({"machine_type": "pc"})))
+        hba = qdevices.QDevice(
+            "ahci",
+            {"id": "hba1"},
+            aobject="hba1",
+            parent_bus={"aobject": "pci.0"},
+            child_bus=qdevices.QAHCIBus("hba1", "hba1"),
+        )
+        disk = qdevices.QDevice(
+            "ide-hd",
+            {"id": "disk1", "drive": "drive_disk1"},
+            aobject="disk1",
+            parent_bus={"aobject": "hba1"},
+        )
+        qdev.insert([hba, disk])
+        self.assertIs(qdev["disk1"], disk)
+        self.assertEqual(qdev.get_by_qid("hba1"), [hba])
+        self.assertEqual(qdev.get_qdev_by_drive("drive_disk1"), "disk1")
+        self.assertEqual(qdev.get_by_properties({"aobject": "disk1"}), [disk])
+        self.assertEqual(qdev.get_by_params({"id": "disk1"}), [disk])
+        self.assertEqual(
+            [_.busid for _ in qdev.get_buses({"aobject": "hba1"})], ["hba1"]
+        )
+        self.assertEqual(
+            qdev.get_buses({"type": "IDE"}, True),
+            [_ for _ in qdev.get_buses({}) if _.type == "IDE"],
+        )
+        # params changed after insertion are still found
+        disk.set_param("drive", "drive_other")
+        self.assertEqual(qdev.get_qdev_by_drive("drive_other"), "disk1")
+        disk.set_param("drive", "drive_disk1")
+
+        qdev2 = pickle.loads(pickle.dumps(qdev))
+        self.assertEqual(qdev2["disk1"].get_qid(), "disk1")
+        qdev2.remove("hba1")
+        self.assertNotIn("disk1", qdev2)
+        self.assertIn("disk1", qdev)
+
+        qdev.remove(hba)
+        self.assertNotIn("disk1", qdev)
+        self.assertNotIn(disk, qdev)
+        self.assertEqual(qdev.get_by_qid("disk1"), [])
+        self.assertEqual(qdev.get_qdev_by_drive("drive_disk1"), None)
+        self.assertEqual(qdev.get_buses({"aobject": "hba1"}), [])
+
+        qdev.insert([hba, disk])
+        qdev.wash_the_device_out(hba)
+        self.assertEqual(qdev.get_by_qid("hba1"), [])
+        self.assertEqual(qdev.get_buses({"aobject": "hba1"}), [])
+        self.assertEqual(len(qdev), len(qdev2))
+
+    def test_many_disks(self):
+        """Benchmark: define 500 disks behind PCIe root ports"""
+        qdev = self.create_qdev("vm1")
+        qdev.insert(qdev.machine_by_params(ParamsDict({"machine_type": "q35"})))
+        start = time.time()
+        for i in xrange(500):
+            # virtio-blk-pci disks get their own root port, the rest goes to
+            # virtio-scsi-pci HBAs (the number of root ports is limited)
+            qdev.insert(
+                qdev.images_define_by_variables(
+                    "disk%d" % i,
+                    "/tmp/disk%d.qcow2" % i,
+                    {"aobject": "pci.0"},
+                    fmt="virtio" if i < 200 else "scsi-hd",
+                    imgfmt="qcow2",
+                    scsi_hba="virtio-scsi-pci",
+                )
+            )
+        duration = time.time() - start
+        sys.stderr.write("500 disks defined in %.3fs\n" % duration)
+        self.assertEqual(qdev.get_by_qid("disk499")[0].get_param("driver"), "scsi-hd")
+        self.assertEqual(qdev.get_qdev_by_drive("drive_disk0"), "disk0")
+        self.assertEqual(
+            qdev.get_buses({"type": "PCIE"}, True),
+            [_ for _ in qdev.get_buses({}) if _.type == "PCIE"],
+        )
+
+    def test_hotplug_many(self):
+        """Pipelined hotplug/unplug of several devices"""
+        qdev = self.create_qdev("vm1")
+        qdev.insert(qdev.machine_by_params(ParamsDict({"machine_type": "pc"})))
+        qdev.caps.set_flag(qcontainer.Flags.BLOCKDEV)
+        monitor = MockQMPMonitor()
+        disks = []
+        for i in xrange(3):
+            disks.append(
+                qdev.images_define_by_variables(
+                    "disk%d" % i,
+                    "/tmp/disk%d.qcow2" % i,
+                    {"aobject": "pci.0"},
+                    fmt="virtio",
+                    imgfmt="qcow2",
+                )
+            )
+        devices = disks[0] + disks[1]
+        out = qdev.hotplug_many(devices, monitor)
+        self.assertEqual([_[1] for _ in out], [True] * 6)
+        self.assertEqual(monitor.batches, [6])
+        self.assertEqual(monitor.devices, set(["disk0", "disk1"]))
+        self.assertEqual(qdev.get_state(), 0)
+
+        # Failure of the last device unplugs the nodes again
+        monitor.fail.add("disk2")
+        self.assertRaises(
+            qcontainer.DeviceHotplugError, qdev.hotplug_many, disks[2], monitor
+        )
+        nodes = set(["file_disk0", "drive_disk0", "file_disk1", "drive_disk1"])
+        self.assertEqual(monitor.nodes, nodes)
+        self.assertEqual(monitor.devices, set(["disk0", "disk1"]))
+        self.assertFalse(qdev.get_by_qid("disk2"))
+        self.assertFalse(qdev.get_by_qid("drive_disk2"))
+        self.assertEqual(qdev.get_state(), 0)
+
+        # One device fails to unplug, the other one and its nodes are removed
+        monitor.batches = []
+        monitor.fail = set(["disk1"])
+        out = qdev.unplug_many([disks[0][-1], disks[1][-1]], monitor)
+        self.assertEqual([_[1] for _ in out], [True, False])
+        self.assertEqual(monitor.batches, [2, 2])
+        self.assertEqual(monitor.devices, set(["disk1"]))
+        self.assertEqual(monitor.nodes, set(["drive_disk1", "file_disk1"]))
+        self.assertFalse(qdev.get_by_qid("disk0"))
+        self.assertFalse(qdev.get_by_qid("file_disk0"))
+        self.assertTrue(qdev.get_by_qid("disk1"))
+        self.assertEqual(qdev.get_state(), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,7 +1,13 @@
 #!/usr/bin/python
 
+import json
 import os
+import shutil
+import socket
 import sys
+import tempfile
+import threading
+import time
 import unittest
 
 # simple magic for using scripts within a source tree
@@ -11,7 +17,7 @@ if os.path.isdir(os.path.join(basedir, "virttest")):
 
 import six
 
-from virttest import qemu_monitor
+from virttest import qemu_monitor, utils_logfile
 
 
 class MockMonitor(qemu_monitor.Monitor):
@@ -24,6 +30,33 @@ class MockMonitor(qemu_monitor.Monitor):
         pass
 
 
+class MockQMPMonitor(qemu_monitor.QMPMonitor):
+    """Dummy QMP monitor talking to the other end of a socket pair"""
+
+    def __init__(self):  # pylint: disable=W0231
+        self._socket, self.peer = socket.socketpair()
+        self.vm = qemu_monitor.VM("vm1")
+        self.name = "qmpmonitor1"
+        self._server_closed = False
+        self._lock = threading.RLock()
+        self._events = []
+        self._event_listeners = []
+        self._job_tracker = None
+        self._supported_cmds = []
+        self.debug_log = False
+
+    def __del__(self):
+        pass
+
+    def _log_lines(self, log_str):
+        pass
+
+    def emit(self, event, **data):
+        obj = {"event": event, "data": data}
+        obj["timestamp"] = {"seconds": int(time.time()), "microseconds": 0}
+        self.peer.sendall(json.dumps(obj).encode() + b"\n")
+
+
 class InfoNumaTests(unittest.TestCase):
     def testZeroNodes(self):
         d = "0 nodes\n"
@@ -364,5 +397,200 @@ sd0: [not inserted]
                 )
 
 
+class QMPEvents(unittest.TestCase):
+    def setUp(self):
+        self.monitor = MockQMPMonitor()
+
+    def tearDown(self):
+        self.monitor.peer.close()
+        self.monitor._socket.close()
+
+    def test_wait_for_event_pops_matching(self):
+        self.monitor.emit("MIGRATION_PASS", **{"pass": 1})
+        self.monitor.emit("MIGRATION", status="active")
+        self.monitor.emit("MIGRATION", status="completed")
+        event = self.monitor.wait_for_event(
+            "MIGRATION", 1, lambda e: e["data"]["status"] == "completed"
+        )
+        self.assertEqual(event["data"]["status"], "completed")
+        remaining = [e["event"] for e in self.monitor._events]
+        self.assertEqual(remaining, ["MIGRATION_PASS", "MIGRATION"])
+
+    def test_wait_for_event_wakes_up(self):
+        timer = threading.Timer(0.2, self.monitor.emit, ("RESET",))
+        timer.start()
+        start = time.time()
+        event = self.monitor.wait_for_event(["RESET", "STOP"], 10)
+        timer.join()
+        self.assertEqual(event["event"], "RESET")
+        self.assertLess(time.time() - start, 1)
+
+    def test_wait_for_event_timeout(self):
+        self.assertIsNone(self.monitor.wait_for_event("RESET", 0.1))
+
+    def test_job_tracker(self):
+        self.monitor.emit("JOB_STATUS_CHANGE", id="job0", status="created")
+        tracker = self.monitor.job_tracker
+        self.monitor.emit("JOB_STATUS_CHANGE", id="job0", status="running")
+        timer = threading.Timer(
+            0.2,
+            self.monitor.emit,
+            ("BLOCK_JOB_READY",),
+            {"device": "job0", "len": 10, "offset": 10, "speed": 0, "type": "mirror"},
+        )
+        timer.start()
+        job = self.monitor.wait_job("job0", "ready", 10)
+        timer.join()
+        self.assertEqual(job["history"], ["created", "running", "ready"])
+        self.assertEqual(tracker.get_progress("job0"), (10, 10))
+        # Events stay available to get_event() users
+        self.assertTrue(self.monitor.get_event("BLOCK_JOB_READY"))
+
+    def test_job_tracker_final_status(self):
+        tracker = self.monitor.job_tracker
+        self.monitor.emit(
+            "BLOCK_JOB_COMPLETED",
+            device="job1",
+            len=10,
+            offset=5,
+            speed=0,
+            type="stream",
+            error="Input/output error",
+        )
+        self.monitor.emit("JOB_STATUS_CHANGE", id="job1", status="null")
+        self.assertRaises(
+            qemu_monitor.MonitorError, tracker.wait_job, "job1", "ready", 10
+        )
+        self.assertEqual(tracker.get_job("job1")["error"], "Input/output error")
+
+    def test_job_tracker_reused_id(self):
+        tracker = self.monitor.job_tracker
+        for status in ("created", "running", "ready", "concluded", "null"):
+            self.monitor.emit("JOB_STATUS_CHANGE", id="job2", status=status)
+        self.assertEqual(tracker.wait_job("job2", "null", 1)["status"], "null")
+        # A new job with the same ID is not ready yet
+        self.monitor.emit("JOB_STATUS_CHANGE", id="job2", status="created")
+        self.monitor.emit("JOB_STATUS_CHANGE", id="job2", status="running")
+        self.assertRaises(
+            qemu_monitor.MonitorError, tracker.wait_job, "job2", "ready", 0.2
+        )
+        self.assertEqual(tracker.get_job("job2")["history"], ["created", "running"])
+
+    def test_cmd_many(self):
+        def qemu():
+            data = b""
+            while data.count(b"\n") < 3:
+                data += self.monitor.peer.recv(4096)
+            self.monitor.emit("RESET")
+            for cmd in reversed([json.loads(_) for _ in data.splitlines()]):
+                if cmd["execute"] == "bad":
+                    resp = {"error": {"class": "GenericError", "desc": "bad"}}
+                else:
+                    resp = {"return": cmd["execute"]}
+                resp["id"] = cmd["id"]
+                self.monitor.peer.sendall(json.dumps(resp).encode() + b"\n")
+
+        thread = threading.Thread(target=qemu)
+        thread.start()
+        out = self.monitor.cmd_many([("stop", None), ("bad", {}), ("cont", None)], 10)
+        thread.join()
+        self.assertEqual(out[0], "stop")
+        self.assertIsInstance(out[1], qemu_monitor.QMPCmdError)
+        self.assertEqual(out[2], "cont")
+        self.assertTrue(self.monitor.get_event("RESET"))
+
+
+class FakeQMPMonitor(object):
+    """Answers human-monitor-command with canned HMP output"""
+
+    name = "qmpmonitor1"
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.sent = []
+
+    def cmd(self, cmd, args=None, timeout=None, debug=True, fd=None):
+        self.sent.append((cmd, args["command-line"]))
+        out = self.outputs[args["command-line"]]
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+
+class MockQMPHumanMonitor(qemu_monitor.QMPHumanMonitor):
+    """QMPHumanMonitor not writing the monitor log file"""
+
+    def _log_lines(self, log_str):
+        pass
+
+
+class QMPHumanMonitorTests(unittest.TestCase):
+    def setUp(self):
+        self.qmp = FakeQMPMonitor(
+            {
+                "help": "info [subcommand] -- show info\nquit -- quit\n",
+                "info status": "VM status: running\n",
+                "info foo": "Error: unknown\n",
+                "bar": qemu_monitor.QMPCmdError("human-monitor-command", {}, {}),
+            }
+        )
+        self.monitor = MockQMPHumanMonitor(
+            qemu_monitor.VM("vm1"), "hmp1", {}, qmp_monitor=self.qmp
+        )
+
+    def test_cmd(self):
+        self.assertEqual(self.monitor.protocol, "human")
+        self.assertEqual(self.monitor._supported_cmds, ["info", "quit"])
+        self.assertEqual(self.monitor.info("status"), "VM status: running\n")
+        self.assertTrue(self.monitor.is_responsive())
+        self.assertIn(("human-monitor-command", "info status"), self.qmp.sent)
+
+    def test_cmd_error(self):
+        self.assertRaises(qemu_monitor.HumanCmdError, self.monitor.cmd, "info foo")
+        self.assertRaises(qemu_monitor.HumanCmdError, self.monitor.cmd, "bar")
+
+    def test_without_qmp_monitor(self):
+        monitor = MockQMPHumanMonitor(
+            qemu_monitor.VM("vm1"), "hmp1", {}, suppress_exceptions=True
+        )
+        self.assertFalse(monitor.is_responsive())
+
+
+class MonitorLogging(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.orig_log_dir = utils_logfile.get_log_file_dir()
+        utils_logfile.set_log_file_dir(self.log_dir)
+
+    def tearDown(self):
+        utils_logfile.set_log_file_dir(self.orig_log_dir)
+        shutil.rmtree(self.log_dir)
+
+    def test_log_writer(self):
+        writer = qemu_monitor.get_log_writer()
+        writer.write("mon.log", b'{"execute": "stop"}')
+        writer.write("mon.log", "line1\nline2")
+        writer.write("mon.log", ["line3"])
+        writer.close_file("mon.log")
+        # The data enqueued so far belongs to the current log directory
+        utils_logfile.set_log_file_dir(self.orig_log_dir)
+        qemu_monitor.flush_logs()
+        with open(os.path.join(self.log_dir, "mon.log")) as log:
+            lines = [_.split(": ", 1)[1] for _ in log.read().splitlines()]
+        self.assertEqual(lines, ['{"execute": "stop"}', "line1", "line2", "line3"])
+
+    def test_log_sampling(self):
+        monitor = MockMonitor()
+        monitor._log_sampling = qemu_monitor.parse_log_sampling(
+            "query-status:0 query-jobs:3"
+        )
+        monitor._log_counts = {}
+        self.assertFalse(monitor._log_sampled("query-status"))
+        sampled = [monitor._log_sampled("query-jobs") for _ in range(6)]
+        self.assertEqual(sampled, [True, False, False, True, False, False])
+        self.assertTrue(monitor._log_sampled("query-block"))
+        self.assertFalse(monitor._log_sampled("query-block", debug=False))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -19,7 +19,7 @@ if os.path.isdir(os.path.join(basedir, "virttest")):
 import six
 from six.moves import xrange
 
-from virttest import qemu_qtree
+from virttest import qemu_monitor, qemu_qtree
 from virttest.unittest_utils import mock
 
 OFFSET_PER_LEVEL = qemu_qtree.OFFSET_PER_LEVEL
@@ -188,6 +188,146 @@ params = ParamsDict(
     }
 )
 
+# QOM composition tree equivalent to dev_ide_disk + dev_usb_disk, it maps
+# path to ([(property, type), ...], {property: value})
+_BUS = [("type", "string"), ("realized", "bool"), ("hotplug-handler", "link<x>")]
+_DEV = [("type", "string"), ("realized", "bool"), ("parent_bus", "link<bus>")]
+qom_tree = {
+    "/machine": (
+        [
+            ("type", "string"),
+            ("unattached", "child<container>"),
+            ("peripheral", "child<container>"),
+            ("peripheral-anon", "child<container>"),
+            ("pc.ram", "child<qemu:memory-region>"),
+        ],
+        {},
+    ),
+    "/machine/unattached": (
+        [
+            ("sysbus", "child<System>"),
+            ("device[0]", "child<i440FX-pcihost>"),
+            ("device[1]", "child<piix3-ide>"),
+            ("device[2]", "child<qemu64-x86_64-cpu>"),
+        ],
+        {},
+    ),
+    "/machine/peripheral": ([("usb1", "child<ich9-usb-uhci1>")], {}),
+    "/machine/peripheral-anon": (
+        [("device[0]", "child<ide-hd>"), ("device[1]", "child<usb-storage>")],
+        {},
+    ),
+    "/machine/unattached/sysbus": (_BUS, {}),
+    "/machine/unattached/device[0]": (
+        _DEV + [("pci.0", "child<PCI>")],
+        {"parent_bus": "/machine/unattached/sysbus"},
+    ),
+    "/machine/unattached/device[0]/pci.0": (_BUS, {}),
+    "/machine/unattached/device[1]": (
+        _DEV
+        + [
+            ("addr", "int32"),
+            ("romfile", "str"),
+            ("multifunction", "bool"),
+            ("ide.0", "child<IDE>"),
+        ],
+        {
+            "parent_bus": "/machine/unattached/device[0]/pci.0",
+            "addr": 9,
+            "romfile": "",
+            "multifunction": False,
+        },
+    ),
+    "/machine/unattached/device[1]/ide.0": (_BUS, {}),
+    "/machine/unattached/device[2]": (_DEV, {"parent_bus": ""}),
+    "/machine/peripheral-anon/device[0]": (
+        _DEV + [("drive", "str"), ("unit", "uint32"), ("ver", "str")],
+        {
+            "parent_bus": "/machine/unattached/device[1]/ide.0",
+            "drive": "ide0-hd0",
+            "unit": 0,
+            "ver": "1.0.50",
+        },
+    ),
+    "/machine/peripheral/usb1": (
+        _DEV + [("addr", "int32"), ("usb1.0", "child<usb-bus>")],
+        {"parent_bus": "/machine/unattached/device[0]/pci.0", "addr": 32},
+    ),
+    "/machine/peripheral/usb1/usb1.0": (_BUS, {}),
+    "/machine/peripheral-anon/device[1]": (
+        _DEV + [("drive", "str"), ("scsi.0", "child<SCSI>")],
+        {"parent_bus": "/machine/peripheral/usb1/usb1.0", "drive": ""},
+    ),
+    "/machine/peripheral-anon/device[1]/scsi.0": (
+        _BUS + [("device[0]", "child<scsi-disk>")],
+        {},
+    ),
+    "/machine/peripheral-anon/device[1]/scsi.0/device[0]": (
+        _DEV
+        + [
+            ("drive", "str"),
+            ("channel", "uint32"),
+            ("scsi-id", "uint32"),
+            ("lun", "uint32"),
+        ],
+        {
+            "parent_bus": "/machine/peripheral-anon/device[1]/scsi.0",
+            "drive": "usb2.6",
+            "channel": 0,
+            "scsi-id": 0,
+            "lun": 0,
+        },
+    ),
+}
+
+query_block = [
+    {
+        "device": "ide0-hd0",
+        "removable": False,
+        "inserted": {
+            "node-name": "#block135",
+            "file": "/tmp/vl.UWzrkU",
+            "backing_file": "/dummy/directory/f16-64.qcow2",
+            "ro": True,
+            "drv": "qcow2",
+        },
+    },
+    {
+        "device": "usb2.6",
+        "removable": False,
+        "inserted": {
+            "node-name": "#block317",
+            "file": "/tmp/stg4.qcow2",
+            "ro": False,
+            "drv": "qcow2",
+        },
+    },
+    {"device": "ide1-cd0", "removable": True},
+]
+
+
+class FakeQMPMonitor(object):
+    """Answers the qom-list/qom-get/query-block commands from qom_tree"""
+
+    def __init__(self):
+        self.batches = []
+
+    def _cmd(self, cmd, args):
+        if cmd == "query-block":
+            return query_block
+        if cmd == "query-named-block-nodes":
+            return [_["inserted"] for _ in query_block if "inserted" in _]
+        if args["path"] not in qom_tree:
+            return qemu_monitor.QMPCmdError(cmd, args, "not found")
+        props, values = qom_tree[args["path"]]
+        if cmd == "qom-list":
+            return [{"name": name, "type": _type} for name, _type in props]
+        return values[args["property"]]
+
+    def cmd_many(self, cmds, timeout=None, debug=True):
+        self.batches.append(cmds)
+        return [self._cmd(cmd, args) for cmd, args in cmds]
+
 
 class QtreeContainerTest(unittest.TestCase):
     """QtreeContainer tests"""
@@ -249,6 +389,46 @@ class QtreeContainerTest(unittest.TestCase):
             "str(qtree) returns nonstring output.",
         )
 
+    def test_qom_tree(self):
+        """qtree built from QOM matches the info qtree one"""
+        reference_nodes = [
+            qemu_qtree.QtreeDisk,
+            qemu_qtree.QtreeBus,
+            qemu_qtree.QtreeDev,
+            qemu_qtree.QtreeDisk,
+            qemu_qtree.QtreeBus,
+            qemu_qtree.QtreeDev,
+            qemu_qtree.QtreeBus,
+            qemu_qtree.QtreeDev,
+            qemu_qtree.QtreeBus,
+            qemu_qtree.QtreeDev,
+            qemu_qtree.QtreeBus,
+        ]
+        monitor = FakeQMPMonitor()
+        qtree = qemu_qtree.QtreeContainer()
+        qtree.parse_qom_tree(monitor)
+        nodes = qtree.get_nodes()
+        self.assertEqual([type(_) for _ in nodes], reference_nodes)
+        # One batch per QOM tree level and one for all the properties
+        self.assertEqual(len(monitor.batches), 6)
+        for batch in monitor.batches:
+            for _, args in batch:
+                self.assertNotIn("pc.ram", args["path"])
+        self.assertEqual(
+            nodes[-1].get_qtree(), {"id": "main-system-bus", "type": "System"}
+        )
+        ide = nodes[2].get_qtree()
+        self.assertEqual(ide["type"], "piix3-ide")
+        self.assertEqual(ide["addr"], "01.1")
+        self.assertEqual(ide["romfile"], "<null>")
+        self.assertEqual(ide["multifunction"], "off")
+        self.assertEqual(nodes[1].get_qtree()["id"], "ide.0")
+        self.assertEqual(nodes[0].get_qname(), "ide0-hd0")
+        self.assertEqual(nodes[3].get_qtree()["type"], "usb2")
+        self.assertEqual(nodes[7].get_qtree()["id"], "usb1")
+        self.assertEqual(nodes[7].get_qtree()["addr"], "04.0")
+        self.assertNotIn("id", nodes[5].get_qtree())
+
     def test_bad_qtree(self):
         """Incorrect qtree"""
         qtree = qemu_qtree.QtreeContainer()
@@ -325,6 +505,17 @@ Host: scsi1 Channel: 00 Id: 00 Lun: 00
         self.assertEqual(disks.check_disk_params(_params), 4)
         self.assertEqual(disks.check_guests_proc_scsi(_guest_proc_scsi), (0, 1, 1, 0))
 
+    def test_check_params_qmp(self):
+        """Correct workflow with qtree and block info from QMP"""
+        qtree = qemu_qtree.QtreeContainer()
+        qtree.parse_qom_tree(FakeQMPMonitor())
+        disks = qemu_qtree.QtreeDisksContainer(qtree.get_nodes())
+        self.assertEqual(len(disks.disks), self.no_disks)
+        self.assertEqual(disks.parse_query_block(FakeQMPMonitor()), (0, 0))
+        self.assertEqual(disks.generate_params(), 0)
+        self.assertEqual(disks.check_disk_params(params), 2)
+        self.assertEqual(disks.check_guests_proc_scsi(guest_proc_scsi), (0, 0, 1, 0))
+
 
 class KvmQtreeClassTest(unittest.TestCase):
     """Additional tests for qemu_qtree classes"""
@@ -0,0 +1,614 @@
+#!/usr/bin/python
+"""
+Unittests and benchmarks of the qemu_vm module.
+"""
+
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from avocado.utils import process
+
+from virttest import ip_sniffing, qemu_vm, qemu_vm_template, utils_params
+from virttest.qemu_devices import qcontainer, qdevices
+from virttest.unittest_utils import mock
+
+UNITTEST_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "unittest_data"
+)
+
+
+def _read_data(name):
+    with open(os.path.join(UNITTEST_DATA_DIR, name)) as data:
+        return data.read()
+
+
+# qemu-1.5.0 outputs used by the DevContainer probe
+QEMU_HMP = _read_data("qemu-1.5.0__hmp_help")
+QEMU_QMP = _read_data("qemu-1.5.0__qmp_help")
+QEMU_HELP = _read_data("qemu-1.5.0__help")
+QEMU_DEVICES = _read_data("qemu-1.5.0__devices_help")
+QEMU_MACHINE = _read_data("qemu-1.5.0__machine_help")
+
+
+def create_params(qemu_binary, disks=1, nics=1, numa_nodes=0):
+    """
+    Synthetic VM params
+
+    :param qemu_binary: path to the (fake) qemu binary
+    :param disks: number of scsi-hd disks
+    :param nics: number of virtio nics, 16 of them fit into pci.0
+    :param numa_nodes: number of guest NUMA nodes
+    """
+    params = {
+        "qemu_binary": qemu_binary,
+        "vm_type": "qemu",
+        "vms": "vm1",
+        "main_vm": "vm1",
+        "machine_type": "pc",
+        "mem": "1024",
+        "smp": "2",
+        "vga": "none",
+        "display": "none",
+        "images": " ".join("image%d" % i for i in range(disks)),
+        "image_format": "qcow2",
+        "drive_format": "scsi-hd",
+        "nics": " ".join("nic%d" % i for i in range(nics)),
+        "nic_model": "virtio",
+        "nettype": "user",
+        "netdst": "virbr0",
+        "pci_assignable": "no",
+    }
+    for i in range(disks):
+        params["image_name_image%d" % i] = "/tmp/image%d" % i
+    for i in range(nics):
+        params["mac_nic%d" % i] = "9a:00:00:00:%02x:%02x" % (i // 256, i % 256)
+    if nics > 16:
+        params["pci_controllers"] = "pci_bridge1"
+        params["type_pci_bridge1"] = "pci-bridge"
+        for i in range(16, nics):
+            params["nic_pci_bus_nic%d" % i] = "pci_bridge1"
+    if numa_nodes:
+        nodes = ["node%d" % i for i in range(numa_nodes)]
+        params["guest_numa_nodes"] = " ".join(nodes)
+    return utils_params.Params(params)
+
+
+class FakeQemuTestCase(unittest.TestCase):
+    """Create the VMs using the qemu-1.5.0 probe outputs"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_create_command")
+        self.qemu_binary = os.path.join(self.tmpdir, "qemu-kvm")
+        shutil.copy("/bin/true", self.qemu_binary)
+        self.god = mock.mock_god(ut=self)
+        self.god.stub_with(qcontainer.utils_qemu, "CAPS_CACHE_ENABLED", False)
+        self.god.stub_with(qcontainer.process, "run", self._run_qemu)
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def _run_qemu(cmd, *args, **kwargs):
+        """Pretend to run the qemu-1.5.0 probes"""
+        if "help\nquit" in cmd:
+            output = QEMU_HMP
+        elif "-vnc none" in cmd and "RAND91" in cmd:
+            output = QEMU_QMP
+        elif cmd.endswith(" -help 2>&1"):
+            output = QEMU_HELP
+        elif "-device \\?" in cmd:
+            output = QEMU_DEVICES
+        elif cmd.endswith("-machine help"):
+            output = QEMU_MACHINE
+        elif cmd.endswith("-version"):
+            output = "QEMU emulator version 1.5.0"
+        else:
+            output = ""
+        return process.CmdResult(cmd, output.encode(), b"", 0)
+
+
+class MakeCreateCommandBenchmark(FakeQemuTestCase):
+    """Measure make_create_command"""
+
+    def _create(self, repeat=3, **kwargs):
+        """:return: (best time of make_create_command, the command line)"""
+        params = create_params(self.qemu_binary, **kwargs)
+        best = None
+        for _ in range(repeat):
+            vm = qemu_vm.VM("vm1", params.copy(), self.tmpdir, {})
+            start = time.time()
+            devices = vm.make_create_command()[0]
+            duration = time.time() - start
+            if best is None or duration < best:
+                best = duration
+        return best, devices.cmdline()
+
+    def test_disks(self):
+        """Creation time grows linearly with the number of disks"""
+        times = {}
+        for disks in (1, 50, 500):
+            times[disks], cmdline = self._create(disks=disks)
+            self.assertEqual(cmdline.count("-device scsi-hd,"), disks)
+        # quadratic growth takes more than 30x longer for 10x more disks
+        self.assertLess(
+            times[500],
+            times[50] * 20,
+            "make_create_command took %s (disks: seconds)" % times,
+        )
+
+    def test_nics_numa(self):
+        """32 nics and 16 NUMA nodes together with disks"""
+        times = {}
+        for disks in (1, 50, 500):
+            times[disks], cmdline = self._create(disks=disks, nics=32, numa_nodes=16)
+            self.assertEqual(cmdline.count("-device scsi-hd,"), disks)
+            self.assertEqual(cmdline.count("-device virtio-net-pci,"), 32)
+            self.assertEqual(cmdline.count("-numa node"), 16)
+        self.assertLess(
+            times[500],
+            times[50] * 20,
+            "make_create_command took %s (disks: seconds)" % times,
+        )
+
+
+class VMTemplateTest(FakeQemuTestCase):
+    """Fingerprints of the VM templates"""
+
+    def create_template(self, **extra):
+        params = create_params(self.qemu_binary, disks=2, nics=2)
+        params["vm_templates_dir"] = os.path.join(self.tmpdir, "templates")
+        for i in range(2):
+            image = os.path.join(self.tmpdir, "image%d" % i)
+            if not os.path.exists(image + ".qcow2"):
+                open(image + ".qcow2", "w").close()
+            params["image_name_image%d" % i] = image
+        params.update(extra)
+        vm = qemu_vm.VM("vm1", params, self.tmpdir, {})
+        return qemu_vm_template.VMTemplate(vm, params)
+
+    def save_metadata(self, template, macs):
+        os.makedirs(template.template_dir)
+        open(template.state_file, "w").close()
+        with open(template.metadata_file, "w") as metadata_file:
+            json.dump(
+                {"cmdline": template.cmdline, "images": template.images, "macs": macs},
+                metadata_file,
+            )
+
+    def test_normalize_cmdline(self):
+        self.assertEqual(
+            qemu_vm_template.normalize_cmdline(
+                "qemu -chardev socket,server=on,path=/tmp/avocado_x/mon,id=m1  "
+                "-device virtio-net-pci,mac=9a:00:00:00:00:01,id=idAbCdEf,"
+                "netdev=idGhIjKl,bus=pci.0,addr=0x5 -netdev user,id=idGhIjKl,"
+                "hostfwd=tcp::5000-:22 -vnc :1 -m 1024"
+            ),
+            "qemu -chardev socket,server=on,path=*,id=* -device virtio-net-pci,"
+            "mac=*,id=*,netdev=*,bus=pci.0,addr=0x5 -netdev user,id=*,hostfwd=* "
+            "-vnc * -m 1024",
+        )
+
+    def test_fingerprint(self):
+        template = self.create_template()
+        self.assertTrue(template.is_usable())
+        # Another instance of the same configuration, nic ids differ
+        other = self.create_template()
+        self.assertTrue(other.is_usable())
+        self.assertEqual(template.template_dir, other.template_dir)
+        different = self.create_template(mem="2048")
+        self.assertTrue(different.is_usable())
+        self.assertNotEqual(template.template_dir, different.template_dir)
+
+    def test_not_usable(self):
+        template = self.create_template(enable_nbd_image1="yes")
+        self.assertFalse(template.is_usable())
+        template = self.create_template(image_name_image1="/nonexisting/image")
+        self.assertFalse(template.is_usable())
+
+    def test_saved(self):
+        template = self.create_template()
+        self.assertTrue(template.is_usable())
+        self.assertFalse(template.is_saved())
+        macs = {"nic0": "9a:00:00:00:00:00", "nic1": "9a:00:00:00:00:01"}
+        self.save_metadata(template, macs)
+        template = self.create_template()
+        self.assertTrue(template.is_usable())
+        self.assertTrue(template.is_saved())
+        self.assertEqual(template.get_mac_address("nic1"), "9a:00:00:00:00:01")
+        self.assertRaises(
+            qemu_vm.virt_vm.VMMACAddressMissingError,
+            template.get_mac_address,
+            "nic2",
+        )
+        # The image was replaced after the template was saved
+        with open(os.path.join(self.tmpdir, "image1.qcow2"), "w") as image:
+            image.write("changed")
+        template = self.create_template()
+        self.assertTrue(template.is_usable())
+        self.assertFalse(template.is_saved())
+
+    def test_device_config_differs(self):
+        template = self.create_template()
+        self.assertTrue(template.is_usable())
+        self.save_metadata(template, {})
+        # Same fingerprint but different devices must not be restored
+        template.cmdline += " -device virtio-balloon-pci"
+        self.assertFalse(template.is_saved())
+
+
+class FakeChardevMonitor(object):
+    """Monitor whose chardevs get a client on the $connect_after query"""
+
+    name = "qmp1"
+
+    def __init__(self, paths, connect_after, human=False):
+        self.paths = paths
+        self.connect_after = connect_after
+        self.human = human
+        self.queries = 0
+
+    def info(self, what, debug=True):
+        self.queries += 1
+        prefix = "disconnected:" if self.queries < self.connect_after else ""
+        chardevs = [
+            {"label": "c%d" % i, "filename": "%sunix:%s,server=on" % (prefix, path)}
+            for i, path in enumerate(self.paths)
+        ]
+        if self.human:
+            return "\n".join("%(label)s: filename=%(filename)s" % _ for _ in chardevs)
+        return chardevs
+
+
+class ReadinessTest(unittest.TestCase):
+    """Wait for the VM readiness signals"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_readiness")
+        self.god = mock.mock_god(ut=self)
+        self.god.stub_with(
+            qemu_vm.virt_vm.utils_net,
+            "verify_ip_address_ownership",
+            lambda *args, **kwargs: True,
+        )
+        params = utils_params.Params(
+            {
+                "vm_type": "qemu",
+                "nics": "nic1",
+                "nettype": "bridge",
+                "netdst": "virbr0",
+                "mac_nic1": "9a:00:00:00:00:01",
+            }
+        )
+        self.address_cache = ip_sniffing.AddrCache()
+        self.vm = qemu_vm.VM("vm1", params, self.tmpdir, self.address_cache)
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.tmpdir)
+
+    def test_io_channels(self):
+        self.vm.logs = {"seabios": os.path.join(self.tmpdir, "seabios")}
+        for human in (False, True):
+            monitor = FakeChardevMonitor(list(self.vm.logs.values()), 3, human)
+            self.vm.monitors = [monitor]
+            start = time.time()
+            self.vm._wait_for_io_channels(5)
+            self.assertLess(time.time() - start, 2)
+            self.assertEqual(monitor.queries, 3)
+
+    def test_address(self):
+        timer = threading.Timer(
+            0.5, self.address_cache.__setitem__, ("9a:00:00:00:00:01", "10.0.0.2")
+        )
+        timer.start()
+        start = time.time()
+        ready = self.vm.wait_until_ready(["address"], timeout=30)
+        timer.join()
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(list(ready), ["address"])
+        self.assertRaises(ValueError, self.vm.wait_until_ready, ["unknown"], 1)
+
+    def test_serial(self):
+        self.assertRaises(
+            qemu_vm.virt_vm.VMNotReadyError, self.vm.wait_until_ready, ["serial"], 1
+        )
+
+    def test_login_no_address(self):
+        def _wait_for_login(nic_index=0, timeout=None):
+            raise qemu_vm.virt_vm.VMIPAddressMissingError("9a:00:00:00:00:01")
+
+        self.vm.wait_for_login = _wait_for_login
+        self.assertRaises(
+            qemu_vm.virt_vm.VMNotReadyError, self.vm.wait_until_ready, ["login"], 1
+        )
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def is_responsive(self):
+        return self.alive
+
+    def close(self):
+        self.alive = False
+
+
+class SSHConnectionsTest(unittest.TestCase):
+    """Idle session pool and ssh multiplexing"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_ssh")
+        self.vm = qemu_vm.VM(
+            "vm1",
+            utils_params.Params({"vm_type": "qemu", "vm_session_pool_size": "1"}),
+            self.tmpdir,
+            {},
+        )
+        self.logins = []
+        self.vm.wait_for_login = self._login
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _login(self, nic_index=0, timeout=None):
+        self.logins.append(FakeSession())
+        return self.logins[-1]
+
+    def test_borrow_session(self):
+        with self.vm.borrow_session() as other:
+            with self.vm.borrow_session() as session:
+                self.assertIsNot(session, other)
+        # Only the first returned one is kept
+        self.assertTrue(session.alive)
+        self.assertFalse(other.alive)
+        with self.vm.borrow_session() as again:
+            self.assertIs(again, session)
+        # Dead idle sessions are dropped, failed ones aren't kept
+        session.alive = False
+        try:
+            with self.vm.borrow_session() as failed:
+                self.assertIsNot(failed, session)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertFalse(failed.alive)
+        self.assertEqual(len(self.logins), 3)
+        with self.vm.borrow_session() as last:
+            pass
+        self.vm.close_ssh_connections()
+        self.assertFalse(last.alive)
+        self.assertEqual(self.vm.idle_sessions, {})
+
+    def test_control_path(self):
+        self.assertIsNone(self.vm._get_ssh_control_path("10.0.0.2", 22, "root"))
+        self.vm.params["ssh_control_master"] = "yes"
+        path = self.vm._get_ssh_control_path("10.0.0.2", 22, "root")
+        self.assertEqual(path, self.vm._get_ssh_control_path("10.0.0.2", 22, "root"))
+        self.assertNotEqual(path, self.vm._get_ssh_control_path("10.0.0.3", 22, "root"))
+        self.assertLess(len(path), 100)
+        open(path, "w").close()
+        self.vm.close_ssh_connections()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.vm.ssh_control_paths, set())
+
+
+class OutputWatcherTest(unittest.TestCase):
+    """Scan the qemu output for failures line by line"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_output")
+        self.vm = qemu_vm.VM(
+            "vm1", utils_params.Params({"vm_type": "qemu"}), self.tmpdir, {}
+        )
+
+    def tearDown(self):
+        if self.vm.process is not None:
+            self.vm.process.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches(self):
+        watcher = qemu_vm.QemuOutputWatcher(max_lines=3)
+        for i in range(5):
+            watcher("line %d" % i)
+        watcher("error: kvm internal error. Suberror: 1")
+        watcher("emulation failure")
+        watcher("Aborted (core dumped)")
+        watcher("KVM internal error. Suberror: 2")
+        self.assertEqual(watcher.line_count, 9)
+        self.assertEqual(
+            watcher.get_output(),
+            "emulation failure\nAborted (core dumped)\nKVM internal error. Suberror: 2",
+        )
+        self.assertEqual(watcher.matches["kvm_internal"][:2], (6, 7))
+        self.assertEqual(
+            watcher.get_output_since("kvm_internal"),
+            "kvm internal error. Suberror: 1\n" + watcher.get_output(),
+        )
+        self.assertIsNone(watcher.get_output_since("hugepage"))
+        self.assertFalse(watcher.has_create_failure())
+        watcher("qemu: alloc_mem_area: can't mmap hugetlbfs pages")
+        self.assertTrue(watcher.has_create_failure())
+        other = pickle.loads(pickle.dumps(watcher))
+        self.assertEqual(other.matches, watcher.matches)
+        self.assertEqual(other.lines.maxlen, 3)
+
+    def test_create_error(self):
+        self.vm.process = qemu_vm.aexpect.run_tail(
+            "echo booting; echo 'Could not initialize KVM, will disable'; exit 1",
+            None,
+            qemu_vm.QemuOutputWatcher("[qemu output] "),
+            "",
+            auto_close=False,
+        )
+        self.assertTrue(
+            qemu_vm.utils_misc.wait_for(lambda: not self.vm.process.is_alive(), 10)
+        )
+        e = self.vm._get_create_error("qemu")
+        self.assertIsInstance(e, qemu_vm.virt_vm.VMKVMInitError)
+        self.assertIn("Could not initialize KVM", str(e))
+        # No crash was seen
+        self.vm.verify_userspace_crash()
+        self.vm.verify_kvm_internal_error()
+
+    def test_monitor_wait_aborted(self):
+        self.vm.process = qemu_vm.aexpect.run_tail(
+            "echo 'qemu: unknown migration protocol: foo'; sleep 60",
+            None,
+            qemu_vm.QemuOutputWatcher(),
+            "",
+            auto_close=False,
+        )
+        m_params = utils_params.Params(
+            {
+                "monitor_type": "qmp",
+                "monitor_filename": os.path.join(self.tmpdir, "qmp.sock"),
+            }
+        )
+        start = time.time()
+        self.assertRaises(
+            qemu_vm.qemu_monitor.MonitorConnectError,
+            qemu_vm.qemu_monitor.wait_for_create_monitor,
+            self.vm,
+            "qmp1",
+            m_params,
+            30,
+        )
+        self.assertLess(time.time() - start, 10)
+        e = self.vm._get_create_error("qemu", "unix")
+        self.assertIsInstance(e, qemu_vm.VMMigrateProtoUnsupportedError)
+
+
+class FakeDest(object):
+    def __init__(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def destroy(self, gracefully=True, free_mac_addresses=True):
+        self.alive = False
+
+
+class PrespawnedDestTest(unittest.TestCase):
+    """Reuse the destination VM started by the previous migration"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_prespawn")
+        params = utils_params.Params(
+            {"vm_type": "qemu", "migration_prespawn_dest": "yes"}
+        )
+        self.vm = qemu_vm.VM("vm1", params, self.tmpdir, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def prespawn(self, protocol="tcp"):
+        dest = FakeDest()
+        params = self.vm._get_migration_dest_params()
+        self.vm.prespawned_dest = (protocol, params, dest)
+        return dest
+
+    def test_take(self):
+        dest = self.prespawn()
+        self.assertIs(self.vm._take_prespawned_dest("tcp"), dest)
+        self.assertTrue(dest.alive)
+        self.assertIsNone(self.vm.prespawned_dest)
+        self.assertIsNone(self.vm._take_prespawned_dest("tcp"))
+
+    def test_outdated(self):
+        dest = self.prespawn("unix")
+        self.assertIsNone(self.vm._take_prespawned_dest("tcp"))
+        self.assertFalse(dest.alive)
+        dest = self.prespawn()
+        self.vm.params["mem"] = "4096"
+        self.assertIsNone(self.vm._take_prespawned_dest("tcp"))
+        self.assertFalse(dest.alive)
+        dest = self.prespawn()
+        dest.alive = False
+        self.assertIsNone(self.vm._take_prespawned_dest("tcp"))
+
+    def test_destroy(self):
+        dest = self.prespawn()
+        self.vm._destroy_prespawned_dest()
+        self.assertFalse(dest.alive)
+        self.assertIsNone(self.vm.prespawned_dest)
+        # VMs pickled before don't know the attribute
+        del self.vm.prespawned_dest
+        self.vm._destroy_prespawned_dest()
+        self.assertIsNone(self.vm._take_prespawned_dest("tcp"))
+
+
+class FailingDaemon(qdevices.QDaemonDev):
+    """Daemon which fails to start"""
+
+    __slots__ = ()
+
+    def start_daemon(self):
+        raise qemu_vm.DeviceError("Failed to run %s daemon" % self.get_aid())
+
+
+class DaemonsTest(unittest.TestCase):
+    """Start and stop the daemons of qemu devices"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_daemons")
+        self.vm = qemu_vm.VM(
+            "vm1", utils_params.Params({"vm_type": "qemu"}), self.tmpdir, {}
+        )
+
+    def tearDown(self):
+        self.vm._stop_daemons()
+        shutil.rmtree(self.tmpdir)
+
+    def create_daemon(self, index, delay):
+        """:return: daemon creating its socket after $delay seconds"""
+        sock_path = os.path.join(self.tmpdir, "daemon%d.sock" % index)
+        daemon = qdevices.QDaemonDev("daemon", "obj%d" % index)
+        daemon.set_param("sock_path", sock_path)
+        daemon.set_param("cmd", "sleep %s; touch %s; sleep 60" % (delay, sock_path))
+        daemon.set_param("start_until_timeout", 10)
+        daemon.set_param("stop_timeout", 0.5)
+        return daemon
+
+    def test_concurrent(self):
+        self.vm.devices = [self.create_daemon(i, 1) for i in range(4)]
+        start = time.time()
+        self.vm._start_daemons()
+        duration = time.time() - start
+        for daemon in self.vm.devices:
+            self.assertTrue(daemon.is_daemon_alive())
+            self.assertTrue(os.path.exists(daemon.get_param("sock_path")))
+        # All of them are ready at once, not after the 10s timeout
+        self.assertLess(duration, 3.5)
+        start = time.time()
+        self.vm._stop_daemons()
+        self.assertLess(time.time() - start, 1.5)
+        for daemon in self.vm.devices:
+            self.assertIsNone(daemon.daemon_process)
+
+    def test_failure(self):
+        self.vm.devices = [self.create_daemon(0, 0), FailingDaemon("daemon", "obj1")]
+        self.assertRaises(qemu_vm.DeviceError, self.vm._start_daemons)
+        # The started daemon is stopped again
+        self.assertIsNone(self.vm.devices[0].daemon_process)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from virttest import qemu_vm_pool, qemu_vm_template, utils_params
+from virttest.unittest_utils import mock
+
+
+class FakeDevices(object):
+    def __init__(self, cmdline):
+        self._cmdline = cmdline
+
+    def cmdline(self):
+        return self._cmdline
+
+
+class FakeSession(object):
+    def close(self):
+        pass
+
+
+class FakeMonitor(object):
+    def __init__(self, calls):
+        self.resets = 0
+        self.calls = calls
+        self.snapshots = []
+        self.savevm_error = None
+
+    def system_reset(self):
+        self.resets += 1
+
+    def human_monitor_cmd(self, cmd):
+        if cmd == "info snapshots":
+            return "\n".join(self.snapshots)
+        self.calls.append(cmd)
+        if self.savevm_error:
+            return self.savevm_error
+        self.snapshots.append(cmd.split()[1])
+        return ""
+
+
+class FakeVM(object):
+    """VM whose qemu command line only depends on its "mem" param"""
+
+    def __init__(self, name, mem="1024"):
+        self.name = name
+        self.params = utils_params.Params({"mem": mem})
+        self.alive = True
+        self.calls = []
+        self.monitor = FakeMonitor(self.calls)
+        self.instance = "%s-%s" % (name, id(self))
+        self.pool_overlays = {"image_format_image1": "qcow2"}
+
+    def make_create_command(self, name=None, params=None, root_dir=None):
+        params = params or self.params
+        return (
+            FakeDevices("qemu -m %s -pidfile /tmp/%s" % (params["mem"], id(self))),
+            None,
+        )
+
+    def needs_restart(self, name, params, basedir):
+        return self.params.get("needs_restart") == "yes"
+
+    def is_alive(self):
+        return self.alive
+
+    def get_pid(self):
+        return id(self)
+
+    def destroy(self, gracefully=True, free_mac_addresses=True):
+        self.alive = False
+
+    def pause(self):
+        self.calls.append("pause")
+
+    def resume(self):
+        self.calls.append("resume")
+
+    def wait_for_login(self, timeout):
+        self.calls.append("login")
+        return FakeSession()
+
+    def loadvm(self, tag):
+        self.calls.append("loadvm %s" % tag)
+
+
+class VMPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.params = utils_params.Params({"vm_pool": "yes", "vm_pool_size": "3"})
+
+    def take(self, pool, mem="1024"):
+        self.params["mem"] = mem
+        return pool.take(FakeVM("vm1", mem), "vm1", self.params, None)
+
+    def test_get(self):
+        env = {}
+        pool = qemu_vm_pool.VMPool.get(env)
+        self.assertIs(env["vm_pool"], pool)
+        self.assertIs(qemu_vm_pool.VMPool.get(env), pool)
+
+    def test_take(self):
+        self.params["vm_pool_reset"] = "system_reset"
+        pool = qemu_vm_pool.VMPool()
+        self.assertIsNone(self.take(pool))
+        vm = FakeVM("vm1")
+        self.assertTrue(pool.put(vm, self.params))
+        self.assertIsNone(self.take(pool, mem="2048"))
+        self.assertIs(self.take(pool), vm)
+        self.assertEqual(vm.monitor.resets, 1)
+        # The params of the test using the overlays of the VM
+        self.assertEqual(vm.params["mem"], "1024")
+        self.assertEqual(vm.params["image_format_image1"], "qcow2")
+        self.assertEqual(len(pool), 0)
+
+    def test_not_reused(self):
+        pool = qemu_vm_pool.VMPool()
+        dead = FakeVM("vm1")
+        dead.alive = False
+        self.assertFalse(pool.put(dead, self.params))
+        # Not running on pool overlays
+        vm = FakeVM("vm1")
+        vm.pool_overlays = None
+        self.assertFalse(pool.put(vm, self.params))
+        self.assertFalse(vm.alive)
+        vm = FakeVM("vm1")
+        pool.put(vm, self.params)
+        vm.alive = False
+        self.assertIsNone(self.take(pool))
+        self.assertEqual(len(pool), 0)
+        # Same command line but needs_restart() disagrees
+        vm = FakeVM("vm1")
+        vm.params["needs_restart"] = "yes"
+        pool.put(vm, self.params)
+        self.assertIsNone(self.take(pool))
+        self.assertEqual(len(pool), 1)
+
+    def test_lru(self):
+        pool = qemu_vm_pool.VMPool()
+        vms = [FakeVM("vm%d" % i, str(1024 * (i + 1))) for i in range(4)]
+        for vm in vms[:3]:
+            pool.put(vm, self.params)
+        # vm0 is used again, vm1 is the least recently used now
+        pool.put(self.take(pool, "1024"), self.params)
+        pool.put(vms[3], self.params)
+        self.assertEqual([_.alive for _ in vms], [True, False, True, True])
+        self.assertEqual([_[1] for _ in pool.entries], [vms[2], vms[0], vms[3]])
+
+    def test_mem_budget(self):
+        pool = qemu_vm_pool.VMPool()
+        self.params["vm_pool_mem_budget"] = "3072"
+        vms = [FakeVM("vm%d" % i, mem) for i, mem in enumerate(("1024", "2048"))]
+        for vm in vms:
+            pool.put(vm, self.params)
+        self.assertEqual(len(pool), 2)
+        vm = FakeVM("vm2", "1024")
+        pool.put(vm, self.params)
+        self.assertEqual([_[1] for _ in pool.entries], [vms[1], vm])
+        self.assertFalse(vms[0].alive)
+        pool.destroy()
+        self.assertEqual(len(pool), 0)
+        self.assertFalse(vm.alive)
+
+    def test_loadvm(self):
+        pool = qemu_vm_pool.VMPool()
+        vm = FakeVM("vm1")
+        qemu_vm_pool.prepare_vm(vm, self.params)
+        pool.put(vm, self.params)
+        self.assertIs(self.take(pool), vm)
+        # Saved once the guest was ready, without resetting it
+        self.assertEqual(
+            vm.calls,
+            [
+                "login",
+                "pause",
+                "savevm vm_pool",
+                "resume",
+                "pause",
+                "loadvm vm_pool",
+                "resume",
+            ],
+        )
+        self.assertEqual(vm.monitor.resets, 0)
+
+    def test_savevm_failure(self):
+        vm = FakeVM("vm1")
+        vm.monitor.savevm_error = (
+            "Error: Device 'pflash1' is writable but does not support snapshots"
+        )
+        qemu_vm_pool.prepare_vm(vm, self.params)
+        self.assertEqual(vm.calls, ["login", "pause", "savevm vm_pool", "resume"])
+        # The VM runs unpooled
+        self.assertIsNone(vm.pool_overlays)
+        pool = qemu_vm_pool.VMPool()
+        self.assertFalse(pool.put(vm, self.params))
+        # The guest never ran
+        vm = FakeVM("vm1")
+        self.params["paused_after_start_vm"] = "yes"
+        qemu_vm_pool.prepare_vm(vm, self.params)
+        self.assertEqual(vm.calls, [])
+        self.assertIsNone(vm.pool_overlays)
+
+
+class OverlaysTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.commands = []
+        self.god = mock.mock_god(ut=self)
+        self.god.stub_with(
+            qemu_vm_template.utils_misc, "get_qemu_img_binary", lambda _: "qemu-img"
+        )
+        self.god.stub_with(qemu_vm_template.process, "run", self.run_cmd)
+        open(os.path.join(self.tmpdir, "disk.raw"), "w").close()
+        self.params = utils_params.Params(
+            {
+                "images": "image1",
+                "image_name": "disk",
+                "image_format": "raw",
+                "images_base_dir": self.tmpdir,
+                "vm_pool_dir": os.path.join(self.tmpdir, "pool"),
+            }
+        )
+
+    def tearDown(self):
+        self.god.unstub_all()
+        shutil.rmtree(self.tmpdir)
+
+    def run_cmd(self, cmd):
+        self.commands.append(cmd)
+        open(cmd.split()[-1], "w").close()
+
+    def test_overlays(self):
+        vm = FakeVM("vm1")
+        vm.pool_overlays = qemu_vm_pool.create_overlays(vm, self.params)
+        overlay = os.path.join(self.tmpdir, "pool", "image1-%s" % vm.instance)
+        self.assertEqual(
+            vm.pool_overlays,
+            {"image_name_image1": overlay, "image_format_image1": "qcow2"},
+        )
+        self.assertEqual(
+            self.commands,
+            [
+                "qemu-img create -f qcow2 -b %s -F raw %s.qcow2"
+                % (os.path.join(self.tmpdir, "disk.raw"), overlay)
+            ],
+        )
+        pool = qemu_vm_pool.VMPool()
+        pool.put(vm, self.params)
+        pool.destroy()
+        self.assertFalse(os.path.exists(overlay + ".qcow2"))
+
+    def test_not_overlaid(self):
+        self.params["enable_nbd"] = "yes"
+        self.assertIsNone(qemu_vm_pool.create_overlays(FakeVM("vm1"), self.params))
+        self.params["enable_nbd"] = "no"
+        self.params["image_name"] = "missing"
+        self.assertIsNone(qemu_vm_pool.create_overlays(FakeVM("vm1"), self.params))
+        self.assertEqual(self.commands, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from virttest import ip_sniffing, qemu_vm_template, utils_params
+
+
+class FakeNic(object):
+    def __init__(self, nic_name):
+        self.nic_name = nic_name
+
+
+class FakeSession(object):
+    def close(self):
+        pass
+
+
+class FakeMonitor(object):
+    def verify_status(self, status):
+        return False
+
+
+class FakeVM(object):
+    """VM whose guest got 10.0.0.2 from DHCP when it was booted"""
+
+    def __init__(self, address_cache):
+        self.name = "vm1"
+        self.params = utils_params.Params()
+        self.virtnet = [FakeNic("nic1")]
+        self.address_cache = address_cache
+        self.monitor = FakeMonitor()
+        self.created = []
+
+    def create(self, params=None, timeout=None, **kwargs):
+        self.created.append(kwargs.get("migration_mode"))
+
+    def wait_for_login(self, timeout):
+        self.address_cache["9A:00:00:00:00:01"] = "10.0.0.2"
+        return FakeSession()
+
+    def get_mac_address(self, nic_name):
+        return "9A:00:00:00:00:01"
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def save_to_file(self, path):
+        open(path, "w").close()
+
+    def destroy(self, gracefully=True, free_mac_addresses=True):
+        pass
+
+
+class VMTemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def template(self, vm):
+        template = qemu_vm_template.VMTemplate(vm, vm.params)
+        template.template_dir = self.tmpdir
+        template.state_file = os.path.join(self.tmpdir, "state")
+        template.metadata_file = os.path.join(self.tmpdir, "metadata.json")
+        template._create_overlays = lambda suffix, backing_files: vm.params
+        return template
+
+    def test_addresses(self):
+        self.template(FakeVM(ip_sniffing.AddrCache())).save(10)
+        # A new job doesn't know the address the guest keeps using
+        vm = FakeVM(ip_sniffing.AddrCache())
+        template = self.template(vm)
+        self.assertTrue(template.is_saved())
+        self.assertEqual(template.macs, {"nic1": "9A:00:00:00:00:01"})
+        template.restore(10)
+        self.assertEqual(vm.created, ["exec"])
+        self.assertEqual(vm.address_cache.get("9a:00:00:00:00:01"), "10.0.0.2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,6 +10,7 @@ if os.path.isdir(os.path.join(basedir, "virttest")):
     sys.path.append(basedir)
 
 from virttest import data_dir, remote
+from virttest.unittest_utils import mock
 
 
 class RemoteFileTest(unittest.TestCase):
@@ -93,5 +94,48 @@ class RemoteFileTest(unittest.TestCase):
         self.assertEqual(test_data, self.default_data)
 
 
+class SSHMuxTest(unittest.TestCase):
+    def setUp(self):
+        self.god = mock.mock_god(ut=self)
+        self.commands = []
+        self.god.stub_with(
+            remote, "remote_copy", lambda command, *args: self.commands.append(command)
+        )
+
+    def tearDown(self):
+        self.god.unstub_all()
+
+    def testScp(self):
+        remote.scp_mux(
+            "/tmp/ssh-x", "10.0.0.2", 22, "root", "pw", "/tmp/a b", "/root/", True
+        )
+        remote.scp_mux(
+            "/tmp/ssh-x", "10.0.0.2", 22, "root", "pw", ["/l1", "/l2"], "/tmp", False
+        )
+        for command in self.commands:
+            self.assertIn(
+                "-o ControlMaster=auto -o ControlPath=/tmp/ssh-x "
+                "-o ControlPersist=300",
+                command,
+            )
+        self.assertTrue(
+            self.commands[0].endswith(r" -P 22 '/tmp/a b' root@\[10.0.0.2\]:/root/")
+        )
+        self.assertTrue(
+            self.commands[1].endswith(r" -P 22 root@\[10.0.0.2\]:/l1 /l2 /tmp")
+        )
+        self.assertRaises(
+            remote.SCPError,
+            remote.scp_mux,
+            "/tmp/ssh-x",
+            "fe80::1",
+            22,
+            "root",
+            "pw",
+            "/a",
+            "/b",
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
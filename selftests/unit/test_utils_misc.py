@@ -3,6 +3,8 @@
 import os
 import sys
 import tempfile
+import threading
+import time
 import unittest
 
 from avocado.utils import process
@@ -87,6 +89,30 @@ git_repo_foo_commit = bc732ad8b2ed8be52160b893735417b43a1e91a8
         self.assertEqual(n6, "1048576.0")
 
 
+class TestWaitForPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "monitor.sock")
+
+    def tearDown(self):
+        process.run("rm -rf %s" % self.tmpdir)
+
+    def test_path_created(self):
+        timer = threading.Timer(0.2, open(self.path, "w").close)
+        timer.start()
+        start = time.time()
+        self.assertTrue(utils_misc.wait_for_path(self.path, 10, step=5))
+        timer.join()
+        self.assertLess(time.time() - start, 5)
+
+    def test_timeout(self):
+        self.assertFalse(utils_misc.wait_for_path([self.path], 0.2))
+
+    def test_missing_dir(self):
+        path = os.path.join(self.tmpdir, "missing", "monitor.sock")
+        self.assertFalse(utils_misc.wait_for_path(path, 0.2))
+
+
 class FakeCmd(object):
     def __init__(self, cmd):
         self.fake_cmds = [
@@ -146,6 +172,7 @@ class TestNumaNode(unittest.TestCase):
     def setUp(self):
         self.god = mock.mock_god(ut=self)
         self.god.stub_with(process, "run", utils_run)
+        self.addCleanup(self.god.unstub_all)
         all_nodes = tempfile.NamedTemporaryFile(delete=False)
         all_nodes.write(all_nodes_contents)
         all_nodes.close()
@@ -260,7 +287,6 @@ class TestNumaNode(unittest.TestCase):
         self.assertEqual(utils_misc.bitlist_to_string(bitlist), string)
 
     def tearDown(self):
-        self.god.unstub_all()
         os.unlink(self.all_nodes_path)
         os.unlink(self.online_nodes_path)
 
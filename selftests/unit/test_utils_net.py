@@ -6,7 +6,10 @@ import logging
 import os
 import random
 import shelve
+import shutil
 import sys
+import tempfile
+import threading
 import time
 import unittest
 
@@ -701,5 +704,39 @@ class TestVmNetSubclasses(unittest.TestCase):
             pass
 
 
+class TestDbThreadLock(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_filename = os.path.join(self.tmpdir, "address_pool")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lock_db(self):
+        params = utils_params.Params(
+            {"nics": "nic1", "vms": "vm1 vm2", "netdst": "virbr0"}
+        )
+        virtnets = [
+            utils_net.VirtNet(params, name, name, self.db_filename)
+            for name in ("vm1", "vm2")
+        ]
+        locked = []
+
+        def _lock():
+            virtnets[1].lock_db()
+            locked.append(True)
+            virtnets[1].unlock_db()
+
+        virtnets[0].lock_db()
+        thread = threading.Thread(target=_lock)
+        thread.start()
+        # The database lock file doesn't serialize the threads of a process
+        time.sleep(0.2)
+        self.assertEqual(locked, [])
+        virtnets[0].unlock_db()
+        thread.join(5)
+        self.assertEqual(locked, [True])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from virttest import utils_qemu
+
+
+class CapsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_caps_cache")
+        self.binary = os.path.join(self.tmpdir, "qemu-kvm")
+        shutil.copy("/bin/true", self.binary)
+        self.cache_dir = os.path.join(self.tmpdir, "cache")
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _probe(self, value="probed"):
+        self.calls += 1
+        return value
+
+    def test_shared_between_instances(self):
+        cache = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        self.assertEqual(cache.probe("key", self._probe), "probed")
+        self.assertEqual(cache.probe("key", self._probe), "probed")
+        other = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        self.assertEqual(other.probe("key", self._probe), "probed")
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(cache.path)])
+
+    def test_none_not_cached(self):
+        cache = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        cache.probe("key", self._probe, None)
+        cache.probe("key", self._probe, None)
+        self.assertEqual(self.calls, 2)
+
+    def test_uncached_result(self):
+        cache = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        failed = utils_qemu.UncachedResult("truncated")
+        self.assertEqual(cache.probe("key", self._probe, failed), "truncated")
+        self.assertEqual(cache.probe("key", self._probe), "probed")
+        self.assertEqual(cache.probe("key", self._probe, "other"), "probed")
+        self.assertEqual(self.calls, 2)
+
+    def test_binary_change_invalidates(self):
+        cache = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        cache.probe("key", self._probe)
+        with open(self.binary, "ab") as binary:
+            binary.write(b"\0")
+        other = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        self.assertNotEqual(cache.path, other.path)
+        self.assertEqual(other.probe("key", self._probe, "new"), "new")
+        self.assertEqual(self.calls, 2)
+
+    def test_invalidate(self):
+        cache = utils_qemu.CapsCache(self.binary, self.cache_dir)
+        cache.probe("key", self._probe)
+        cache.invalidate()
+        self.assertFalse(os.path.exists(cache.path))
+        cache.probe("key", self._probe)
+        self.assertEqual(self.calls, 2)
+
+    def test_build_id(self):
+        fingerprint = utils_qemu.get_binary_fingerprint(self.binary)
+        self.assertEqual(fingerprint["path"], os.path.realpath(self.binary))
+        build_id = fingerprint["build_id"]
+        if build_id is not None:
+            self.assertRegex(build_id, r"^[0-9a-f]+$")
+        self.assertIsNone(utils_qemu._get_build_id(__file__))
+
+
+SCHEMA = [
+    {"name": "block-stream", "meta-type": "command", "arg-type": "0"},
+    {
+        "name": "0",
+        "meta-type": "object",
+        "members": [
+            {"name": "job-id", "type": "str"},
+            {"name": "backing-mask-protocol", "type": "bool"},
+        ],
+    },
+    {"name": "query-status", "meta-type": "command", "arg-type": "1"},
+    {"name": "1", "meta-type": "object", "members": []},
+    {"name": "STOP", "meta-type": "event", "arg-type": "1"},
+]
+
+RESPONSES = {
+    "query-version": {"qemu": {"major": 9, "minor": 1, "micro": 0}},
+    "query-commands": [{"name": "block-stream"}, {"name": "query-status"}],
+    "query-qmp-schema": SCHEMA,
+    "qom-list-types": [{"name": "sev-guest"}, {"name": "iothread"}],
+    "query-machines": [
+        {"name": "pc-q35-9.1", "alias": "q35", "cpu-max": 4096},
+        {"name": "pc-i440fx-9.1", "is-default": True, "cpu-max": 255},
+    ],
+}
+
+
+class QMPProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="avocado_vt_qmp_probe")
+        self.binary = os.path.join(self.tmpdir, "qemu-kvm")
+        with open(self.binary, "w") as binary:
+            binary.write("#!/bin/sh\necho '{\"QMP\": {}}'\n")
+            binary.write("echo '%s'\n" % json.dumps({"return": {}}))
+            for cmd, ret in RESPONSES.items():
+                binary.write("echo '%s'\n" % json.dumps({"return": ret, "id": cmd}))
+            binary.write('echo \'{"error": {}, "id": "unknown"}\'\n')
+        os.chmod(self.binary, stat.S_IRWXU)
+        self._cache_dir = utils_qemu.CAPS_CACHE_DIR
+        utils_qemu.CAPS_CACHE_DIR = os.path.join(self.tmpdir, "cache")
+
+    def tearDown(self):
+        utils_qemu.CAPS_CACHE_DIR = self._cache_dir
+        shutil.rmtree(self.tmpdir)
+
+    def test_qmp_info(self):
+        info = utils_qemu.get_qmp_info(self.binary)
+        self.assertEqual(info["version"], "9.1.0")
+        self.assertEqual(info["commands"], ["block-stream", "query-status"])
+        self.assertEqual(info["types"], ["sev-guest", "iothread"])
+        self.assertIsNone(info["cmdline_options"])
+        self.assertEqual(
+            utils_qemu.get_maxcpus_hard_limit(self.binary, "pc-q35-9.1"), 4096
+        )
+        self.assertRaises(
+            ValueError, utils_qemu.get_maxcpus_hard_limit, self.binary, "virt"
+        )
+
+    def test_schema(self):
+        schema = utils_qemu.QMPSchema(SCHEMA)
+        self.assertTrue(schema)
+        self.assertFalse(utils_qemu.QMPSchema(None))
+        self.assertTrue(schema.has_command("query-status"))
+        self.assertFalse(schema.has_command("STOP"))
+        self.assertTrue(schema.has_event("STOP"))
+        self.assertTrue(schema.has_command_arg("block-stream", "backing-mask-protocol"))
+        self.assertFalse(schema.has_command_arg("query-status", "job-id"))
+        self.assertEqual(schema.get_command_args("unknown"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
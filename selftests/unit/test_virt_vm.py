@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+import os
+import pickle
+import sys
+import time
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from virttest import utils_params, virt_vm
+
+OOPS = """[   10.1] ------------[ cut here ]------------
+[   10.1] WARNING: CPU: 0 PID: 1 at kernel/foo.c:42 foo+0x10/0x20
+[   10.1] Call Trace:
+[   10.1]  <TASK>
+[   10.1]  bar+0x10/0x20
+[   10.1] ---[ end trace 0000000000000000 ]---"""
+
+GPF = """[   20.2] general protection fault: 0000 [#1] SMP
+[   20.2] RIP: 0010:foo+0x10/0x20
+[   20.2] RSP: 0018:ffffb0c0c0c0c0c0 EFLAGS: 00010246
+[   20.2] Call Trace:
+[   20.2]  <TASK>"""
+
+
+class FakeConsole(object):
+    def __init__(self, output_func):
+        self.output_func = output_func
+        self.output = []
+
+    def feed(self, text):
+        for line in text.splitlines():
+            self.output.append(line)
+            self.output_func("serial.log", line)
+
+    def get_output(self):
+        return "\n".join(self.output)
+
+
+class KernelCrashDetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.logged = []
+        self.vm = virt_vm.BaseVM("vm1", utils_params.Params())
+
+    def log_line(self, filename, line):
+        self.logged.append((filename, line))
+
+    def check(self, detector, text, crash):
+        console = FakeConsole(detector)
+        console.feed(text)
+        self.vm.serial_console = console
+        if crash is None:
+            self.vm.verify_kernel_crash()
+            self.assertIsNone(detector.crash)
+        else:
+            self.assertRaises(
+                virt_vm.VMDeadKernelCrashError, self.vm.verify_kernel_crash
+            )
+            self.assertEqual(detector.crash, crash)
+        # Same result as searching in the whole output
+        match = virt_vm.KernelCrashDetector.PANIC_RE.search(console.get_output())
+        self.assertEqual(match and match.group(0), crash)
+
+    def test_crashes(self):
+        for text in (OOPS, GPF):
+            detector = virt_vm.KernelCrashDetector(self.log_line)
+            noise = "\n".join("[    1.0] line %d" % i for i in range(100))
+            crash = text[text.index("-") + 2 :] if text is OOPS else text[10:]
+            self.check(detector, noise + "\n" + text, crash)
+        self.assertEqual(self.logged[0], ("serial.log", "[    1.0] line 0"))
+
+    def test_no_crash(self):
+        self.check(virt_vm.KernelCrashDetector(), OOPS.replace("end", "start"), None)
+        self.check(virt_vm.KernelCrashDetector(), "BUG: foo\n<TASK>", None)
+
+    def test_window(self):
+        detector = virt_vm.KernelCrashDetector(max_lines=100)
+        detector.feed("BUG: foo")
+        for _ in range(100):
+            self.assertIsNone(detector.feed("x"))
+        # The start of the crash was dropped already
+        self.assertIsNone(detector.feed("---[ end trace 0 ]---"))
+        self.assertEqual(len(detector.lines), 100)
+        self.assertIsNone(detector.feed("BUG: bar"))
+        self.assertEqual(detector.start, 103)
+        crash = "BUG: bar\n---[ end trace 1 ]---"
+        self.assertEqual(detector.feed("---[ end trace 1 ]---"), crash)
+
+    def test_pickle(self):
+        detector = virt_vm.KernelCrashDetector(max_lines=10)
+        detector.feed("BUG: unable to handle page fault")
+        other = pickle.loads(pickle.dumps(detector))
+        self.assertEqual(other.start, 1)
+        self.assertIsNotNone(other.feed("---[ end trace 1 ]---"))
+
+
+class FakeVM(object):
+    """VM going down $shutdown_time seconds after the shutdown command"""
+
+    def __init__(self, name, shutdown_time=None, kill_timeout="2"):
+        self.name = name
+        self.params = utils_params.Params({"kill_timeout": kill_timeout})
+        self.shutdown_time = shutdown_time
+        self.dead = False
+        self.calls = []
+
+    def get_pid(self):
+        return 0
+
+    def is_dead(self):
+        return self.dead
+
+    def graceful_shutdown(self, timeout=60):
+        self.calls.append("shutdown")
+        if self.shutdown_time is not None and self.shutdown_time < timeout:
+            time.sleep(self.shutdown_time)
+            self.dead = True
+            return True
+        time.sleep(timeout)
+
+    def destroy(self, gracefully=True, free_mac_addresses=True):
+        self.calls.append("destroy gracefully=%s" % gracefully)
+        self.free_mac_addresses = free_mac_addresses
+        if self.name == "broken":
+            raise virt_vm.VMError("%s can't be destroyed" % self.name)
+        self.dead = True
+
+
+class DestroyAllTest(unittest.TestCase):
+    def test_destroy_all(self):
+        vms = [FakeVM("vm%d" % i, 0.5) for i in range(4)]
+        vms.append(FakeVM("hung"))
+        start = time.time()
+        virt_vm.destroy_all(vms + [None])
+        # The shutdowns were waited for at once, up to the longest timeout
+        self.assertLess(time.time() - start, 3.5)
+        for vm in vms:
+            self.assertTrue(vm.dead)
+            self.assertEqual(vm.calls, ["shutdown", "destroy gracefully=False"])
+
+    def test_not_gracefully(self):
+        vms = [FakeVM("vm1"), FakeVM("broken"), FakeVM("vm2")]
+        self.assertRaisesRegex(
+            virt_vm.VMError, "broken", virt_vm.destroy_all, vms, gracefully=False
+        )
+        # The other VMs were destroyed anyway
+        self.assertEqual([vm.dead for vm in vms], [True, False, True])
+        self.assertEqual(vms[0].calls, ["destroy gracefully=False"])
+
+    def test_free_mac_addresses(self):
+        # Each VM type applies its own rules when freeing the addresses
+        for free in (True, False):
+            vms = [FakeVM("vm1"), FakeVM("vm2")]
+            virt_vm.destroy_all(vms, gracefully=False, free_mac_addresses=free)
+            self.assertEqual([vm.free_mac_addresses for vm in vms], [free, free])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+import os
+import random
+import sys
+import time
+import unittest
+
+# simple magic for using scripts within a source tree
+basedir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if os.path.isdir(os.path.join(basedir, "virttest")):
+    sys.path.append(basedir)
+
+from virttest import vt_iothread
+from virttest.qemu_devices import qdevices
+
+
+def create_iothreads(count):
+    """Return list of iothreads iothread0..iothread<count-1>"""
+    return [qdevices.QIOThread("iothread%d" % i) for i in range(count)]
+
+
+def create_device(index):
+    """Return device which could be attached to an iothread"""
+    return qdevices.QDevice("virtio-blk-pci", {"id": "disk%d" % index})
+
+
+def naive_request(iothreads):
+    """Least loaded iothread the way it used to be computed"""
+    return min(iothreads, key=lambda _: (len(_.iothread_bus), _.get_aid()))
+
+
+class RoundRobinManagerTest(unittest.TestCase):
+    def test_least_loaded(self):
+        iothreads = create_iothreads(3)
+        manager = vt_iothread.RoundRobinManager(iothreads)
+        self.assertRaises(ValueError, manager.request_iothread, "iothread0")
+        allocated = []
+        for i in range(7):
+            iothread = manager.request_iothread("auto")
+            iothread.iothread_bus.insert(create_device(i))
+            allocated.append(iothread.get_aid())
+        self.assertEqual(
+            allocated,
+            ["iothread%d" % (i % 3) for i in range(7)],
+        )
+        # Requests without attaching a device return the same iothread
+        self.assertEqual(manager.request_iothread("AUTO").get_aid(), "iothread1")
+        self.assertEqual(manager.request_iothread("AUTO").get_aid(), "iothread1")
+
+    def test_detach_and_release(self):
+        iothreads = create_iothreads(3)
+        manager = vt_iothread.RoundRobinManager(iothreads)
+        devices = []
+        for i in range(6):
+            device = create_device(i)
+            manager.request_iothread("auto").iothread_bus.insert(device)
+            devices.append(device)
+        # Detach both devices from iothread2
+        for device in devices[2::3]:
+            iothreads[2].iothread_bus.remove(device)
+        manager.update_iothread(iothreads[2])
+        self.assertIs(manager.request_iothread("auto"), iothreads[2])
+        manager.release_iothread(iothreads[2])
+        self.assertIs(manager.request_iothread("auto"), iothreads[0])
+        manager.release_iothread(iothreads[0])
+        manager.release_iothread(iothreads[1])
+        self.assertRaises(KeyError, manager.request_iothread, "auto")
+
+    def test_matches_naive(self):
+        """Heap allocation results in the same mapping as min()"""
+        rand = random.Random(0)
+        iothreads = create_iothreads(16)
+        manager = vt_iothread.RoundRobinManager(iothreads)
+        attached = []
+        for i in range(500):
+            if attached and rand.random() < 0.3:
+                device, iothread = attached.pop(rand.randrange(len(attached)))
+                iothread.iothread_bus.remove(device)
+                manager.update_iothread(iothread)
+            iothread = manager.request_iothread("auto")
+            self.assertIs(iothread, naive_request(iothreads))
+            device = create_device(i)
+            iothread.iothread_bus.insert(device)
+            attached.append((device, iothread))
+
+
+class RoundRobinManagerBenchmark(unittest.TestCase):
+    """Allocate iothreads to many devices"""
+
+    iothreads = 256
+    devices = 2000
+
+    def _allocate(self, request):
+        iothreads = create_iothreads(self.iothreads)
+        devices = [create_device(i) for i in range(self.devices)]
+        manager = vt_iothread.RoundRobinManager(iothreads)
+        start = time.time()
+        for device in devices:
+            request(manager, iothreads).iothread_bus.insert(device)
+        return time.time() - start, [len(_.iothread_bus) for _ in iothreads]
+
+    def test_benchmark(self):
+        naive_time, naive_loads = self._allocate(
+            lambda manager, iothreads: naive_request(iothreads)
+        )
+        heap_time, heap_loads = self._allocate(
+            lambda manager, iothreads: manager.request_iothread("auto")
+        )
+        self.assertEqual(heap_loads, naive_loads)
+        self.assertLess(
+            heap_time,
+            naive_time,
+            "Allocation of %s devices to %s iothreads took %.3fs, using min() "
+            "%.3fs" % (self.devices, self.iothreads, heap_time, naive_time),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 from __future__ import division
 
 import copy
+import functools
 import glob
 import logging
 import multiprocessing
@@ -27,6 +28,7 @@ from virttest import (
     ppm_utils,
     qemu_monitor,
     qemu_storage,
+    qemu_vm_pool,
     storage,
     test_setup,
     utils_libguestfs,
@@ -268,6 +270,14 @@ def preprocess_vm(test, params, env, name):
     start_vm = False
     update_virtnet = False
     gracefully_kill = params.get("kill_vm_gracefully") == "yes"
+    use_pool = (
+        vm_type == "qemu"
+        and params.get("vm_pool") == "yes"
+        and not params.get("migration_mode")
+    )
+    if not use_pool and env.get("vm_pool"):
+        # The parked VMs keep the backing images of their overlays open
+        qemu_vm_pool.VMPool.get(env).destroy()
 
     if params.get("migration_mode"):
         start_vm = True
@@ -280,11 +290,19 @@ def preprocess_vm(test, params, env, name):
             if not vm.is_alive():
                 start_vm = True
             if params.get("check_vm_needs_restart", "yes") == "yes":
-                if vm.needs_restart(name=name, params=params, basedir=test.bindir):
-                    vm.devices = None
+                vm_params = params
+                if use_pool and getattr(vm, "pool_overlays", None):
+                    vm_params = qemu_vm_pool.overlay_params(params, vm.pool_overlays)
+                if vm.needs_restart(name=name, params=vm_params, basedir=test.bindir):
                     start_vm = True
-                    old_vm.destroy(gracefully=gracefully_kill)
-                    update_virtnet = True
+                    if use_pool and vm.is_alive():
+                        # Keep it running for a later test with its config
+                        qemu_vm_pool.VMPool.get(env).put(vm, params)
+                        vm = env.create_vm(vm_type, target, name, params, test.bindir)
+                    else:
+                        vm.devices = None
+                        old_vm.destroy(gracefully=gracefully_kill)
+                        update_virtnet = True
 
     if start_vm:
         if vm_type == "libvirt" and params.get("type") != "unattended_install":
@@ -297,13 +315,29 @@ def preprocess_vm(test, params, env, name):
             if update_virtnet:
                 vm.update_vm_id()
                 vm.virtnet = utils_net.VirtNet(params, name, vm.instance)
+            pooled_vm = None
+            if use_pool and params.get("reuse_previous_config", "no") == "no":
+                pooled_vm = qemu_vm_pool.VMPool.get(env).take(
+                    vm, name, params, test.bindir
+                )
             # Start the VM (or restart it if it's already up)
             if vm.is_alive():
                 vm.destroy(free_mac_addresses=False)
-            if params.get("reuse_previous_config", "no") == "no":
+            if pooled_vm:
+                vm = pooled_vm
+                env.register_vm(name, vm)
+            elif params.get("reuse_previous_config", "no") == "no":
+                create_params = params
+                vm.pool_overlays = None
+                if use_pool:
+                    vm.pool_overlays = qemu_vm_pool.create_overlays(vm, params)
+                if vm.pool_overlays:
+                    create_params = qemu_vm_pool.overlay_params(
+                        params, vm.pool_overlays
+                    )
                 vm.create(
                     name,
-                    params,
+                    create_params,
                     test.bindir,
                     timeout=int(params.get("vm_create_timeout", 90)),
                     migration_mode=params.get("migration_mode"),
@@ -317,6 +351,14 @@ def preprocess_vm(test, params, env, name):
                     migration_fd=params.get("migration_fd"),
                     migration_exec_cmd=params.get("migration_exec_cmd_dst"),
                 )
+            if (
+                params.get("vm_ready_conditions")
+                and not params.get("migration_mode")
+                and params.get("paused_after_start_vm") != "yes"
+            ):
+                vm.wait_until_ready(timeout=int(params.get("vm_ready_timeout", 360)))
+            if use_pool and not pooled_vm and getattr(vm, "pool_overlays", None):
+                qemu_vm_pool.prepare_vm(vm, params)
 
         # Update kernel param
         serial_login = params.get_boolean("kernel_extra_params_serial_login")
@@ -623,7 +665,7 @@ def postprocess_fs_source(test, params, fs_name, vm_process_status=None):
         )
 
 
-def postprocess_vm(test, params, env, name):
+def postprocess_vm(test, params, env, name, destroy=True):
     """
     Postprocess a single VM object according to the instructions in params.
     Kill the VM if requested and get a screendump.
@@ -632,6 +674,8 @@ def postprocess_vm(test, params, env, name):
     :param params: A dict containing VM postprocessing parameters.
     :param env: The environment (a dict-like object).
     :param name: The name of the VM object.
+    :param destroy: Kill the VM if requested and finish its postprocessing,
+                    otherwise it's left to _postprocess_vms_destroy()
     """
     vm = env.get_vm(name)
     if not vm:
@@ -687,6 +731,9 @@ def postprocess_vm(test, params, env, name):
                     vm.name,
                 )
 
+    if not destroy:
+        return
+
     if params.get("kill_vm") == "yes":
         kill_vm_timeout = float(params.get("kill_vm_timeout", 0))
         if kill_vm_timeout:
@@ -698,6 +745,18 @@ def postprocess_vm(test, params, env, name):
         ):
             vm.undefine(options=params.get("kill_vm_libvirt_options"))
 
+    _postprocess_vm_destroyed(test, params, env, vm)
+
+
+def _postprocess_vm_destroyed(test, params, env, vm):
+    """
+    Finish the postprocessing of a VM once it was killed (if requested).
+
+    :param test: An Autotest test object.
+    :param params: A dict containing VM postprocessing parameters.
+    :param env: The environment (a dict-like object).
+    :param vm: The VM object.
+    """
     if vm.is_dead():
         if params.get("vm_type") == "qemu":
             if vm.devices is not None:
@@ -708,6 +767,52 @@ def postprocess_vm(test, params, env, name):
         strace.stop()
 
 
+def _postprocess_vms_destroy(test, params, env, vms):
+    """
+    Kill the VMs which request it all at once, so their graceful shutdowns
+    are waited for in parallel, then finish their postprocessing.
+
+    :param test: An Autotest test object.
+    :param params: A dict containing all VM parameters.
+    :param env: The environment (a dict-like object).
+    :param vms: List of VM names.
+    """
+    all_vms = []
+    killed_vms = {True: [], False: []}
+    # VMs given some time to go down by themselves
+    waited_vms = []
+    kill_vm_timeout = 0
+    for name in vms:
+        vm = env.get_vm(name)
+        if not vm:
+            continue
+        vm_params = params.object_params(name)
+        all_vms.append((vm, vm_params))
+        if vm_params.get("kill_vm") == "yes":
+            gracefully = vm_params.get("kill_vm_gracefully") == "yes"
+            killed_vms[gracefully].append(vm)
+            timeout = float(vm_params.get("kill_vm_timeout", 0))
+            if timeout:
+                waited_vms.append(vm)
+                kill_vm_timeout = max(kill_vm_timeout, timeout)
+    if waited_vms:
+        utils_misc.wait_for(
+            lambda: all(vm.is_dead() for vm in waited_vms), kill_vm_timeout, 0, 1
+        )
+    try:
+        for gracefully in (False, True):
+            virt_vm.destroy_all(killed_vms[gracefully], gracefully=gracefully)
+    finally:
+        for vm, vm_params in all_vms:
+            if (
+                vm_params.get("kill_vm") == "yes"
+                and vm_params.get("kill_vm_libvirt") == "yes"
+                and vm_params.get("vm_type") == "libvirt"
+            ):
+                vm.undefine(options=vm_params.get("kill_vm_libvirt_options"))
+            _postprocess_vm_destroyed(test, vm_params, env, vm)
+
+
 def process_command(test, params, env, command, command_timeout, command_noncritical):
     """
     Pre- or post- custom commands to be executed before/after a test is run
@@ -732,37 +837,6 @@ def process_command(test, params, env, command, command_timeout, command_noncrit
             raise
 
 
-class _CreateImages(threading.Thread):
-    """
-    Thread which creates images. In case of failure it stores the exception
-    in self.exc_info
-    """
-
-    def __init__(self, image_func, test, images, params, exit_event, vm_process_status):
-        threading.Thread.__init__(self)
-        self.image_func = image_func
-        self.test = test
-        self.images = images
-        self.params = params
-        self.exit_event = exit_event
-        self.exc_info = None
-        self.vm_process_status = vm_process_status
-
-    def run(self):
-        try:
-            _process_images_serial(
-                self.image_func,
-                self.test,
-                self.images,
-                self.params,
-                self.exit_event,
-                self.vm_process_status,
-            )
-        except Exception:
-            self.exc_info = sys.exc_info()
-            self.exit_event.set()
-
-
 def process_images(image_func, test, params, vm_process_status=None):
     """
     Wrapper which chooses the best way to process images.
@@ -773,15 +847,13 @@ def process_images(image_func, test, params, vm_process_status=None):
     :param vm_process_status: (optional) vm process status like running, dead
                               or None for no vm exist.
     """
-    images = params.objects("images")
-    if len(images) > 20:  # Lets do it in parallel
-        _process_images_parallel(
-            image_func, test, params, vm_process_status=vm_process_status
-        )
-    else:
-        _process_images_serial(
-            image_func, test, images, params, vm_process_status=vm_process_status
-        )
+    _process_images(
+        image_func,
+        test,
+        params.objects("images"),
+        params,
+        vm_process_status=vm_process_status,
+    )
 
 
 def process_fs_sources(fs_source_func, test, params, vm_process_status=None):
@@ -820,40 +892,310 @@ def _process_images_serial(
             break
 
 
-def _process_images_parallel(image_func, test, params, vm_process_status=None):
+def _get_image_storage(params):
+    """
+    Identify the storage of an image.
+
+    :param params: A dict containing the image parameters.
+    :return: The name of the network storage backend or the id of the device
+             holding the local image file.
+    """
+    if params.get("storage_type") == "vhost-vdpa":
+        return "vhost-vdpa"
+    for backend in ("curl", "nbd", "iscsi", "gluster", "ceph", "nvme", "ssh"):
+        if params.get("enable_%s" % backend) == "yes":
+            return backend
+    base_dir = params.get("images_base_dir", data_dir.get_data_dir())
+    path = os.path.dirname(os.path.join(base_dir, params.get("image_name", "")))
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return path
+
+
+def _process_images(image_func, test, images, params, vm_process_status=None):
+    """
+    Process images serially or in parallel depending on params.
+
+    "images_process_threads" sets the number of threads processing the
+    images, by default the images are processed in parallel only when there
+    are more than 20 of them.
+
+    :param image_func: Process function
+    :param test: An Autotest test object.
+    :param images: List of images (usually params.objects("images"))
+    :param params: A dict containing all VM and image parameters.
+    :param vm_process_status: (optional) vm process status like running, dead
+                              or None for no vm exist.
+    """
+    max_threads = 2 * multiprocessing.cpu_count()
+    if params.get("images_process_threads"):
+        no_threads = int(params["images_process_threads"])
+    elif len(images) > 20:
+        no_threads = len(images) // 5
+    else:
+        no_threads = 1
+    no_threads = min(no_threads, max_threads, len(images))
+    if no_threads > 1:
+        _process_images_parallel(
+            image_func, test, images, params, no_threads, vm_process_status
+        )
+    else:
+        _process_images_serial(
+            image_func, test, images, params, vm_process_status=vm_process_status
+        )
+
+
+def _process_images_parallel(
+    image_func, test, images, params, no_threads, vm_process_status=None
+):
     """
-    The same as _process_images but in parallel.
+    The same as _process_images_serial but in parallel.
+
+    The threads take the images from a shared queue, so slow images don't hold
+    up the others. At most "images_process_threads_per_storage" (4 by default)
+    images of the same storage (local filesystem or network backend) are
+    processed at once, the rest of the threads process images of other
+    storages. The images of a backing chain ("image_chain") are processed by
+    a single thread in the order of $images. When an image fails, no more
+    images are started and the failure of the first image (in the order of
+    $images) is raised once the running ones finish.
+
     :param image_func: Process function
     :param test: An Autotest test object.
+    :param images: List of images (usually params.objects("images"))
     :param params: A dict containing all VM and image parameters.
+    :param no_threads: Number of threads
     :param vm_process_status: (optional) vm process status like running, dead
                               or None for no vm exist.
     """
-    images = params.objects("images")
-    no_threads = min(len(images) // 5, 2 * multiprocessing.cpu_count())
-    exit_event = threading.Event()
+    per_storage = int(params.get("images_process_threads_per_storage", 4))
+    # [([(image_name, image_params)], storage)], the chains are kept together
+    pending = []
+    chains = {}
+    for image_name in images:
+        image_params = params.object_params(image_name)
+        chain = None
+        for other in image_params.objects("image_chain"):
+            if other in chains and other != image_name:
+                chain = chains[other]
+                break
+        if chain is None:
+            chain = ([], _get_image_storage(image_params))
+            pending.append(chain)
+        chain[0].append((image_name, image_params))
+        for other in image_params.objects("image_chain") + [image_name]:
+            chains.setdefault(other, chain)
+    running = {}
+    failures = {}
+    condition = threading.Condition()
+
+    def _get_image():
+        """Wait for an image with a free slot on its storage, None when done"""
+        with condition:
+            while pending and not failures:
+                for item in pending:
+                    if running.get(item[1], 0) < per_storage:
+                        pending.remove(item)
+                        running[item[1]] = running.get(item[1], 0) + 1
+                        return item
+                condition.wait()
+            return None
+
+    def _worker():
+        while True:
+            item = _get_image()
+            if item is None:
+                return
+            chain, image_storage = item
+            try:
+                for image_name, image_params in chain:
+                    image_func(test, image_params, image_name, vm_process_status)
+            except Exception:
+                with condition:
+                    failures[image_name] = sys.exc_info()
+            finally:
+                with condition:
+                    running[image_storage] -= 1
+                    condition.notify_all()
+
     threads = []
     for i in xrange(no_threads):
-        imgs = images[i::no_threads]
         threads.append(
-            _CreateImages(image_func, test, imgs, params, exit_event, vm_process_status)
+            threading.Thread(target=_worker, name="%s_%d" % (image_func.__name__, i))
         )
         threads[-1].start()
-
     for thread in threads:
         thread.join()
 
-    if exit_event.is_set():  # Failure in some thread
+    if failures:
         LOG.error("Image processing failed:")
+        for image_name in images:
+            if image_name in failures:
+                LOG.error("%s: %s", image_name, failures[image_name][1])
+        # Throw the first failure
+        first = [_ for _ in images if _ in failures][0]
+        six.reraise(*failures[first])
+
+
+class _VMLogPrefix(logging.Filter):
+    """
+    Prefix the records logged by the threads processing VMs by [$vm_name]
+    """
+
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.prefixes = {}
+
+    def filter(self, record):
+        prefix = self.prefixes.get(record.thread)
+        # The same record passes through several handlers
+        if prefix is not None and not getattr(record, "vm_prefix", None):
+            record.msg = "[%s] %s" % (prefix, record.msg)
+            record.vm_prefix = prefix
+        return True
+
+
+def _get_vms_dependencies(params, vms):
+    """
+    Get the VMs which have to be processed before each VM.
+
+    They are listed in "vm_process_after_$vm_name", e.g. the migration
+    destination VM is started after the source one using
+    "vm_process_after_dst = src".
+
+    :param params: A dict containing all VM parameters.
+    :param vms: List of VM names.
+    :return: dict {vm_name: set of VM names to be processed first}
+    :raise exceptions.TestError: When the dependencies form a cycle.
+    """
+    dependencies = {}
+    for vm_name in vms:
+        after = params.object_params(vm_name).objects("vm_process_after")
+        dependencies[vm_name] = set(_ for _ in after if _ in vms and _ != vm_name)
+    resolved = set()
+    while len(resolved) < len(vms):
+        ready = [
+            vm_name
+            for vm_name in vms
+            if vm_name not in resolved and dependencies[vm_name] <= resolved
+        ]
+        if not ready:
+            raise exceptions.TestError(
+                "Cyclic vm_process_after dependencies between VMs %s"
+                % [_ for _ in vms if _ not in resolved]
+            )
+        resolved.update(ready)
+    return dependencies
+
+
+def _process_vms_parallel(vm_func, test, params, env, vms):
+    """
+    Call vm_func for each VM in a bounded pool of threads.
+
+    At most "vms_process_max_threads" (by default and at most twice the
+    number of host CPUs, like the images) VMs are processed at once,
+    "vm_process_after_$vm_name" VMs are processed first. Every VM is
+    processed even when others fail (except the ones which depend on a
+    failed VM), then the failures are logged and the first one in the order
+    of $vms is raised.
+
+    :param vm_func: A function to call for each VM.
+    :param test: An Autotest test object.
+    :param params: A dict containing all VM parameters.
+    :param env: The environment (a dict-like object).
+    :param vms: List of VM names.
+    """
+    dependencies = _get_vms_dependencies(params, vms)
+    max_threads = 2 * multiprocessing.cpu_count()
+    max_threads = min(
+        int(params.get("vms_process_max_threads", max_threads)), max_threads
+    )
+    max_threads = max(1, min(max_threads, len(vms)))
+
+    pending = list(vms)
+    results = {}
+    skipped = set()
+    condition = threading.Condition()
+    log_prefix = _VMLogPrefix()
+
+    def _get_vm():
+        """Wait for a VM whose dependencies were processed, None when done"""
+        with condition:
+            while pending:
+                for vm_name in pending:
+                    if dependencies[vm_name] <= set(results):
+                        pending.remove(vm_name)
+                        return vm_name
+                condition.wait()
+            return None
+
+    def _worker():
+        while True:
+            vm_name = _get_vm()
+            if vm_name is None:
+                return
+            failed = [_ for _ in dependencies[vm_name] if results[_] is not None]
+            result = None
+            if failed:
+                LOG.error(
+                    "VM %s not processed, %s failed", vm_name, ", ".join(sorted(failed))
+                )
+                result = True
+                skipped.add(vm_name)
+            else:
+                log_prefix.prefixes[threading.current_thread().ident] = vm_name
+                try:
+                    vm_func(test, params.object_params(vm_name), env, vm_name)
+                except Exception:
+                    result = sys.exc_info()
+                finally:
+                    del log_prefix.prefixes[threading.current_thread().ident]
+            with condition:
+                results[vm_name] = result
+                condition.notify_all()
+
+    handlers = set(logging.getLogger().handlers)
+    handlers.update(logging.getLogger("avocado").handlers)
+    handlers.update(logging.getLogger("avocado.test").handlers)
+    for handler in handlers:
+        handler.addFilter(log_prefix)
+    LOG.debug(
+        "Calling %s for VMs %s using %s threads", vm_func.__name__, vms, max_threads
+    )
+    try:
+        threads = []
+        for i in xrange(max_threads):
+            thread = threading.Thread(
+                target=_worker, name="%s_%d" % (vm_func.__name__, i)
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
         for thread in threads:
-            if thread.exc_info:  # Throw the first failure
-                six.reraise(thread.exc_info[1], None, thread.exc_info[2])
-    del exit_event
-    del threads[:]
+            thread.join()
+    finally:
+        for handler in handlers:
+            handler.removeFilter(log_prefix)
+
+    failures = [
+        (_, results[_]) for _ in vms if results.get(_) is not None and _ not in skipped
+    ]
+    for vm_name, exc_info in failures:
+        LOG.error("%s of VM %s failed: %s", vm_func.__name__, vm_name, exc_info[1])
+    if failures:
+        six.reraise(*failures[0][1])
 
 
 def process(
-    test, params, env, image_func, vm_func, vm_first=False, fs_source_func=None
+    test,
+    params,
+    env,
+    image_func,
+    vm_func,
+    vm_first=False,
+    fs_source_func=None,
+    vms_func=None,
 ):
     """
     Pre- or post-process VMs and images according to the instructions in params.
@@ -866,12 +1208,20 @@ def process(
     :param vm_func: A function to call for each VM.
     :param vm_first: Call vm_func first or not.
     :param fs_source_func: A function to call for each filesystem source.
+    :param vms_func: A function to call with the list of all the VM names
+                     once vm_func was called for each VM.
     """
 
     def _call_vm_func():
-        for vm_name in params.objects("vms"):
-            vm_params = params.object_params(vm_name)
-            vm_func(test, vm_params, env, vm_name)
+        vms = params.objects("vms")
+        if len(vms) > 1 and params.get("vms_process_parallel") == "yes":
+            _process_vms_parallel(vm_func, test, params, env, vms)
+        else:
+            for vm_name in vms:
+                vm_params = params.object_params(vm_name)
+                vm_func(test, vm_params, env, vm_name)
+        if vms_func is not None:
+            vms_func(test, params, env, vms)
 
     def _call_image_func():
         if params.get("skip_image_processing") == "yes":
@@ -943,7 +1293,7 @@ def process(
                     vm_params["skip_cluster_leak_warn"] = "yes"
                 try:
                     images = params.objects("images")
-                    _process_images_serial(
+                    _process_images(
                         check_image,
                         test,
                         images,
@@ -955,7 +1305,7 @@ def process(
                         vm.resume()
         else:
             images = params.objects("images")
-            _process_images_serial(check_image, test, images, params)
+            _process_images(check_image, test, images, params)
 
     # preprocess
     if not vm_first:
@@ -1345,16 +1695,29 @@ def postprocess(test, params, env):
                 "Check either qemu build directory availablilty"
                 " or install gcovr package for qemu coverage report"
             )
-    # Postprocess all VMs and images
+    # Postprocess all VMs and images, the VMs are killed all at once unless
+    # they must be processed in a given order
+    vm_func, vms_func = postprocess_vm, None
+    vms = params.objects("vms")
+    if (
+        len(vms) > 1
+        and params.get("vms_destroy_parallel", "yes") == "yes"
+        and not any(params.get("vm_process_after_%s" % vm) for vm in vms)
+    ):
+        vm_func = functools.update_wrapper(
+            functools.partial(postprocess_vm, destroy=False), postprocess_vm
+        )
+        vms_func = _postprocess_vms_destroy
     try:
         process(
             test,
             params,
             env,
             postprocess_image,
-            postprocess_vm,
+            vm_func,
             True,
             postprocess_fs_source,
+            vms_func,
         )
     except Exception as details:
         err += "\nPostprocess: %s" % str(details).replace("\\n", "\n  ")
@@ -5,6 +5,7 @@ IP sniffing facilities
 import logging
 import re
 import threading
+import time
 
 try:
     from collections import Iterable
@@ -31,7 +32,7 @@ class AddrCache(object):
     def __init__(self):
         """Initializes the address cache."""
         self._data = {}
-        self._lock = threading.RLock()
+        self._lock = threading.Condition(threading.RLock())
 
     def __repr__(self):
         return repr(self._data)
@@ -43,7 +44,7 @@ class AddrCache(object):
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        self._lock = threading.RLock()
+        self._lock = threading.Condition(threading.RLock())
 
     @staticmethod
     def _format_hwaddr(hwaddr):
@@ -55,6 +56,7 @@ class AddrCache(object):
             if self._data.get(hwaddr) == ipaddr:
                 return
             self._data[hwaddr] = ipaddr
+            self._lock.notify_all()
         LOG.debug(
             "Updated HWADDR (%s)<->(%s) IP pair " "into address cache", hwaddr, ipaddr
         )
@@ -82,6 +84,25 @@ class AddrCache(object):
         """
         return self.__getitem__(hwaddr)
 
+    def wait_for(self, hwaddr, timeout, old_ipaddr=None):
+        """
+        Wait until the given hardware address gets an ip address.
+
+        :param hwaddr: Hardware address.
+        :param timeout: Time (seconds) to wait.
+        :param old_ipaddr: Wait for an ip address other than this one.
+        :return: The ip address or None when none arrived in time.
+        """
+        hwaddr = self._format_hwaddr(hwaddr)
+        end_time = time.time() + timeout
+        with self._lock:
+            while self._data.get(hwaddr) in (None, old_ipaddr):
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+            return self._data[hwaddr]
+
     def drop(self, hwaddr):
         """
         Drop the cache of the given hardware address.
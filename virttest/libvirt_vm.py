@@ -1540,7 +1540,8 @@ class VM(virt_vm.BaseVM):
                 cmd += " console %s %s" % (self.name, self.serial_ports[0])
             except IndexError:
                 raise virt_vm.VMConfigMissingError(self.name, "serial")
-            output_func = utils_logfile.log_line  # Because qemu-kvm uses this
+            # Wrap utils_logfile.log_line like the qemu serial console does
+            output_func = virt_vm.KernelCrashDetector(utils_logfile.log_line)
             port = self.serial_ports[0]
             # Because qemu-kvm hard-codes this
             output_filename = self.get_serial_console_filename(port)
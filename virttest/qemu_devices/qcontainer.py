@@ -16,6 +16,7 @@ import os
 import re
 import shutil
 import stat
+import time
 import uuid
 
 import aexpect
@@ -35,6 +36,7 @@ except ImportError:
 from virttest import (
     arch,
     data_dir,
+    qemu_monitor,
     qemu_storage,
     storage,
     utils_logfile,
@@ -60,6 +62,17 @@ from virttest.utils_version import VersionInterval
 
 LOG = logging.getLogger("avocado." + __name__)
 
+# Device attributes/params indexed by DevContainer (see __index_device)
+_DEVICE_KEYS = ("aid", "qid", "aobject", "type", "id", "drive")
+# Hash indexes of DevContainer devices and buses
+_INDEX_ATTRS = (
+    "_DevContainer__device_keys",
+    "_DevContainer__device_index",
+    "_DevContainer__bus_seqs",
+    "_DevContainer__bus_index",
+    "_DevContainer__bus_seq",
+)
+
 #
 # Device container (device representation of VM)
 # This class represents VM by storing all devices and their connections (buses)
@@ -112,24 +125,19 @@ class DevContainer(object):
         strict_mode="no",
         workaround_qemu_qmp_crash="no",
         allow_hotplugged_vm="yes",
+        caps_cache="yes",
     ):
         """
         :param qemu_binary: qemu binary
         :param vm: related VM
         :param strict_mode: Use strict mode (set optional params)
+        :param caps_cache: Reuse the persistent capabilities cache of the
+                           binary, "no" re-probes it and refreshes the cache
         """
 
-        def get_hmp_cmds(qemu_binary):
-            """:return: list of human monitor commands"""
-            _ = process.run(
-                "echo -e 'help\nquit' | %s -monitor "
-                "stdio -vnc none -S" % qemu_binary,
-                timeout=10,
-                ignore_status=True,
-                shell=True,
-                verbose=False,
-            ).stdout_text
-            _ = re.findall(r"^([^()\|\[\sA-Z]+\|?\w+)", _, re.M)
+        def parse_hmp_cmds(hmp_help):
+            """:return: list of human monitor commands listed in help"""
+            _ = re.findall(r"^([^()\|\[\sA-Z]+\|?\w+)", hmp_help, re.M)
             hmp_cmds = []
             for cmd in _:
                 if "|" not in cmd:
@@ -139,6 +147,19 @@ class DevContainer(object):
                     hmp_cmds.extend(cmd.split("|"))
             return hmp_cmds
 
+        def get_hmp_cmds(qemu_binary):
+            """:return: list of human monitor commands"""
+            return parse_hmp_cmds(
+                process.run(
+                    "echo -e 'help\nquit' | %s -monitor "
+                    "stdio -vnc none -S" % qemu_binary,
+                    timeout=10,
+                    ignore_status=True,
+                    shell=True,
+                    verbose=False,
+                ).stdout_text
+            )
+
         def get_qmp_cmds(qemu_binary, workaround_qemu_qmp_crash=False):
             """:return: list of qmp commands"""
             cmds = None
@@ -174,25 +195,35 @@ class DevContainer(object):
             if cmds:  # If no mathes, return None
                 return cmds
 
+        def need_machine_type(qemu_binary):
+            """:return: True when qemu does not start without machine type"""
+            cmd = (
+                "echo -e 'quit' | %s -monitor stdio -nodefaults -nographic -S"
+                % qemu_binary
+            )
+            result = process.run(
+                cmd, timeout=10, ignore_status=True, shell=True, verbose=False
+            )
+            # Some architectures (arm) require machine type to be always set
+            # and some hardware/firmware restrictions cause we need to set
+            # machine type.
+            failed_pattern = (
+                r"(?:kvm_init_vcpu.*failed)|(?:machine specified)"
+                r"|(?:appending -machine)"
+            )
+            output = result.stdout_text + result.stderr_text
+            return bool(result.exit_status and re.search(failed_pattern, output))
+
         self.__state = -1  # -1 synchronized, 0 synchronized after hotplug
         self.__qemu_binary = qemu_binary
         self.__execute_qemu_last = None
         self.__execute_qemu_out = ""
-        # Check whether we need to add machine_type
-        cmd = (
-            "echo -e 'quit' | %s -monitor stdio -nodefaults -nographic -S" % qemu_binary
-        )
-        result = process.run(
-            cmd, timeout=10, ignore_status=True, shell=True, verbose=False
-        )
-        # Some architectures (arm) require machine type to be always set and some
-        # hardware/firmware restrictions cause we need to set machine type.
-        failed_pattern = (
-            r"(?:kvm_init_vcpu.*failed)|(?:machine specified)"
-            r"|(?:appending -machine)"
-        )
-        output = result.stdout_text + result.stderr_text
-        if result.exit_status and re.search(failed_pattern, output):
+        self.__caps_cache = utils_qemu.get_caps_cache(qemu_binary)
+        if self.__caps_cache is not None and caps_cache == "no":
+            self.__caps_cache.invalidate()
+        # Check whether we need to add machine_type (not cached, it depends
+        # on the host too)
+        if need_machine_type(qemu_binary):
             self.__workaround_machine_type = True
             basic_qemu_cmd = "%s -machine none" % qemu_binary
         else:
@@ -202,18 +233,56 @@ class DevContainer(object):
         # escape the '?' otherwise it will fail if we have a single-char
         # filename in cwd
         self.__device_help = self.execute_qemu("-device \? 2>&1", 10)
-        self.__object_help = self.execute_qemu("-object \? 2>&1", 10)
-        self.__machines_info = utils_qemu.get_machines_info(qemu_binary)
-        self.__hmp_cmds = get_hmp_cmds(basic_qemu_cmd)
-        self.__qmp_cmds = get_qmp_cmds(
-            basic_qemu_cmd, workaround_qemu_qmp_crash == "always"
+        # Most of the capabilities come from a single QMP session, the
+        # text scraping below is kept for binaries unable to provide them
+        qmp_info = utils_qemu.get_qmp_info(qemu_binary) or {}
+        self.__qmp_schema = utils_qemu.QMPSchema(qmp_info.get("schema"))
+        self.__qom_types = qmp_info.get("types")
+        if self.__qom_types is None:
+            self.__object_help = self.execute_qemu("-object \? 2>&1", 10)
+        self.__cmdline_options = {
+            opt["option"]: [param["name"] for param in opt["parameters"]]
+            for opt in qmp_info.get("cmdline_options") or []
+        }
+        if qmp_info.get("machines"):
+            self.__machines_info = {}
+            for machine in qmp_info["machines"]:
+                self.__machines_info[machine["name"]] = (
+                    "(default)" if machine.get("is-default") else ""
+                )
+                if machine.get("alias"):
+                    self.__machines_info[machine["alias"]] = (
+                        "(alias of %s)" % machine["name"]
+                    )
+        else:
+            self.__machines_info = utils_qemu.get_machines_info(qemu_binary)
+        if qmp_info.get("hmp_help"):
+            self.__hmp_cmds = parse_hmp_cmds(qmp_info["hmp_help"])
+        else:
+            self.__hmp_cmds = self._probe_cached(
+                "hmp_cmds:%s" % basic_qemu_cmd, get_hmp_cmds, basic_qemu_cmd
+            )
+        self.__qmp_cmds = qmp_info.get("commands") or self._probe_cached(
+            "qmp_cmds:%s" % basic_qemu_cmd,
+            get_qmp_cmds,
+            basic_qemu_cmd,
+            workaround_qemu_qmp_crash == "always",
         )
         self.vmname = vmname
         self.strict_mode = strict_mode == "yes"
         self.__devices = []
         self.__buses = []
+        # Hash indexes of devices and buses, see __index_device/__index_bus
+        self.__device_keys = {}
+        self.__device_index = {}
+        self.__bus_seqs = {}
+        self.__bus_index = {}
+        self.__bus_seq = 0
         self.allow_hotplugged_vm = allow_hotplugged_vm == "yes"
-        self.__qemu_ver = utils_qemu.get_qemu_version(self.__qemu_binary)[0]
+        self.__qemu_ver = (
+            qmp_info.get("version")
+            or utils_qemu.get_qemu_version(self.__qemu_binary)[0]
+        )
         self.caps = Capabilities()
         self.mig_params = Capabilities()
         self._probe_capabilities()
@@ -223,11 +292,57 @@ class DevContainer(object):
         self.__iothread_vq_mapping_supported_devices = set()
         self.temporary_image_snapshots = set()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The indexes are cheap to rebuild and keyed by id(), don't pickle them
+        for key in _INDEX_ATTRS:
+            state.pop(key, None)
+        # The capabilities cache is shared by the process (and owns a lock)
+        state.pop("_DevContainer__caps_cache", None)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        for key in _INDEX_ATTRS:
+            state.pop(key, None)
+        state.pop("_DevContainer__caps_cache", None)
+        self.__dict__.update(state)
+        self.__caps_cache = utils_qemu.get_caps_cache(self.__qemu_binary)
+        devices, buses = self.__devices, self.__buses
+        self.__devices, self.__buses = [], []
+        self.__device_keys, self.__device_index = {}, {}
+        self.__bus_seqs, self.__bus_index, self.__bus_seq = {}, {}, 0
+        for device in devices:
+            self.__index_device(device)
+        for bus in reversed(buses):
+            self.__index_bus(bus)
+
+    def _probe_cached(self, key, func, *args, **kwargs):
+        """
+        Return the result of func(*args, **kwargs), reusing the one stored
+        in the persistent capabilities cache of the qemu binary if any.
+
+        :param key: Key of the cache entry
+        :param func: Probe function returning a json serializable value
+        """
+        if self.__caps_cache is None:
+            return utils_qemu.unwrap_result(func(*args, **kwargs))
+        return self.__caps_cache.probe(key, func, *args, **kwargs)
+
     @property
     def qemu_version(self):
         """:return: qemu version, e.g. 5.2.0"""
         return self.__qemu_ver
 
+    @property
+    def qmp_schema(self):
+        """
+        :return: QMP schema of the qemu binary, empty when qemu does not
+                 support the introspection
+        :rtype: utils_qemu.QMPSchema
+        """
+        return self.__qmp_schema
+
     @property
     def iothread_manager(self):
         """
@@ -422,8 +537,15 @@ class DevContainer(object):
         if self.has_option("incoming defer"):
             self.caps.set_flag(Flags.INCOMING_DEFER)
         # -machine memory-backend
-        machine_help = self.execute_qemu("-machine none,help")
-        if re.search(r"memory-backend=", machine_help, re.MULTILINE):
+        machine_opts = self.__cmdline_options.get("machine")
+        if machine_opts:
+            has_memory_backend = "memory-backend" in machine_opts
+        else:
+            machine_help = self.execute_qemu("-machine none,help")
+            has_memory_backend = re.search(
+                r"memory-backend=", machine_help, re.MULTILINE
+            )
+        if has_memory_backend:
             self.caps.set_flag(Flags.MACHINE_MEMORY_BACKEND)
         # -object sev-guest
         if self.has_object("sev-guest"):
@@ -439,11 +561,17 @@ class DevContainer(object):
             self.caps.set_flag(Flags.FLOPPY_DEVICE)
 
         # QMP: block-stream/block-commit @backing-mask-protocol
-        # TODO: probe cap via using the qmp command `query-qmp-schema`
-        #       instead of hard-coding the version range
-        if self.__qemu_ver in VersionInterval(
-            self.BLOCKJOB_BACKING_MASK_PROTOCOL_VERSION_SCOPE
-        ):
+        if self.__qmp_schema:
+            backing_mask_protocol = self.__qmp_schema.has_command_arg(
+                "block-stream", "backing-mask-protocol"
+            ) and self.__qmp_schema.has_command_arg(
+                "block-commit", "backing-mask-protocol"
+            )
+        else:
+            backing_mask_protocol = self.__qemu_ver in VersionInterval(
+                self.BLOCKJOB_BACKING_MASK_PROTOCOL_VERSION_SCOPE
+            )
+        if backing_mask_protocol:
             self.caps.set_flag(Flags.BLOCKJOB_BACKING_MASK_PROTOCOL)
 
         if self.has_qmp_cmd("migrate-set-parameters") and self.has_hmp_cmd(
@@ -463,6 +591,122 @@ class DevContainer(object):
             if self.__qemu_ver in VersionInterval(ver_scope):
                 self.mig_params.set_flag(mig_param)
 
+    @staticmethod
+    def __get_device_keys(device):
+        """:return: Values (in _DEVICE_KEYS order) under which the device
+        is indexed, None for the unhashable ones"""
+        keys = []
+        for value in (
+            device.get_aid(),
+            device.get_qid(),
+            device.aobject,
+            device.type,
+            device.params.get("id"),
+            device.params.get("drive"),
+        ):
+            try:
+                hash(value)
+            except TypeError:
+                value = None
+            keys.append(value)
+        return tuple(keys)
+
+    def __index_device(self, device):
+        """Append device into self.__devices and into the indexes"""
+        keys = self.__get_device_keys(device)
+        self.__device_keys[id(device)] = (device, keys)
+        for name, value in zip(_DEVICE_KEYS, keys):
+            if value is not None:
+                index = self.__device_index.setdefault(name, {})
+                index.setdefault(value, []).append(device)
+        self.__devices.append(device)
+
+    def __unindex_device(self, device):
+        """Remove device (the very same object) from self.__devices and
+        from the indexes"""
+        _, keys = self.__device_keys.pop(id(device))
+        for name, value in zip(_DEVICE_KEYS, keys):
+            if value is None:
+                continue
+            index = self.__device_index[name]
+            devices = index[value]
+            devices[:] = [_ for _ in devices if _ is not device]
+            if not devices:
+                del index[value]
+        for i, dev in enumerate(self.__devices):
+            if dev is device:
+                del self.__devices[i]
+                break
+
+    def __lookup_devices(self, key, value):
+        """
+        :return: Devices indexed under key=value in insertion order (caller
+                 has to verify the match) or None when it can't be indexed
+        """
+        if value is None:
+            return None
+        try:
+            return self.__device_index.get(key, {}).get(value, [])
+        except TypeError:
+            return None
+
+    def __find_device(self, device):
+        """
+        :param device: QBaseDevice-like object
+        :return: The inserted device which is (or equals to) device or None
+        """
+        if id(device) in self.__device_keys:
+            return device
+        for dev in self.__devices:
+            if dev == device:
+                return dev
+        return None
+
+    def __index_bus(self, bus):
+        """Insert bus in front of self.__buses and into the indexes"""
+        self.__bus_seq += 1
+        self.__bus_seqs[bus] = self.__bus_seq
+        for key in ("busid", "type", "aobject"):
+            self.__bus_index.setdefault((key, getattr(bus, key)), []).append(bus)
+        self.__buses.insert(0, bus)
+
+    def __unindex_bus(self, bus):
+        """Remove bus from self.__buses and from the indexes"""
+        del self.__bus_seqs[bus]
+        for key in ("busid", "type", "aobject"):
+            buses = self.__bus_index[(key, getattr(bus, key))]
+            buses.remove(bus)
+            if not buses:
+                del self.__bus_index[(key, getattr(bus, key))]
+        self.__buses.remove(bus)
+
+    def __lookup_buses(self, bus_spec, type_test):
+        """
+        :return: Superset of buses matching the bus_spec ordered as in
+                 self.__buses (the latest added first)
+        """
+        if type_test and bus_spec.get("type"):
+            key = "type"
+        else:
+            for key in ("busid", "aobject", "type"):
+                if key in bus_spec:
+                    break
+            else:
+                return self.__buses
+        values = bus_spec[key]
+        if not isinstance(values, (tuple, list)):
+            values = (values,)
+        buses = []
+        try:
+            for value in values:
+                buses.extend(self.__bus_index.get((key, value), []))
+        except TypeError:
+            return self.__buses
+        if len(values) > 1:
+            buses = list(set(buses))
+        buses.sort(key=self.__bus_seqs.get, reverse=True)
+        return buses
+
     def __getitem__(self, item):
         """
         :param item: autotest id or QObject-like object
@@ -470,10 +714,13 @@ class DevContainer(object):
         :raise KeyError: In case no match was found
         """
         if isinstance(item, qdevices.QBaseDevice):
-            if item in self.__devices:
+            if self.__find_device(item) is not None:
                 return item
         elif item:
-            for device in self.__devices:
+            devices = self.__lookup_devices("aid", item)
+            if devices is None:
+                devices = self.__devices
+            for device in devices:
                 if device.get_aid() == item:
                     return device
         raise KeyError("Device %s is not in %s" % (item, self))
@@ -493,7 +740,14 @@ class DevContainer(object):
         :type filt: dict
         """
         out = []
-        for device in self.__devices:
+        devices = self.__devices
+        for key in ("aobject", "type"):
+            if key in filt:
+                devices = self.__lookup_devices(key, filt[key])
+                if devices is None:
+                    devices = self.__devices
+                break
+        for device in devices:
             for key, value in six.iteritems(filt):
                 if not hasattr(device, key):
                     break
@@ -510,7 +764,14 @@ class DevContainer(object):
         :type filt: dict
         """
         out = []
-        for device in self.__devices:
+        devices = self.__devices
+        for key in ("id", "drive"):
+            if key in filt:
+                # params might be changed after insertion, scan all devices
+                # when the index does not know about any match
+                devices = self.__lookup_devices(key, filt[key]) or self.__devices
+                break
+        for device in devices:
             for key, value in six.iteritems(filt):
                 if key not in device.params:
                     break
@@ -549,36 +810,47 @@ class DevContainer(object):
                 # One child might be already removed from other child's bus
                 if dev in self:
                     self.remove(dev, True)
-        if device in self.__devices:  # It might be removed from child bus
-            for bus in self.__buses:  # Remove from parent_buses
-                bus.remove(device)
+        inserted = self.__find_device(device)
+        if inserted is not None:  # It might be removed from child bus
+            self.__remove_from_parent_buses(device)
             for bus in device.child_bus:  # Remove child buses from vm buses
-                self.__buses.remove(bus)
-            self.__devices.remove(device)  # Remove from list of devices
+                self.__unindex_bus(bus)
+            self.__unindex_device(inserted)  # Remove from list of devices
 
         if isinstance(device, qdevices.QIOThread):
             self.__iothread_manager.release_iothread(device)
 
+    def __remove_from_parent_buses(self, device):
+        """
+        Removes the device from all buses it's plugged into and lets the
+        iothread manager know when an iothread lost one of its devices.
+        :param device: qdevices.QBaseDevice device
+        """
+        for bus in self.__buses:
+            if not bus.remove(device):
+                continue
+            if isinstance(bus, qdevices.QIOThreadBus) and self.__iothread_manager:
+                self.__iothread_manager.update_iothread(bus.get_device())
+
     def wash_the_device_out(self, device):
         """
         Removes any traces of the device from representation.
         :param device: qdevices.QBaseDevice device
         """
         # remove device from parent buses
-        for bus in self.__buses:
-            if device in bus:
-                bus.remove(device)
+        self.__remove_from_parent_buses(device)
         # remove child devices
         for bus in device.child_bus:
             for dev in device.get_children():
                 if dev in self:
                     self.remove(dev, True)
             # remove child_buses from self.__buses
-            if bus in self.__buses:
-                self.__buses.remove(bus)
+            if bus in self.__bus_seqs:
+                self.__unindex_bus(bus)
         # remove device from self.__devices
-        if device in self.__devices:
-            self.__devices.remove(device)
+        inserted = self.__find_device(device)
+        if inserted is not None:
+            self.__unindex_device(inserted)
 
     def __len__(self):
         """:return: Number of inserted devices"""
@@ -591,10 +863,13 @@ class DevContainer(object):
         :return: True - yes, False - no
         """
         if isinstance(item, qdevices.QBaseDevice):
-            if item in self.__devices:
+            if self.__find_device(item) is not None:
                 return True
         elif item:
-            for device in self.__devices:
+            devices = self.__lookup_devices("aid", item)
+            if devices is None:
+                devices = self.__devices
+            for device in devices:
                 if device.get_aid() == item:
                     return True
         return False
@@ -613,29 +888,51 @@ class DevContainer(object):
                     return False
             else:
                 return False
+        # Compare the devices with the ones of the same cmdline first, the
+        # rendered cmdlines are cached by the devices
+        candidates = {}
+        for dev in qdev2:
+            candidates.setdefault(self.__device_signature(dev), []).append(dev)
         for dev in self:
-            if dev not in qdev2:
-                return False
+            for dev2 in candidates.get(self.__device_signature(dev), []):
+                if dev == dev2:
+                    break
+            else:
+                if dev not in qdev2:
+                    return False
 
         # state, buses and devices are handled earlier
         qdev2 = qdev2.__dict__
         for key, value in six.iteritems(self.__dict__):
-            if key in (
-                "_DevContainer__devices",
-                "_DevContainer__buses",
-                "_DevContainer__state",
-                "caps",
-                "allow_hotplugged_vm",
-                "_DevContainer__iothread_manager",
-                "_DevContainer__iothread_supported_devices",
-                "temporary_image_snapshots",
-                "mig_params",
+            if (
+                key
+                in (
+                    "_DevContainer__devices",
+                    "_DevContainer__buses",
+                    "_DevContainer__state",
+                    "caps",
+                    "allow_hotplugged_vm",
+                    "_DevContainer__iothread_manager",
+                    "_DevContainer__iothread_supported_devices",
+                    "_DevContainer__qmp_schema",
+                    "temporary_image_snapshots",
+                    "mig_params",
+                )
+                + _INDEX_ATTRS
             ):
                 continue
             if key not in qdev2 or qdev2[key] != value:
                 return False
         return True
 
+    @staticmethod
+    def __device_signature(device):
+        """:return: Hashable value which equal devices have in common"""
+        try:
+            return device.cmdline_nd()
+        except Exception:
+            return None
+
     def __ne__(self, qdev2):
         """Are the VM representation different?"""
         return not self.__eq__(qdev2)
@@ -674,7 +971,10 @@ class DevContainer(object):
         """
         ret = []
         if qid:
-            for device in self:
+            devices = self.__lookup_devices("qid", qid)
+            if devices is None:
+                devices = self.__devices
+            for device in devices:
                 if device.get_qid() == qid:
                     ret.append(device)
         return ret
@@ -688,7 +988,10 @@ class DevContainer(object):
         :return: the qdev ID
         :rtype: str
         """
-        for dev in self.__devices:
+        # 'drive' might be changed after insertion (unplug hooks), scan all
+        # devices when the index does not know about any match
+        devices = self.__lookup_devices("drive", device) or self.__devices
+        for dev in devices:
             try:
                 if isinstance(dev, qdevices.QDevice) and device == dev.params["drive"]:
                     return dev.params["id"]
@@ -778,6 +1081,8 @@ class DevContainer(object):
         :param obj: Desired object string, e.g. 'sev-guest'
         :return: True if the object is supported by qemu, or False
         """
+        if self.__qom_types is not None:
+            return obj in self.__qom_types
         return bool(re.search(r"^\s*%s\n" % obj, self.__object_help, re.M))
 
     def get_help_text(self):
@@ -815,13 +1120,22 @@ class DevContainer(object):
                 cmd = "%s -machine none %s 2>&1" % (self.__qemu_binary, options)
             else:
                 cmd = "%s %s 2>&1" % (self.__qemu_binary, options)
-            result = process.run(
-                cmd, timeout=timeout, ignore_status=True, shell=True, verbose=False
+            self.__execute_qemu_out = self._probe_cached(
+                "execute_qemu:%s" % cmd, self._run_qemu, cmd, timeout
             )
-            self.__execute_qemu_out = result.stdout_text
             self.__execute_qemu_last = options
         return self.__execute_qemu_out
 
+    @staticmethod
+    def _run_qemu(cmd, timeout):
+        """:return: stdout of the qemu command, not cached when it failed"""
+        result = process.run(
+            cmd, timeout=timeout, ignore_status=True, shell=True, verbose=False
+        )
+        if result.exit_status or getattr(result, "interrupted", False):
+            return utils_qemu.UncachedResult(result.stdout_text)
+        return result.stdout_text
+
     def get_buses(self, bus_spec, type_test=False):
         """
         :param bus_spec: Bus specification (dictionary)
@@ -832,7 +1146,7 @@ class DevContainer(object):
         :rtype: List of QSparseBus
         """
         buses = []
-        for bus in self.__buses:
+        for bus in self.__lookup_buses(bus_spec, type_test):
             if bus.match_bus(bus_spec, type_test):
                 buses.append(bus)
         return buses
@@ -951,14 +1265,14 @@ class DevContainer(object):
             raise DeviceInsertError(device, err, self)
         # 3
         for bus in device.child_bus:
-            self.__buses.insert(0, bus)
+            self.__index_bus(bus)
         # 4
         if device.get_qid() and self.get_by_qid(device.get_qid()):
             err = "Devices qid %s already used in VM\n" % device.get_qid()
             clean(device, added_devices)
             raise DeviceInsertError(device, err, self)
         device.set_aid(self.__create_unique_aid(device.get_qid()))
-        self.__devices.append(device)
+        self.__index_device(device)
         added_devices.append(device)
         return added_devices
 
@@ -975,6 +1289,25 @@ class DevContainer(object):
             )
         )
 
+    def __prepare_hotplug(self, device, bus=None):
+        """
+        Let the bus (pci.0 or the one matching the device's parent_bus when
+        not specified) prepare the device for hotplug.
+        """
+        if isinstance(device, qdevices.QDevice):
+            if bus is None:
+                if self.is_pci_device(device["driver"]):
+                    bus = self.get_buses({"aobject": "pci.0"})[0]
+                if not isinstance(device.parent_bus, (list, tuple)):
+                    device.parent_bus = [device.parent_bus]
+                for parent_bus in device.parent_bus:
+                    for _bus in self.get_buses(parent_bus):
+                        if _bus.bus_item == "bus":
+                            bus = _bus
+                            break
+            if bus is not None:
+                bus.prepare_hotplug(device)
+
     def simple_hotplug(self, device, monitor, bus=None):
         """
         Function hotplug device to devices representation. If verification is
@@ -991,20 +1324,7 @@ class DevContainer(object):
         :return: tuple(monitor.cmd(), verify_hotplug output)
         """
         self.set_dirty()
-
-        if isinstance(device, qdevices.QDevice):
-            if bus is None:
-                if self.is_pci_device(device["driver"]):
-                    bus = self.get_buses({"aobject": "pci.0"})[0]
-                if not isinstance(device.parent_bus, (list, tuple)):
-                    device.parent_bus = [device.parent_bus]
-                for parent_bus in device.parent_bus:
-                    for _bus in self.get_buses(parent_bus):
-                        if _bus.bus_item == "bus":
-                            bus = _bus
-                            break
-            if bus is not None:
-                bus.prepare_hotplug(device)
+        self.__prepare_hotplug(device, bus)
 
         try:
             # Insert the device first to assign slot
@@ -1104,6 +1424,268 @@ class DevContainer(object):
 
         return out, ver_out
 
+    @staticmethod
+    def __present_qids(monitor, cmds):
+        """
+        Query qemu once per kind of the given hotplug/unplug commands.
+
+        :param monitor: QMP monitor
+        :param cmds: List of the (cmd, args) used to (un)plug the devices
+        :return: dict {"device": set of present device ids (/machine/peripheral),
+                 "blockdev": set of present block node names}, only the kinds
+                 needed by cmds are queried
+        """
+        kinds = set()
+        for cmd, _ in cmds:
+            if cmd in ("device_add", "device_del"):
+                kinds.add("device")
+            elif cmd in ("blockdev-add", "blockdev-del"):
+                kinds.add("blockdev")
+        present = {}
+        if "device" in kinds:
+            out = monitor.cmd("qom-list", {"path": "/machine/peripheral"}, debug=False)
+            present["device"] = set(
+                _["name"] for _ in out if _.get("type", "").startswith("child<")
+            )
+        if "blockdev" in kinds:
+            try:
+                out = monitor.cmd(
+                    "query-named-block-nodes", {"flat": True}, debug=False
+                )
+            except qemu_monitor.QMPCmdError:  # "flat" is supported since 5.0
+                out = monitor.cmd("query-named-block-nodes", debug=False)
+            present["blockdev"] = set(_["node-name"] for _ in out)
+        return present
+
+    def __qmp_plug_cmds(self, devices, monitor, unplug=False):
+        """
+        :param unplug: Return the unplug commands instead of hotplug ones
+        :return: List of (cmd, args) or None when the devices can't be
+                 (un)plugged by QMP
+        """
+        if not isinstance(monitor, qemu_monitor.QMPMonitor):
+            return None
+        try:
+            if unplug:
+                return [device.unplug_qmp() for device in devices]
+            return [
+                device._hotplug_qmp_mapping(self.qemu_version)() for device in devices
+            ]
+        except DeviceError:
+            return None
+
+    def __unplug_pipelined(self, devices, monitor, timeout):
+        """
+        Unplug the devices in qemu (the representation is not modified).
+
+        All device_del commands are sent at once, then all the DEVICE_DELETED
+        events are awaited together and after that the other commands
+        (blockdev-del, ...) are sent, again at once. The result is verified by
+        a single query per kind of the devices.
+
+        :return: List of tuple(unplug output, verify_unplug output)
+        """
+        cmds = [device.unplug_qmp() for device in devices]
+        outs = [None] * len(devices)
+        device_del = [i for i, (cmd, _) in enumerate(cmds) if cmd == "device_del"]
+        others = [i for i, (cmd, _) in enumerate(cmds) if cmd != "device_del"]
+        end_time = time.time() + timeout
+        for batch in (device_del, others):
+            if not batch:
+                continue
+            pending = set(devices[i].get_qid() for i in batch)
+
+            def _match(event):
+                return event.get("data", {}).get("device") in pending
+
+            if batch is device_del:
+                # Drop stale events of the previous unplugs of the same ids
+                while monitor.wait_for_event("DEVICE_DELETED", 0, _match):
+                    pass
+            outs_batch = monitor.cmd_many([cmds[i] for i in batch], timeout)
+            for i, out in zip(batch, outs_batch):
+                outs[i] = out
+                if isinstance(out, qemu_monitor.QMPCmdError):
+                    pending.discard(devices[i].get_qid())
+            if batch is device_del:
+                while pending:
+                    event = monitor.wait_for_event(
+                        "DEVICE_DELETED", end_time - time.time(), _match
+                    )
+                    if event is None:
+                        break
+                    pending.discard(event["data"]["device"])
+        present = self.__present_qids(monitor, cmds)
+        results = []
+        for device, (cmd, _), out in zip(devices, cmds, outs):
+            if isinstance(out, qemu_monitor.QMPCmdError):
+                ver_out = False
+            elif cmd == "device_del":
+                ver_out = device.get_qid() not in present["device"]
+            elif cmd == "blockdev-del":
+                ver_out = device.get_qid() not in present["blockdev"]
+            else:
+                ver_out = device.verify_unplug(out, monitor)
+            results.append((out, ver_out))
+        return results
+
+    def hotplug_many(self, devices, monitor, timeout=60):
+        """
+        Hotplug several devices at once.
+
+        The devices are inserted into the representation one by one first,
+        then all the QMP hotplug commands are sent at once (pipelined) and the
+        result is verified by a single query per kind of the devices. When any
+        of them fails, the already hotplugged ones are unplugged again and all
+        of them are removed from the representation.
+        Without QMP monitor (or QMP hotplug support of some device) the
+        devices are hotplugged one by one like simple_hotplug() does.
+
+        :param devices: Devices which should be hotplugged, in the order of
+                        their dependencies (eg. blockdev nodes, then device).
+        :type devices: list of qdevices.QBaseDevice
+        :param monitor: Monitor from vm.
+        :type monitor: qemu_monitor.Monitor
+        :param timeout: Time duration to wait for the responses
+        :type timeout: int
+        :return: List of tuple(monitor.cmd(), verify_hotplug output)
+        :raise DeviceHotplugError: On failure (after the rollback)
+        """
+        self.set_dirty()
+        inserted = []
+        for device in devices:
+            self.__prepare_hotplug(device)
+            try:
+                qdev_out = self.insert(device)
+                if not isinstance(qdev_out, list) or len(qdev_out) != 1:
+                    raise DeviceError(
+                        "This device %s require to hotplug multiple devices, "
+                        "which is not supported." % device
+                    )
+            except DeviceError as exc:
+                for dev in reversed(inserted):
+                    if dev in self:
+                        self.remove(dev)
+                self.set_clean()
+                raise DeviceHotplugError(
+                    device, "According to qemu_device: %s" % exc, self
+                )
+            inserted.append(device)
+
+        cmds = self.__qmp_plug_cmds(devices, monitor)
+        if cmds is None:
+            results = []
+            for device in devices:
+                out = device.hotplug(monitor, self.qemu_version)
+                ver_out = device.verify_hotplug(out, monitor)
+                if ver_out is False:
+                    self.remove(device)
+                results.append((out, ver_out))
+            self.set_clean()
+            return results
+
+        outs = monitor.cmd_many(cmds, timeout)
+        present = self.__present_qids(monitor, cmds)
+        results = []
+        for device, (cmd, _), out in zip(devices, cmds, outs):
+            if isinstance(out, qemu_monitor.QMPCmdError):
+                ver_out = False
+            elif cmd == "device_add" and device.get_qid():
+                ver_out = device.get_qid() in present["device"]
+            elif cmd == "blockdev-add":
+                ver_out = device.get_qid() in present["blockdev"]
+            else:
+                ver_out = device.verify_hotplug(out, monitor)
+            results.append((out, ver_out))
+
+        failed = [
+            (device, out, ver_out)
+            for device, (out, ver_out) in zip(devices, results)
+            if ver_out is False
+        ]
+        if failed:
+            plugged = [
+                device
+                for device, (out, ver_out) in zip(devices, results)
+                if ver_out is not False
+            ]
+            rollback = self.__unplug_pipelined(plugged[::-1], monitor, timeout)
+            for device in reversed(devices):
+                if device in self:
+                    self.remove(device)
+            self.set_clean()
+            device, out, ver_out = failed[0]
+            reason = "%d of %d devices failed to hotplug (%s)" % (
+                len(failed),
+                len(devices),
+                ", ".join("%s: %s" % (dev, out) for dev, out, _ in failed),
+            )
+            stuck = [dev for dev, (_, ver) in zip(plugged[::-1], rollback) if not ver]
+            if stuck:
+                reason += ", failed to roll back %s" % ", ".join(map(str, stuck))
+            raise DeviceHotplugError(device, reason, self, ver_out)
+        self.set_clean()
+        return results
+
+    def unplug_many(self, devices, monitor, timeout=30):
+        """
+        Unplug several devices at once.
+
+        All the unplug commands are sent at once (pipelined), the
+        DEVICE_DELETED events are awaited together and the result is verified
+        by a single query per kind of the devices. Afterwards the blockdev
+        nodes of the unplugged devices are removed the same way. Devices
+        which failed to unplug are kept in the representation.
+        Without QMP monitor (or QMP unplug support of some device) the devices
+        are unplugged one by one by simple_unplug().
+
+        :param devices: Devices which should be unplugged.
+        :type devices: list of string, qdevices.QDevice.
+        :param monitor: Monitor from vm.
+        :type monitor: qemu_monitor.Monitor
+        :param timeout: Time duration to wait for the unplug of all devices
+        :type timeout: int
+        :return: List of tuple(monitor.cmd(), verify_unplug output)
+        """
+        devices = [self[device] for device in devices]
+        if self.__qmp_plug_cmds(devices, monitor, True) is None:
+            return [self.simple_unplug(device, monitor, timeout) for device in devices]
+
+        self.set_dirty()
+        results = self.__unplug_pipelined(devices, monitor, timeout)
+        nodes = []
+        for device, (out, ver_out) in zip(devices, results):
+            if ver_out is not True:
+                continue
+            try:
+                device.unplug_hook()
+                drive = device.get_param("drive")
+                self.remove(device, True)
+                if drive:
+                    if Flags.BLOCKDEV in self.caps:
+                        # top node and all its child nodes
+                        _nodes = [self[drive]]
+                        for node in _nodes:
+                            _nodes.extend(node.get_child_nodes())
+                        nodes.extend(_nodes)
+                    else:
+                        self.remove(drive)
+            except (DeviceError, KeyError) as exc:
+                device.unplug_unhook()
+                raise DeviceUnplugError(device, exc, self)
+
+        node_results = self.__unplug_pipelined(nodes, monitor, timeout) if nodes else []
+        for node, (out, ver_out) in zip(nodes, node_results):
+            if ver_out is not True:
+                raise DeviceUnplugError(node, "Failed to unplug blockdev node.", self)
+            parent_node = node.get_parent_node()
+            child_nodes = node.get_child_nodes()
+            self.remove(node, True if len(child_nodes) > 0 else False)
+            if parent_node:
+                parent_node.del_child_node(node)
+        self.set_clean()
+        return results
+
     def hotplug_verified(self):
         """
         This function should be used after you verify, that hotplug was
@@ -1161,16 +1743,16 @@ class DevContainer(object):
         Creates cmdline arguments for creating all defined devices
         :return: cmdline of all devices (without qemu-cmd itself)
         """
-        out = ""
+        out = []
         for device in self.__devices:
             if dynamic:
                 _out = device.cmdline()
             else:
                 _out = device.cmdline_nd()
             if _out:
-                out += " %s" % _out
+                out.append(_out)
         if out:
-            return out[1:]
+            return " ".join(out)
 
     def hook_fill_scsi_hbas(self, params):
         """
@@ -7,6 +7,7 @@ interact with qemu qdev structure.
 :copyright: 2012-2013 Red Hat Inc.
 """
 
+import itertools
 import json
 import logging
 import os
@@ -62,12 +63,128 @@ def _build_cmd(cmd, args=None, q_id=None):
     return obj
 
 
+_PARAMS_VERSIONS = itertools.count(1)
+
+
+class QParams(OrderedDict):
+    """
+    Ordered device params which track their modifications.
+
+    The ``version`` is changed on every modification (to a value unique
+    within the process) so the rendered representations of the device can
+    be cached. (In-place changes of mutable values are not tracked.)
+    """
+
+    __slots__ = ("version",)
+
+    def __init__(self, *args, **kwargs):
+        self.version = 0
+        super(QParams, self).__init__(*args, **kwargs)
+
+    def __reduce__(self):
+        # The version is unique only within this process, don't pickle it
+        return self.__class__, (list(self.items()),)
+
+    def _modified(self):
+        self.version = next(_PARAMS_VERSIONS)
+
+    def __setitem__(self, key, value):
+        self._modified()
+        super(QParams, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._modified()
+        super(QParams, self).__delitem__(key)
+
+    def pop(self, *args):
+        self._modified()
+        return super(QParams, self).pop(*args)
+
+    def popitem(self, *args, **kwargs):
+        self._modified()
+        return super(QParams, self).popitem(*args, **kwargs)
+
+    def setdefault(self, key, default=None):
+        self._modified()
+        return super(QParams, self).setdefault(key, default)
+
+    def clear(self):
+        self._modified()
+        super(QParams, self).clear()
+
+    def move_to_end(self, *args, **kwargs):
+        self._modified()
+        super(QParams, self).move_to_end(*args, **kwargs)
+
+
+_SLOTS = {}
+
+
+def _get_slots(cls):
+    """:return: Names of all __slots__ of the cls and of its parents"""
+    slots = _SLOTS.get(cls)
+    if slots is None:
+        slots = []
+        for klass in reversed(cls.__mro__):
+            for name in klass.__dict__.get("__slots__", ()):
+                if name.startswith("__") and not name.endswith("__"):
+                    name = "_%s%s" % (klass.__name__.lstrip("_"), name)
+                if name not in slots and name not in ("__dict__", "__weakref__"):
+                    slots.append(name)
+        slots = _SLOTS[cls] = tuple(slots)
+    return slots
+
+
+def _get_state(obj, skip=()):
+    """
+    Get the pickle state of an object using __slots__
+
+    :param obj: Object to be pickled
+    :param skip: Names of attributes which should not be pickled
+    :return: dict of the set attributes (including the __dict__ ones)
+    """
+    state = dict(getattr(obj, "__dict__", {}))
+    for name in _get_slots(type(obj)):
+        if name not in skip and hasattr(obj, name):
+            state[name] = getattr(obj, name)
+    return state
+
+
+def _set_state(obj, state):
+    """
+    Restore the state created by _get_state (or the __dict__ pickled by
+    the previous versions without __slots__)
+
+    :param obj: Object being unpickled
+    :param state: dict of attributes
+    """
+    for name, value in six.iteritems(state):
+        try:
+            setattr(obj, name, value)
+        except AttributeError:
+            LOG.debug("Ignoring unknown attribute %s of pickled %s", name, obj)
+
+
 #
 # Device objects
 #
 class QBaseDevice(object):
     """Base class of qemu objects"""
 
+    __slots__ = (
+        "aid",
+        "type",
+        "aobject",
+        "parent_bus",
+        "child_bus",
+        "dynamic_params",
+        "params",
+        "cmdline_format",
+        "pcie_direct_plug",
+        "_rendered",
+        "__dict__",  # created only when other attributes are set (mocks)
+    )
+
     def __init__(
         self,
         dev_type="QBaseDevice",
@@ -89,7 +206,7 @@ class QBaseDevice(object):
         if parent_bus is None:
             parent_bus = tuple()
         self.parent_bus = parent_bus  # list of buses into which this dev fits
-        self.child_bus = []  # list of buses which this dev provides
+        self.child_bus = ()  # tuple of buses which this dev provides
         if child_bus is None:
             child_bus = []
         elif not isinstance(child_bus, (list, tuple)):
@@ -97,9 +214,10 @@ class QBaseDevice(object):
         else:
             for bus in child_bus:
                 self.add_child_bus(bus)
-        self.dynamic_params = []
-        self.params = OrderedDict()  # various device params (id, name, ...)
+        self.dynamic_params = ()
+        self.params = QParams()  # various device params (id, name, ...)
         self.cmdline_format = "raw"
+        self._rendered = {}  # cached cmdline representations
         if params:
             for key, value in six.iteritems(params):
                 if key == "pcie_direct_plug":
@@ -113,7 +231,7 @@ class QBaseDevice(object):
         :param bus: Bus, which this device contains
         :type bus: QSparseBus-like
         """
-        self.child_bus.append(bus)
+        self.child_bus = tuple(self.child_bus) + (bus,)
         bus.set_device(self)
 
     def rm_child_bus(self, bus):
@@ -122,7 +240,9 @@ class QBaseDevice(object):
         :param bus: Bus, which this device contains
         :type bus: QSparseBus-like
         """
-        self.child_bus.remove(bus)
+        child_bus = list(self.child_bus)
+        child_bus.remove(bus)
+        self.child_bus = tuple(child_bus)
         bus.set_device(None)
 
     def set_param(self, option, value, option_type=None, dynamic=False):
@@ -135,10 +255,9 @@ class QBaseDevice(object):
         """
         if dynamic:
             if option not in self.dynamic_params:
-                self.dynamic_params.append(option)
+                self.dynamic_params = tuple(self.dynamic_params) + (option,)
         else:
-            if option in self.dynamic_params:
-                self.dynamic_params.remove(option)
+            self._unset_dynamic(option)
 
         if option_type is bool or isinstance(value, bool):
             if value in ["yes", "on", True]:
@@ -152,8 +271,12 @@ class QBaseDevice(object):
                 self.params[option] = value
         elif value is None and option in self.params:
             del self.params[option]
-            if option in self.dynamic_params:
-                self.dynamic_params.remove(option)
+            self._unset_dynamic(option)
+
+    def _unset_dynamic(self, option):
+        """Remove option from the dynamic params"""
+        if option in self.dynamic_params:
+            self.dynamic_params = tuple(_ for _ in self.dynamic_params if _ != option)
 
     def get_param(self, option, default=None):
         """:return: object param"""
@@ -209,6 +332,19 @@ class QBaseDevice(object):
         """:return: True when devs are different, False when similar."""
         return not self.__eq__(dev2)
 
+    def __getstate__(self):
+        """:return: dict of the attributes without the cached cmdlines"""
+        return _get_state(self, ("_rendered",))
+
+    def __setstate__(self, state):
+        """Restore state (also the __dict__ of the older versions)"""
+        self._rendered = {}
+        _set_state(self, state)
+        if isinstance(self.params, OrderedDict) and not isinstance(
+            self.params, QParams
+        ):
+            self.params = QParams(self.params)
+
     def str_short(self):
         """Short representation (aid, qid, alternative, type)"""
         if self.get_qid():  # Show aid only when it's based on qid
@@ -233,7 +369,7 @@ class QBaseDevice(object):
             self.aid,
             self.aobject,
             self.parent_bus,
-            self.child_bus,
+            list(self.child_bus),
         )
         for key, value in six.iteritems(self.params):
             out += "\n    %s = %s" % (key, value)
@@ -262,6 +398,31 @@ class QBaseDevice(object):
             children.extend(bus)
         return children
 
+    def _cached(self, name, render):
+        """
+        Return the cached output of render, call it when the params, the
+        dynamic params or the format changed since the last call.
+
+        :param name: Name of the representation (cmdline, cmdline_nd)
+        :param render: Function rendering the representation
+        """
+        params = self.params
+        if not isinstance(params, QParams):
+            return render()
+        state = (
+            id(params),
+            params.version,
+            self.cmdline_format,
+            self.type,
+            tuple(self.dynamic_params),
+        )
+        cached = self._rendered.get(name)
+        if cached is not None and cached[0] == state:
+            return cached[1]
+        out = render()
+        self._rendered[name] = (state, out)
+        return out
+
     def cmdline(self):
         """:return: cmdline command to define this device"""
         _cmdline = {"json": self._cmdline_json, "raw": self._cmdline_raw}
@@ -269,7 +430,7 @@ class QBaseDevice(object):
             raise ValueError(
                 "The input of qemu-kvm command format is NOT " "supported!"
             )
-        return _cmdline.get(self.cmdline_format)()
+        return self._cached("cmdline", _cmdline.get(self.cmdline_format))
 
     def _cmdline_raw(self):
         """:return: cmdline command to define this device in raw format"""
@@ -391,6 +552,8 @@ class QStringDevice(QBaseDevice):
     ``params`` will be used to subst ``%()s``
     """
 
+    __slots__ = ("_cmdline", "_cmdline_nd")
+
     def __init__(
         self,
         dev_type="dummy",
@@ -450,6 +613,8 @@ class QCustomDevice(QBaseDevice):
     This representation handles only cmdline.
     """
 
+    __slots__ = ("__backend",)
+
     def __init__(
         self,
         dev_type,
@@ -494,6 +659,10 @@ class QCustomDevice(QBaseDevice):
 
         :return: cmdline command to define this device without dynamic parameters.
         """
+        return self._cached("cmdline_nd", self._render_cmdline_nd)
+
+    def _render_cmdline_nd(self):
+        """:return: cmdline without dynamic parameters in raw format"""
         if self.__backend and self.params.get(self.__backend):
             out = "-%s %s," % (self.type, self.params.get(self.__backend))
             params = self.params.copy()
@@ -519,6 +688,8 @@ class QDrive(QCustomDevice):
     Representation of the '-drive' qemu object without hotplug support.
     """
 
+    __slots__ = ()
+
     def __init__(self, aobject, use_device=True):
         child_bus = QDriveBus("drive_%s" % aobject, aobject)
         super(QDrive, self).__init__("drive", {}, aobject, (), child_bus)
@@ -548,6 +719,8 @@ class QOldDrive(QDrive):
     This is a variant for -drive without 'addr' support
     """
 
+    __slots__ = ()
+
     def set_param(self, option, value, option_type=None):
         """
         Ignore addr parameters as they are not supported by old qemus
@@ -568,6 +741,8 @@ class QHPDrive(QDrive):
     Representation of the '-drive' qemu object with hotplug support.
     """
 
+    __slots__ = ("__hook_drive_bus",)
+
     def __init__(self, aobject):
         super(QHPDrive, self).__init__(aobject)
         self.__hook_drive_bus = None
@@ -641,6 +816,8 @@ class QRHDrive(QDrive):
     Representation of the '-drive' qemu object with RedHat hotplug support.
     """
 
+    __slots__ = ("__hook_drive_bus",)
+
     def __init__(self, aobject):
         super(QRHDrive, self).__init__(aobject)
         self.__hook_drive_bus = None
@@ -707,6 +884,8 @@ class QRHDrive(QDrive):
 class QBlockdevNode(QCustomDevice):
     """Representation of the '-blockdev' qemu object."""
 
+    __slots__ = ("_child_nodes", "_parent_node", "_is_root", "__hook_drive_bus")
+
     TYPE = None
 
     def __init__(self, aobject, child_bus=None, is_root=True):
@@ -888,6 +1067,8 @@ class QBlockdevNode(QCustomDevice):
 class QBlockdevFormatNode(QBlockdevNode):
     """New a format type blockdev node."""
 
+    __slots__ = ()
+
     def __init__(self, aobject):
         super(QBlockdevFormatNode, self).__init__(aobject, None)
 
@@ -907,24 +1088,32 @@ class QBlockdevFormatNode(QBlockdevNode):
 class QBlockdevFormatQcow2(QBlockdevFormatNode):
     """New a format qcow2 blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "qcow2"
 
 
 class QBlockdevFormatRaw(QBlockdevFormatNode):
     """New a format raw blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "raw"
 
 
 class QBlockdevFormatLuks(QBlockdevFormatNode):
     """New a format luks blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "luks"
 
 
 class QBlockdevProtocol(QBlockdevNode):
     """New a protocol blockdev node."""
 
+    __slots__ = ()
+
     def __init__(self, aobject):
         child_bus = QDriveBus("drive_%s" % aobject, aobject)
         super(QBlockdevProtocol, self).__init__(aobject, child_bus)
@@ -933,60 +1122,82 @@ class QBlockdevProtocol(QBlockdevNode):
 class QBlockdevProtocolVirtioBlkVhostVdpa(QBlockdevProtocol):
     """New a protocol virtio-blk-vhost-vdpa blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "virtio-blk-vhost-vdpa"
 
 
 class QBlockdevProtocolFile(QBlockdevProtocol):
     """New a protocol file blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "file"
 
 
 class QBlockdevProtocolNullCo(QBlockdevProtocol):
     """New a protocol null-co node."""
 
+    __slots__ = ()
+
     TYPE = "null-co"
 
 
 class QBlockdevProtocolHostDevice(QBlockdevProtocol):
     """New a protocol host_device blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "host_device"
 
 
 class QBlockdevProtocolBlkdebug(QBlockdevProtocol):
     """New a protocol blkdebug blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "blkdebug"
 
 
 class QBlockdevProtocolHostCdrom(QBlockdevProtocol):
     """New a protocol host_cdrom blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "host_cdrom"
 
 
 class QBlockdevProtocolISCSI(QBlockdevProtocol):
     """New a protocol iscsi blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "iscsi"
 
 
 class QBlockdevProtocolRBD(QBlockdevProtocol):
     """New a protocol rbd blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "rbd"
 
 
 class QBlockdevFilter(QBlockdevNode):
+    __slots__ = ()
+
     pass
 
 
 class QBlockdevFilterCOR(QBlockdevFilter):
+    __slots__ = ()
+
     TYPE = "copy-on-read"
 
 
 class QBlockdevFilterThrottle(QBlockdevFilter):
+    __slots__ = ()
+
     TYPE = "throttle"
 
     def __init__(self, aobject, group):
@@ -998,48 +1209,64 @@ class QBlockdevFilterThrottle(QBlockdevFilter):
 class QBlockdevProtocolGluster(QBlockdevProtocol):
     """New a protocol gluster blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "gluster"
 
 
 class QBlockdevProtocolNBD(QBlockdevProtocol):
     """New a protocol nbd blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "nbd"
 
 
 class QBlockdevProtocolNVMe(QBlockdevProtocol):
     """New a protocol NVMe blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "nvme"
 
 
 class QBlockdevProtocolSSH(QBlockdevProtocol):
     """New a protocol ssh blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "ssh"
 
 
 class QBlockdevProtocolHTTP(QBlockdevProtocol):
     """New a protocol http blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "http"
 
 
 class QBlockdevProtocolHTTPS(QBlockdevProtocol):
     """New a protocol https blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "https"
 
 
 class QBlockdevProtocolFTP(QBlockdevProtocol):
     """New a protocol ftp blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "ftp"
 
 
 class QBlockdevProtocolFTPS(QBlockdevProtocol):
     """New a protocol ftps blockdev node."""
 
+    __slots__ = ()
+
     TYPE = "ftps"
 
 
@@ -1049,6 +1276,8 @@ class QDevice(QCustomDevice):
     :note: Use driver format in full form - 'driver' = '...' (usb-ehci, ide-hd)
     """
 
+    __slots__ = ()
+
     def __init__(
         self, driver=None, params=None, aobject=None, parent_bus=None, child_bus=None
     ):
@@ -1151,6 +1380,8 @@ class QGlobal(QBaseDevice):
     Representation of qemu global setting (-global driver.property=value)
     """
 
+    __slots__ = ()
+
     def __init__(
         self, driver, prop, value, aobject=None, parent_bus=None, child_bus=None
     ):
@@ -1175,6 +1406,8 @@ class QFloppy(QGlobal):
     Imitation of qemu floppy disk defined by -global isa-fdc.drive?=$drive
     """
 
+    __slots__ = ()
+
     def __init__(
         self, unit=None, drive=None, aobject=None, parent_bus=None, child_bus=None
     ):
@@ -1208,6 +1441,8 @@ class QObject(QCustomDevice):
     Representation of the '-object backend' qemu object.
     """
 
+    __slots__ = ()
+
     QMP_PROPS_VERSION_SCOPE = "(, 6.0.0)"
 
     def __init__(self, backend, params=None):
@@ -1315,6 +1550,8 @@ class QIOThread(QObject):
     ["id", "poll-max-ns", "poll-grow", "poll-shrink"]
     """
 
+    __slots__ = ("iothread_bus", "iothread_vq_bus")
+
     def __init__(self, iothread_id, params=None):
         if params is None:
             params = dict()
@@ -1379,6 +1616,8 @@ class QThrottleGroup(QObject):
     throttle-group object.
     """
 
+    __slots__ = ("_raw_limits", "throttle_group_bus")
+
     def __init__(self, group_id, props):
         self._raw_limits = props.copy()
 
@@ -1440,6 +1679,8 @@ class Memory(QObject):
     'memory-backend-epc'.
     """
 
+    __slots__ = ()
+
     __attributes__ = {
         "memory-backend-ram": [
             "size",
@@ -1569,6 +1810,8 @@ class Dimm(QDevice):
     and 'memory-backend-file'
     """
 
+    __slots__ = ()
+
     __attributes__ = {
         "pc-dimm": ["memdev", "slot", "addr", "node", "size"],
         "nvdimm": [
@@ -1615,6 +1858,8 @@ class CharDevice(QCustomDevice):
     monitor.
     """
 
+    __slots__ = ()
+
     backends = [
         "null",
         "socket",
@@ -1814,6 +2059,8 @@ class QCPUDevice(QDevice):
     properties.
     """
 
+    __slots__ = ("_enabled",)
+
     def __init__(self, cpu_driver, enable, params=None, aobject=None, parent_bus=None):
         """
         :param cpu_driver: cpu driver name
@@ -1868,6 +2115,8 @@ class QDaemonDev(QBaseDevice):
     Virtual daemon device.
     """
 
+    __slots__ = ("_daemon_process",)
+
     def __init__(self, name, aobject, child_bus=None):
         """
         :param name: The daemon name.
@@ -1908,12 +2157,19 @@ class QDaemonDev(QBaseDevice):
         if self.is_daemon_alive():
             return
 
+        # A daemon providing a socket is ready once the socket appears
+        sock_path = self.get_param("sock_path")
+        if sock_path and os.path.exists(sock_path):
+            sock_path = None
+
         LOG.info("Running %s daemon command %s.", name, cmd)
         self._daemon_process = aexpect.run_bg(cmd, **run_bg_kwargs)
         if status_active:
             self._daemon_process.read_until_any_line_matches(
                 status_active, timeout=read_until_timeout
             )
+        elif sock_path:
+            utils_misc.wait_for_path(sock_path, start_until_timeout)
         else:
             time.sleep(start_until_timeout)
 
@@ -1981,6 +2237,8 @@ class QVirtioFSDev(QDaemonDev):
     Virtiofs pseudo device.
     """
 
+    __slots__ = ()
+
     def __init__(
         self,
         aobject,
@@ -2096,6 +2354,8 @@ class QSwtpmDev(QDaemonDev):
     Virtual swtpm pseudo device.
     """
 
+    __slots__ = ()
+
     def __init__(
         self, aobject, binary, sock_path, storage_path, version=None, extra_options=None
     ):
@@ -2163,6 +2423,8 @@ class QPasstDev(QDaemonDev):
     Passt pseudo device.
     """
 
+    __slots__ = ("_pid_file", "_tmp_log_file", "_log_file")
+
     def __init__(self, aobject, binary, sock_path, rules, mtu=None):
         """
         :param aobject: `aobject` of the daemon.
@@ -2278,6 +2540,8 @@ class QPasstDev(QDaemonDev):
 
 
 class QNetdev(QCustomDevice):
+    __slots__ = ()
+
     def __init__(self, nettype, params=None):
         """
         netdev device
@@ -2403,6 +2667,21 @@ class QSparseBus(object):
     :note: When you insert a device, it's properties might be updated (addr,..)
     """
 
+    __slots__ = (
+        "busid",
+        "type",
+        "aobject",
+        "bus",
+        "bus_item",
+        "addr_items",
+        "addr_lengths",
+        "atype",
+        "__device",
+        "first_port",
+        "_free_slots",
+        "__dict__",  # created only when other attributes are set (mocks)
+    )
+
     def __init__(
         self, bus_item, addr_spec, busid, bus_type=None, aobject=None, atype=None
     ):
@@ -2430,6 +2709,17 @@ class QSparseBus(object):
         self.atype = atype
         self.__device = None
         self.first_port = [0] * len(addr_spec[0])
+        # {(addr_pattern, first_port): last free address found}
+        self._free_slots = {}
+
+    def __getstate__(self):
+        """:return: dict of the attributes without the cached addresses"""
+        return _get_state(self, ("_free_slots",))
+
+    def __setstate__(self, state):
+        """Restore state (also the __dict__ of the older versions)"""
+        self._free_slots = {}
+        _set_state(self, state)
 
     def __str__(self):
         """default string representation"""
@@ -2617,9 +2907,17 @@ class QSparseBus(object):
                 or last_addr[i] >= self.addr_lengths[i]
             ):
                 return False
+        if not use_reserved:
+            # All addresses preceding the previously found one are occupied
+            # unless a device was removed since then
+            key = (tuple(addr_pattern), tuple(self.first_port))
+            if key in self._free_slots:
+                last_addr = list(self._free_slots[key])
         # Increment addr until free match is found
         while last_addr is not False:
             if self._addr2stor(last_addr) not in self.bus:
+                if not use_reserved:
+                    self._free_slots[key] = tuple(last_addr)
                 return last_addr
             if use_reserved and self.bus[self._addr2stor(last_addr)] == "reserved":
                 return last_addr
@@ -2738,6 +3036,7 @@ class QSparseBus(object):
                     break
             if remove is not None:
                 del self.bus[remove]
+                self._free_slots.clear()
                 return True
         return False
 
@@ -2770,11 +3069,11 @@ class QSparseBus(object):
         for key, value in six.iteritems(bus_spec):
             if isinstance(value, (tuple, list)):
                 for val in value:
-                    if self.__dict__.get(key, None) == val:
+                    if getattr(self, key, None) == val:
                         break
                 else:
                     return False
-            elif self.__dict__.get(key, None) != value:
+            elif getattr(self, key, None) != value:
                 return False
         return True
 
@@ -2784,6 +3083,8 @@ class QStrictCustomBus(QSparseBus):
     Similar to QSparseBus. The address starts with 1 and addr is always set
     """
 
+    __slots__ = ()
+
     def __init__(
         self,
         bus_item,
@@ -2811,6 +3112,8 @@ class QNoAddrCustomBus(QSparseBus):
     updated in the device's params.
     """
 
+    __slots__ = ()
+
     def _set_device_props(self, device, addr):
         pass
 
@@ -2823,6 +3126,8 @@ class QUSBBus(QSparseBus):
     USB bus representation including usb-hub handling.
     """
 
+    __slots__ = ("__port_prefix", "__length")
+
     def __init__(self, length, busid, bus_type, aobject=None, port_prefix=""):
         """
         Bus type have to be generalized and parsed from original bus type:
@@ -2878,7 +3183,7 @@ class QUSBBus(QSparseBus):
             return
         _bus = [_ for _ in device.child_bus if not isinstance(_, QUSBBus)]
         _bus.append(QUSBBus(8, self.busid, self.type, device.get_aid(), str(addr[0])))
-        device.child_bus = _bus
+        device.child_bus = tuple(_bus)
 
     def _set_device_props(self, device, addr):
         """in case this is usb-hub update the child port_prefix"""
@@ -2898,6 +3203,8 @@ class QDriveBus(QSparseBus):
     QDrive bus representation (single slot, drive=...)
     """
 
+    __slots__ = ()
+
     def __init__(self, busid, aobject=None):
         """
         :param busid: id of the bus (pci.0)
@@ -2932,6 +3239,8 @@ class QDenseBus(QSparseBus):
     too. SparseBus on the other hand prints always the device address.
     """
 
+    __slots__ = ()
+
     def _str_devices_long(self):
         """Show all addresses even when they are unused"""
         out = ""
@@ -2969,6 +3278,8 @@ class QPCIBus(QSparseBus):
     PCI Bus representation (bus&addr, uses hex digits)
     """
 
+    __slots__ = ()
+
     def __init__(self, busid, bus_type, aobject=None, length=32, first_port=0):
         """bus&addr, 32 slots"""
         super(QPCIBus, self).__init__(
@@ -3031,6 +3342,13 @@ class QPCIEBus(QPCIBus):
     device by default.)
     """
 
+    __slots__ = (
+        "__root_ports",
+        "__root_port_type",
+        "__root_port_params",
+        "__last_port_index",
+    )
+
     def __init__(
         self, busid, bus_type, root_port_type, aobject=None, root_port_params=None
     ):
@@ -3231,6 +3549,8 @@ class QPCISwitchBus(QPCIBus):
     a device).
     """
 
+    __slots__ = ("__downstream_ports", "__downstream_type")
+
     def __init__(self, busid, bus_type, downstream_type, aobject=None):
         super(QPCISwitchBus, self).__init__(busid, bus_type, aobject)
         self.__downstream_ports = {}
@@ -3284,6 +3604,8 @@ class QSCSIBus(QSparseBus):
     SCSI bus representation (bus + 2 leves, don't iterate over lun by default)
     """
 
+    __slots__ = ()
+
     def __init__(self, busid, bus_type, addr_spec, aobject=None, atype=None):
         """
         :param busid: id of the bus (mybus.0)
@@ -3310,6 +3632,8 @@ class QSCSIBus(QSparseBus):
 class QBusUnitBus(QDenseBus):
     """Implementation of bus-unit/nr bus (ahci, ide, virtio-serial)"""
 
+    __slots__ = ("unit_spec",)
+
     def __init__(
         self, busid, bus_type, lengths, aobject=None, atype=None, unit_spec="unit"
     ):
@@ -3374,6 +3698,8 @@ class QBusUnitBus(QDenseBus):
 class QSerialBus(QBusUnitBus):
     """Serial bus representation"""
 
+    __slots__ = ()
+
     def __init__(self, busid, bus_type, aobject=None, max_ports=32):
         """
         :param busid: bus id
@@ -3391,6 +3717,8 @@ class QSerialBus(QBusUnitBus):
 class QAHCIBus(QBusUnitBus):
     """AHCI bus (ich9-ahci, ahci)"""
 
+    __slots__ = ()
+
     def __init__(self, busid, aobject=None):
         """6xbus, 2xunit"""
         super(QAHCIBus, self).__init__(busid, "IDE", [6, 1], aobject, "ahci")
@@ -3399,6 +3727,8 @@ class QAHCIBus(QBusUnitBus):
 class QIDEBus(QBusUnitBus):
     """IDE bus (piix3-ide)"""
 
+    __slots__ = ()
+
     def __init__(self, busid, aobject=None):
         """2xbus, 2xunit"""
         super(QIDEBus, self).__init__(busid, "IDE", [2, 2], aobject, "ide")
@@ -3409,6 +3739,8 @@ class QFloppyBus(QDenseBus):
     Floppy bus (-global isa-fdc.drive?=$drive)
     """
 
+    __slots__ = ()
+
     def __init__(self, busid, aobject=None):
         """property <= [driveA, driveB]"""
         super(QFloppyBus, self).__init__(
@@ -3444,6 +3776,8 @@ class QOldFloppyBus(QDenseBus):
     Floppy bus (-drive index=n)
     """
 
+    __slots__ = ()
+
     def __init__(self, busid, aobject=None):
         """property <= [driveA, driveB]"""
         super(QOldFloppyBus, self).__init__(
@@ -3464,6 +3798,8 @@ class QCPUBus(QSparseBus):
     CPU virtual bus representation.
     """
 
+    __slots__ = ("vcpus_count",)
+
     def __init__(self, cpu_model, addr_spec, aobject=None, atype=None):
         """
         :param cpu_model: cpu model name
@@ -3546,6 +3882,8 @@ class QCPUBus(QSparseBus):
 class QThrottleGroupBus(QSparseBus):
     """ThrottleGroup virtual bus."""
 
+    __slots__ = ()
+
     def __init__(self, throttle_group_id):
         """
         ThrottleGroup bus constructor.
@@ -3572,6 +3910,8 @@ class QThrottleGroupBus(QSparseBus):
 class QIOThreadBus(QSparseBus):
     """IOThread virtual bus."""
 
+    __slots__ = ()
+
     def __init__(self, iothread_id):
         """
         iothread bus constructor.
@@ -3611,6 +3951,8 @@ class QIOThreadBus(QSparseBus):
 class QIOThreadVQBus(QSparseBus):
     """IOThread, supporting vq, virtual bus."""
 
+    __slots__ = ()
+
     def __init__(self, iothread_id):
         """
         iothread bus constructor.
@@ -3661,6 +4003,8 @@ class QUnixSocketBus(QSparseBus):
     Unix Socket pseudo bus.
     """
 
+    __slots__ = ()
+
     def __init__(self, busid, aobject):
         super(QUnixSocketBus, self).__init__(
             "path", [[], []], busid, "QUnixSocketBus", aobject
@@ -3672,6 +4016,8 @@ class QUnixSocketBus(QSparseBus):
 
 
 class QMachine(QCustomDevice):
+    __slots__ = ()
+
     def __init__(self, params=None, aobject=None, parent_bus=None, child_bus=None):
         super(QMachine, self).__init__(
             "machine",
@@ -3692,6 +4038,8 @@ class QMachine(QCustomDevice):
 class QPRHelperDev(QDaemonDev):
     """Virtual pr-helper pseudo device."""
 
+    __slots__ = ()
+
     def __init__(self, aobject, binary, sock_path, pidfile, log_filename):
         """
         :param aobject: The auto object of the pr-helper daemon.
@@ -3775,6 +4123,8 @@ class QPRHelperDev(QDaemonDev):
 class QPRManagerBus(QSparseBus):
     """PR manager virtual bus."""
 
+    __slots__ = ()
+
     def __init__(self, pr_mgr_id):
         """
         :param pr_mgr_id: The related QPRManager object id.
@@ -3799,6 +4149,8 @@ class QPRManagerBus(QSparseBus):
 class QPRManager(QObject):
     """The pr-manager-helper object representation."""
 
+    __slots__ = ("pr_manager_bus",)
+
     def __init__(self, pr_manager_name, pr_manager_props=None):
         params = dict()
         if pr_manager_props:
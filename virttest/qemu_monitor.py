@@ -7,6 +7,7 @@ Interfaces to the QEMU monitor.
 from __future__ import division
 
 import array
+import atexit
 import json
 import logging
 import os
@@ -17,6 +18,7 @@ import threading
 import time
 
 import six
+from six.moves import queue
 
 from virttest.qemu_capabilities import Flags
 
@@ -165,6 +167,24 @@ def create_monitor(vm, monitor_name, monitor_params):
         else:
             MonitorClass = QMPMonitor
 
+    qmp_monitor_name = monitor_params.get("hmp_over_qmp")
+    if MonitorClass is HumanMonitor and qmp_monitor_name:
+        for qmp_monitor in vm.monitors:
+            if qmp_monitor.name == qmp_monitor_name and qmp_monitor.protocol == "qmp":
+                break
+        else:
+            raise MonitorConnectError(qmp_monitor_name)
+        LOG.info(
+            "Binding human monitor '%s' to QMP monitor '%s'",
+            monitor_name,
+            qmp_monitor_name,
+        )
+        monitor = QMPHumanMonitor(
+            vm, monitor_name, monitor_params, qmp_monitor=qmp_monitor
+        )
+        monitor.verify_responsive()
+        return monitor
+
     LOG.info("Connecting to monitor '<%s> %s'", MonitorClass, monitor_name)
     monitor = MonitorClass(vm, monitor_name, monitor_params)
     monitor.verify_responsive()
@@ -175,23 +195,54 @@ def create_monitor(vm, monitor_name, monitor_params):
 def wait_for_create_monitor(vm, monitor_name, monitor_params, timeout):
     """
     Wait for the progress of creating monitor object. This function will
-    retry to create the Monitor object until timeout.
+    retry to create the Monitor object until timeout, unless the qemu
+    process dies or reports a failure first.
 
     :param vm: The VM object which has the monitor.
     :param monitor_name: The name of this monitor object.
     :param monitor_params: The dict for creating this monitor object.
     :param timeout: Time to wait for creating this monitor object.
     """
+
+    def _failed():
+        # Don't wait for a qemu which already died or reported a failure
+        watcher = getattr(vm, "_get_output_watcher", lambda: None)()
+        if watcher is not None and watcher.has_create_failure():
+            return True
+        process = getattr(vm, "process", None)
+        return process is not None and not process.is_alive()
+
+    start_time = time.time()
+    end_time = start_time + timeout
+    filename = monitor_params.get("monitor_filename")
+    if (
+        filename
+        and monitor_params.get("chardev_backend", "unix_socket") == "unix_socket"
+        and not monitor_params.get("hmp_over_qmp")
+    ):
+        # Connect the moment QEMU creates the socket instead of retrying
+        if utils_misc.wait_for_path(filename, timeout, abort=_failed):
+            LOG.debug(
+                "Socket of monitor '%s' created after %.3fs",
+                monitor_name,
+                time.time() - start_time,
+            )
     # Wait for monitor connection to succeed
-    end_time = time.time() + timeout
-    while time.time() < end_time:
+    retry_delay = 0.1
+    while time.time() < end_time and not _failed():
         try:
-            return create_monitor(vm, monitor_name, monitor_params)
+            monitor = create_monitor(vm, monitor_name, monitor_params)
+            LOG.debug(
+                "Connected to monitor '%s' after %.3fs",
+                monitor_name,
+                time.time() - start_time,
+            )
+            return monitor
         except MonitorError as e:
             LOG.warning(e)
-            time.sleep(1)
-    else:
-        raise MonitorConnectError(monitor_name)
+            time.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 1)
+    raise MonitorConnectError(monitor_name)
 
 
 def get_monitor_function(vm, cmd):
@@ -253,6 +304,129 @@ def pick_supported_x_feature(
     return feature
 
 
+class _MonitorLogWriter(threading.Thread):
+    """
+    Background thread writing the monitor log files.
+
+    Monitors only enqueue the raw traffic with its timestamp, decoding and
+    formatting of the lines happen in this thread when they are written.
+    """
+
+    def __init__(self):
+        super(_MonitorLogWriter, self).__init__(name="monitor-log-writer")
+        self.daemon = True
+        self.pid = os.getpid()
+        self._queue = queue.Queue()
+        self._files = {}
+
+    def write(self, log_file, data):
+        """
+        Enqueue data to be written to the log file.
+
+        The file name is resolved right away, the log directory may change
+        before the data is written.
+
+        :param log_file: Log file name, see utils_logfile.get_log_filename()
+        :param data: str, bytes or list of lines
+        """
+        log = utils_logfile.get_log_filename(log_file)
+        self._queue.put((log, time.time(), data))
+
+    def close_file(self, log_file):
+        """
+        Close the log file once the data enqueued so far is written.
+
+        :param log_file: Log file name
+        """
+        self._queue.put((utils_logfile.get_log_filename(log_file), None, None))
+
+    def flush(self):
+        """
+        Wait until all the enqueued data is written.
+        """
+        self._queue.join()
+
+    def _write(self, log, when, data):
+        if isinstance(data, bytes):
+            data = data.decode(errors="replace")
+        if isinstance(data, six.string_types):
+            data = data.splitlines()
+        timestr = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when))
+        if log not in self._files:
+            self._files[log] = open(log, "a")
+        try:
+            for line in data:
+                self._files[log].write("%s: %s\n" % (timestr, line))
+            if self._queue.empty():
+                self._files[log].flush()
+        except Exception:
+            self._files.pop(log).close()
+            raise
+
+    def _close(self, log):
+        if log in self._files:
+            self._files.pop(log).close()
+
+    def run(self):
+        while True:
+            log, when, data = self._queue.get()
+            try:
+                if when is None:
+                    self._close(log)
+                else:
+                    self._write(log, when, data)
+            except Exception as err:
+                LOG.error(
+                    "Fail to record log to %s.\nLog content: %s\n"
+                    "Exception error: %s",
+                    log,
+                    data,
+                    err,
+                )
+            finally:
+                self._queue.task_done()
+
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """
+    Return the monitor log writer of this process, starting it if needed.
+    """
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None or _log_writer.pid != os.getpid():
+            _log_writer = _MonitorLogWriter()
+            _log_writer.start()
+            atexit.register(flush_logs)
+        return _log_writer
+
+
+def flush_logs():
+    """
+    Wait until all the monitor traffic enqueued so far is in the log files.
+    """
+    if _log_writer is not None and _log_writer.pid == os.getpid():
+        _log_writer.flush()
+
+
+def parse_log_sampling(policy):
+    """
+    Parse the monitor_log_sampling param.
+
+    :param policy: Space separated "$command:$rate" items, the debug log of
+                   $command is emitted once every $rate calls, 0 suppresses it
+    :return: Dict mapping the commands to their rate
+    """
+    sampling = {}
+    for item in policy.split():
+        cmd, rate = item.rsplit(":", 1)
+        sampling[cmd] = int(rate)
+    return sampling
+
+
 class VM(object):
     """
     Dummy class to represent "vm.name" for pickling to avoid circular deps
@@ -268,6 +442,167 @@ class VM(object):
         return None
 
 
+class BlockJobTracker(object):
+    """
+    Follow the state of (block) jobs through QMP events.
+
+    The tracker listens to JOB_STATUS_CHANGE and BLOCK_JOB_* events as they
+    are read from the monitor, so waiting for a job wakes up as soon as the
+    event arrives and the last reported progress is known without querying
+    the jobs again.
+    """
+
+    EVENTS = (
+        "JOB_STATUS_CHANGE",
+        "BLOCK_JOB_READY",
+        "BLOCK_JOB_COMPLETED",
+        "BLOCK_JOB_CANCELLED",
+        "BLOCK_JOB_ERROR",
+    )
+    #: Statuses after which a job never changes its status again
+    FINAL_STATUSES = ("concluded", "null")
+
+    def __init__(self, monitor):
+        """
+        :param monitor: QMPMonitor to follow the jobs of
+        """
+        self.monitor = monitor
+        self.jobs = {}
+        for event in monitor._events:
+            self._handle_event(event)
+        monitor.add_event_listener(self._handle_event)
+
+    def _job(self, job_id, new=False):
+        """
+        :param job_id: The job ID
+        :param new: Start a new record, the ID of a finished job is reused
+        """
+        if new or job_id not in self.jobs:
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": None,
+                "history": [],
+                "offset": None,
+                "len": None,
+                "error": None,
+            }
+        return self.jobs[job_id]
+
+    def _set_status(self, job, status):
+        job["status"] = status
+        job["history"].append(status)
+
+    def _handle_event(self, event):
+        name = event.get("event")
+        if name not in self.EVENTS:
+            return
+        data = event.get("data", {})
+        if name == "JOB_STATUS_CHANGE":
+            job = self._job(data["id"], new=data["status"] == "created")
+            self._set_status(job, data["status"])
+            return
+        job = self._job(data["device"])
+        if name == "BLOCK_JOB_READY" and job["status"] in self.FINAL_STATUSES:
+            # Legacy block job started again with the same ID
+            job = self._job(data["device"], new=True)
+        if "offset" in data:
+            job["offset"] = data["offset"]
+            job["len"] = data["len"]
+        if name == "BLOCK_JOB_READY" and job["status"] != "ready":
+            # Legacy block jobs do not report JOB_STATUS_CHANGE
+            self._set_status(job, "ready")
+        elif name == "BLOCK_JOB_ERROR":
+            job["error"] = "%s error (%s)" % (data["operation"], data["action"])
+        elif name in ("BLOCK_JOB_COMPLETED", "BLOCK_JOB_CANCELLED"):
+            if "error" in data:
+                job["error"] = data["error"]
+            if job["status"] not in self.FINAL_STATUSES:
+                self._set_status(job, "concluded")
+
+    def refresh(self):
+        """
+        Update the tracked jobs with a single query-jobs round trip.
+        """
+        if not self.monitor._has_command("query-jobs"):
+            return
+        for info in self.monitor.query_jobs():
+            job = self._job(info["id"])
+            if (
+                job["status"] in self.FINAL_STATUSES
+                and info["status"] not in self.FINAL_STATUSES
+            ):
+                # The ID of the finished job was reused
+                job = self._job(info["id"], new=True)
+            if job["status"] != info["status"]:
+                self._set_status(job, info["status"])
+            job["offset"] = info["current-progress"]
+            job["len"] = info["total-progress"]
+            if info.get("error"):
+                job["error"] = info["error"]
+
+    def get_job(self, job_id):
+        """
+        Return the tracked state of the job, reading pending events first.
+
+        :param job_id: The job ID
+        :return: Dict with the 'status', 'history', 'offset', 'len' and
+                 'error' of the job, or None if the job is unknown
+        """
+        self.monitor.get_events()
+        return self.jobs.get(job_id)
+
+    def get_progress(self, job_id):
+        """
+        Return the last known progress of the job without querying QEMU.
+
+        :param job_id: The job ID
+        :return: Tuple (offset, len), items are None when not reported yet
+        """
+        job = self.get_job(job_id) or {}
+        return job.get("offset"), job.get("len")
+
+    def forget(self, job_id):
+        """
+        Drop the tracked state of the job, e.g. before reusing its ID.
+
+        :param job_id: The job ID
+        """
+        self.jobs.pop(job_id, None)
+
+    def wait_job(self, job_id, status, timeout):
+        """
+        Wait until the job has reached the given status.
+
+        The wait ends early when the job reaches a final status without
+        going through the requested one.
+
+        :param job_id: The job ID
+        :param status: Job status, e.g. 'ready', 'concluded' or 'null'
+        :param timeout: Time duration to wait
+        :return: Dict describing the tracked state of the job
+        :raise MonitorError: Raised if the job does not reach the status
+        """
+        if job_id not in self.jobs:
+            # Started before tracking began, get its current state once
+            self.refresh()
+        end_time = time.time() + timeout
+        while True:
+            job = self.get_job(job_id)
+            if job is not None:
+                if status in job["history"]:
+                    return job
+                if job["status"] in self.FINAL_STATUSES:
+                    break
+            remaining = end_time - time.time()
+            if remaining <= 0 or self.monitor._server_closed:
+                break
+            self.monitor._data_available(min(remaining, self.monitor.EVENT_WAIT_STEP))
+        raise MonitorError(
+            "Job '%s' did not reach status '%s' (monitor '%s.%s'): %s"
+            % (job_id, status, self.monitor.vm.name, self.monitor.name, job)
+        )
+
+
 class Monitor(object):
     """
     Common code for monitor classes.
@@ -276,6 +611,7 @@ class Monitor(object):
     ACQUIRE_LOCK_TIMEOUT = 20
     DATA_AVAILABLE_TIMEOUT = 0
     CONNECT_TIMEOUT = 60
+    _log_sampling = {}
 
     def __init__(self, vm, name, monitor_params, suppress_exceptions=False):
         """
@@ -292,17 +628,29 @@ class Monitor(object):
         self.name = name
         self.monitor_params = monitor_params
         self._lock = threading.RLock()
-        self._log_lock = threading.RLock()
         self._supported_cmds = []
         self.debug_log = False
+        self._log_sampling = parse_log_sampling(
+            monitor_params.get("monitor_log_sampling", "")
+        )
+        self._log_counts = {}
         vm_pid = vm.get_pid()
         if vm_pid is None:
             vm_pid = "unknown"
         self.log_file = "%s-%s-pid-%s.log" % (name, vm.name, vm_pid)
-        self.open_log_files = {}
         self._supported_migrate_capabilities = None
         self._supported_migrate_parameters = None
+        self._connect(monitor_params)
+        self._server_closed = False
+
+    def _connect(self, monitor_params):
+        """
+        Connect to the monitor socket.
+
+        :param monitor_params: The dict for creating this monitor object.
 
+        :raise MonitorConnectError: Raised if the connection fails
+        """
         try:
             backend = monitor_params.get("chardev_backend", "unix_socket")
             if backend == "tcp_socket":
@@ -324,26 +672,12 @@ class Monitor(object):
             raise MonitorConnectError(
                 "Could not connect to monitor socket: %s" % details
             )
-        self._server_closed = False
 
     def __del__(self):
         # Automatically close the connection when the instance is garbage
         # collected
         self._close_sock()
-        if not self._acquire_lock(lock=self._log_lock):
-            raise MonitorLockError(
-                "Could not acquire exclusive lock to access"
-                " %s " % self.open_log_files
-            )
-        try:
-            del_logs = []
-            for log in self.open_log_files:
-                self.open_log_files[log].close()
-                del_logs.append(log)
-            for log in del_logs:
-                self.open_log_files.pop(log)
-        finally:
-            self._log_lock.release()
+        get_log_writer().close_file(self.log_file)
 
     # The following two functions are defined to make sure the state is set
     # exclusively by the constructor call as specified in __getinitargs__().
@@ -436,6 +770,26 @@ class Monitor(object):
             return True
         return False
 
+    def _log_sampled(self, cmd, debug=True):
+        """
+        Apply the monitor_log_sampling policy to the debug flag of a command.
+
+        :param cmd: Command string.
+        :param debug: Whether the caller asked to print the command.
+        :return: Whether the command and its response should be printed.
+        """
+        if not debug or not self._log_sampling:
+            return debug
+        name = cmd.split(" ", 1)[0]
+        rate = self._log_sampling.get(name)
+        if rate is None:
+            return debug
+        if rate <= 0:
+            return False
+        count = self._log_counts.get(name, 0)
+        self._log_counts[name] = count + 1
+        return count % rate == 0
+
     def _log_command(self, cmd, debug=True, extra_str=""):
         """
         Print log message being sent.
@@ -456,29 +810,13 @@ class Monitor(object):
     def _log_lines(self, log_str):
         """
         Record monitor cmd/output in log file.
+
+        The data is written by a background thread, it is only formatted
+        there, see flush_logs() to wait for it.
+
+        :param log_str: Raw data (str, bytes or list of lines) to record.
         """
-        if not self._acquire_lock(lock=self._log_lock):
-            raise MonitorLockError(
-                "Could not acquire exclusive lock to access" " %s" % self.open_log_files
-            )
-        try:
-            log = utils_logfile.get_log_filename(self.log_file)
-            timestr = time.strftime("%Y-%m-%d %H:%M:%S")
-            try:
-                if log not in self.open_log_files:
-                    self.open_log_files[log] = open(log, "a")
-                for line in log_str.splitlines():
-                    self.open_log_files[log].write("%s: %s\n" % (timestr, line))
-                self.open_log_files[log].flush()
-            except Exception as err:
-                txt = "Fail to record log to %s.\n" % log
-                txt += "Log content: %s\n" % log_str
-                txt += "Exception error: %s" % err
-                LOG.error(txt)
-                self.open_log_files[log].close()
-                self.open_log_files.pop(log)
-        finally:
-            self._log_lock.release()
+        get_log_writer().write(self.log_file, log_str)
 
     @staticmethod
     def _build_args(**kargs):
@@ -733,19 +1071,9 @@ class Monitor(object):
         Close the connection to the monitor and its log file.
         """
         self._close_sock()
-        if not self._acquire_lock(lock=self._log_lock):
-            raise MonitorLockError(
-                "Could not acquire exclusive lock to access" " %s" % self.open_log_files
-            )
-        try:
-            del_logs = []
-            for log in self.open_log_files:
-                self.open_log_files[log].close()
-                del_logs.append(log)
-            for log in del_logs:
-                self.open_log_files.pop(log)
-        finally:
-            self._log_lock.release()
+        writer = get_log_writer()
+        writer.close_file(self.log_file)
+        writer.flush()
 
     def wait_for_migrate_progress(self, target):
         """
@@ -896,7 +1224,7 @@ class HumanMonitor(Monitor):
         try:
             try:
                 func(*args)
-                self._log_lines(cmd.decode(errors="replace"))
+                self._log_lines(cmd)
             except socket.error as e:
                 raise MonitorSocketError("Could not send monitor command %r" % cmd, e)
         finally:
@@ -922,7 +1250,7 @@ class HumanMonitor(Monitor):
         :param resp: Response from monitor command.
         :param debug: Whether to print the commands.
         """
-        if self.debug_log or debug:
+        if (self.debug_log or debug) and LOG.isEnabledFor(logging.DEBUG):
             LOG.debug("(monitor %s.%s) Response to '%s'", self.vm.name, self.name, cmd)
             for l in resp.splitlines():
                 LOG.debug("(monitor %s.%s)    %s", self.vm.name, self.name, l)
@@ -941,6 +1269,7 @@ class HumanMonitor(Monitor):
         :raise MonitorProtocolError: Raised if the (qemu) prompt cannot be
                 found after sending the command
         """
+        debug = self._log_sampled(cmd, debug)
         self._log_command(cmd, debug)
         if not self._acquire_lock():
             raise MonitorLockError(
@@ -958,7 +1287,7 @@ class HumanMonitor(Monitor):
                 else None
             )
             if debug:
-                LOG.debug("Send command: %s" % cmd)
+                LOG.debug("Send command: %s", cmd)
             self._send(msg, fds)
             # Read output
             s, o = self._read_up_to_qemu_prompt(timeout)
@@ -1770,6 +2099,98 @@ class HumanMonitor(Monitor):
         return self.cmd(netdev_cmd)
 
 
+class QMPHumanMonitor(HumanMonitor):
+    """
+    Wraps "human monitor" commands executed through the human-monitor-command
+    of an existing QMP monitor.
+
+    Provides the HumanMonitor API without a dedicated HMP socket: no (qemu)
+    prompt has to be scraped and every response is matched by its QMP id.
+    """
+
+    def __init__(
+        self, vm, name, monitor_params, suppress_exceptions=False, qmp_monitor=None
+    ):
+        """
+        Bind to the QMP monitor and get the supported commands.
+
+        :param vm: The VM which this monitor belongs to.
+        :param name: Monitor identifier (a string)
+        :param monitor_params: The dict for creating this monitor object.
+        :param qmp_monitor: The QMPMonitor the commands are executed through
+
+        :raise MonitorConnectError: Raised if no QMP monitor is given and
+                suppress_exceptions is False
+        """
+        self._qmp_monitor = qmp_monitor
+        try:
+            Monitor.__init__(self, vm, name, monitor_params)
+
+            self.protocol = "human"
+            if qmp_monitor is None:
+                raise MonitorConnectError(name)
+
+            self._get_supported_cmds()
+
+        except MonitorError as e:
+            if suppress_exceptions:
+                LOG.warning(e)
+            else:
+                raise
+
+    def _connect(self, monitor_params):
+        self._socket = None
+
+    def _close_sock(self):
+        pass
+
+    def _data_available(self, timeout=Monitor.DATA_AVAILABLE_TIMEOUT):
+        return False
+
+    def is_responsive(self):
+        """
+        Return True if the monitor is responsive.
+        """
+        if self._qmp_monitor is None:
+            return False
+        try:
+            self.verify_responsive()
+            return True
+        except MonitorError:
+            return False
+
+    def cmd(self, cmd, timeout=HumanMonitor.CMD_TIMEOUT, debug=True, fd=None):
+        """
+        Send command to the monitor.
+
+        :param cmd: Command to send to the monitor
+        :param timeout: Time duration to wait for the response
+        :param debug: Whether to print the commands being sent and responses
+        :param fd: file object or file descriptor to pass
+        :return: Output received from the monitor
+        :raise MonitorConnectError: Raised if there is no QMP monitor to use
+        :raise HumanCmdError: Raised if the command fails
+        """
+        if self._qmp_monitor is None:
+            raise MonitorConnectError(self.name)
+        debug = self._log_sampled(cmd, debug)
+        self._log_command(
+            cmd, debug, extra_str="(via QMP monitor %s)" % self._qmp_monitor.name
+        )
+        self._log_lines(cmd)
+        args = {"command-line": cmd}
+        try:
+            o = self._qmp_monitor.cmd("human-monitor-command", args, timeout, False, fd)
+        except QMPCmdError as e:
+            raise HumanCmdError(cmd, e.data)
+        if o:
+            self._log_lines(o)
+            self._log_response(cmd, o, debug)
+            if "Error: " in o:
+                raise HumanCmdError(cmd, o)
+        return o
+
+
 class QMPMonitor(Monitor):
     """
     Wraps QMP monitor commands.
@@ -1779,6 +2200,7 @@ class QMPMonitor(Monitor):
     CMD_TIMEOUT = 900
     RESPONSE_TIMEOUT = 600
     PROMPT_TIMEOUT = 90
+    EVENT_WAIT_STEP = 1
 
     def __init__(self, vm, name, monitor_params, suppress_exceptions=False):
         """
@@ -1804,6 +2226,8 @@ class QMPMonitor(Monitor):
             self.protocol = "qmp"
             self._greeting = None
             self._events = []
+            self._event_listeners = []
+            self._job_tracker = None
             self._supported_hmp_cmds = []
 
             # Make sure json is available
@@ -1885,11 +2309,15 @@ class QMPMonitor(Monitor):
         for line in s.splitlines():
             try:
                 objs += [json.loads(line)]
-                self._log_lines(line.decode(errors="replace"))
+                self._log_lines(line)
             except Exception:
                 pass
         # Keep track of asynchronous events
-        self._events += [obj for obj in objs if "event" in obj]
+        events = [obj for obj in objs if "event" in obj]
+        self._events += events
+        for event in events:
+            for listener in self._event_listeners:
+                listener(event)
         return objs
 
     def _send(self, data, fds=None):
@@ -1912,7 +2340,7 @@ class QMPMonitor(Monitor):
             ]
         try:
             func(*args)
-            self._log_lines(data.decode(errors="replace"))
+            self._log_lines(data)
         except socket.error as e:
             raise MonitorSocketError("Could not send data: %r" % data, e)
 
@@ -2014,7 +2442,7 @@ class QMPMonitor(Monitor):
                     o += str(v)
                     _log_output(o, indent)
 
-        if self.debug_log or debug:
+        if (self.debug_log or debug) and LOG.isEnabledFor(logging.DEBUG):
             LOG.debug(
                 "(monitor %s.%s) Response to '%s' " "(re-formatted)",
                 self.vm.name,
@@ -2052,6 +2480,7 @@ class QMPMonitor(Monitor):
                             (the exception's args are (cmd, args, data)
                             where data is the error data)
         """
+        debug = self._log_sampled(cmd, debug)
         self._log_command(cmd, debug)
         if not self._acquire_lock():
             raise MonitorLockError(
@@ -2071,7 +2500,7 @@ class QMPMonitor(Monitor):
                 else None
             )
             if debug:
-                LOG.debug("Send command: %s" % cmdobj)
+                LOG.debug("Send command: %s", cmdobj)
             self._send(msg, fds)
             # Read response
             r = self._get_response(q_id, timeout)
@@ -2155,6 +2584,77 @@ class QMPMonitor(Monitor):
         """
         return self.cmd_obj(self._build_cmd(cmd, args, q_id), timeout)
 
+    def cmd_many(self, cmds, timeout=CMD_TIMEOUT, debug=True):
+        """
+        Send several QMP commands at once and return their responses.
+
+        All the commands are written before reading any response so QEMU
+        executes them back to back (in the given order) without waiting for
+        a round trip per command.
+
+        :param cmds: List of (cmd, args) tuples, args might be None
+        :param timeout: Time duration to wait for all the responses
+        :param debug: Whether to print the commands being sent and responses
+        :return: List of results in the order of cmds, the "return" value of
+                 the successful commands and QMPCmdError instances of the
+                 failed ones
+        :raise MonitorLockError: Raised if the lock cannot be acquired
+        :raise MonitorSocketError: Raised if a socket error occurs
+        :raise MonitorProtocolError: Raised if some response is not received
+        """
+        if not cmds:
+            return []
+        for cmd, _ in cmds:
+            self._log_command(cmd, debug)
+        if not self._acquire_lock():
+            raise MonitorLockError(
+                "Could not acquire exclusive lock to send %d QMP commands" % len(cmds)
+            )
+
+        try:
+            self._read_objects()
+            prefix = utils_misc.generate_random_string(8)
+            q_ids = ["%s-%d" % (prefix, i) for i in range(len(cmds))]
+            cmdobjs = [
+                json.dumps(self._build_cmd(cmd, args, q_id))
+                for (cmd, args), q_id in zip(cmds, q_ids)
+            ]
+            if debug:
+                for cmdobj in cmdobjs:
+                    LOG.debug("Send command: %s", cmdobj)
+            self._send("\n".join(cmdobjs).encode())
+            pending = set(q_ids)
+            responses = {}
+            end_time = time.time() + timeout
+            while len(responses) < len(q_ids) and self._data_available(
+                end_time - time.time()
+            ):
+                for obj in self._read_objects():
+                    if not isinstance(obj, dict) or obj.get("id") not in pending:
+                        continue
+                    if "return" in obj or "error" in obj:
+                        responses[obj["id"]] = obj
+            missing = [
+                cmd for (cmd, _), q_id in zip(cmds, q_ids) if q_id not in responses
+            ]
+            if missing:
+                raise MonitorProtocolError(
+                    "Received no response to QMP commands %s" % missing
+                )
+            out = []
+            for (cmd, args), q_id in zip(cmds, q_ids):
+                resp = responses[q_id]
+                if "error" in resp:
+                    out.append(QMPCmdError(cmd, args, resp["error"]))
+                else:
+                    if resp["return"]:
+                        self._log_response(cmd, resp["return"], debug)
+                    out.append(resp["return"])
+            return out
+
+        finally:
+            self._lock.release()
+
     def verify_responsive(self):
         """
         Make sure the monitor is responsive by sending a command.
@@ -2226,6 +2726,97 @@ class QMPMonitor(Monitor):
             if e.get("event") == name:
                 return e
 
+    def _pop_event(self, names, match=None):
+        """
+        Read pending data and remove the first event matching the criteria
+        from the list of events.
+
+        :param names: List of event names to look for
+        :param match: Optional callable taking the event object, the event is
+                      only considered when it returns True
+        :return: An event object or None if none is found
+        :raise MonitorLockError: Raised if the lock cannot be acquired
+        """
+        if not self._acquire_lock():
+            raise MonitorLockError(
+                "Could not acquire exclusive lock to read " "QMP events"
+            )
+        try:
+            self._read_objects()
+            for e in self._events:
+                if e.get("event") in names and (match is None or match(e)):
+                    self._events.remove(e)
+                    return e
+        finally:
+            self._lock.release()
+
+    def wait_for_event(self, names, timeout, match=None):
+        """
+        Wait for an event and remove it from the list of events.
+
+        Instead of polling get_event() in fixed steps, block on the monitor
+        socket so the caller wakes up as soon as QEMU emits the event.
+
+        :param names: Event name or list of event names (e.g. 'MIGRATION')
+        :param timeout: Time duration to wait for the event
+        :param match: Optional callable taking the event object, the event is
+                      only considered when it returns True
+        :return: An event object or None if timeout expires
+        """
+        if isinstance(names, six.string_types):
+            names = [names]
+        end_time = time.time() + timeout
+        while True:
+            event = self._pop_event(names, match)
+            if event is not None:
+                return event
+            remaining = end_time - time.time()
+            if remaining <= 0 or self._server_closed:
+                return None
+            # Other threads may consume the data we are woken up for, so never
+            # block for too long without re-checking the list of events.
+            self._data_available(min(remaining, self.EVENT_WAIT_STEP))
+
+    def add_event_listener(self, listener):
+        """
+        Register a callable invoked with every event read from the monitor.
+
+        Listeners see the events regardless of who reads them (command
+        responses, get_events(), wait_for_event()) and must not issue
+        monitor commands themselves.
+
+        :param listener: Callable taking the event object
+        """
+        self._event_listeners.append(listener)
+
+    def remove_event_listener(self, listener):
+        """
+        Unregister a callable added by add_event_listener().
+
+        :param listener: The callable to remove
+        """
+        self._event_listeners.remove(listener)
+
+    @property
+    def job_tracker(self):
+        """
+        The BlockJobTracker following the jobs of this monitor.
+        """
+        if self._job_tracker is None:
+            self._job_tracker = BlockJobTracker(self)
+        return self._job_tracker
+
+    def wait_job(self, job_id, status, timeout=CMD_TIMEOUT):
+        """
+        Wait for a (block) job to reach the given status.
+
+        :param job_id: The job ID (the device name for legacy block jobs)
+        :param status: Job status, e.g. 'ready', 'concluded' or 'null'
+        :param timeout: Time duration to wait
+        :return: Dict describing the tracked state of the job
+        """
+        return self.job_tracker.wait_job(job_id, status, timeout)
+
     def human_monitor_cmd(self, cmd="", timeout=CMD_TIMEOUT, debug=True, fd=None):
         """
         Run human monitor command in QMP through human-monitor-command
@@ -2237,6 +2828,7 @@ class QMPMonitor(Monitor):
 
         :return: The response to the command
         """
+        debug = self._log_sampled(cmd, debug)
         self._log_command(cmd, debug, extra_str="(via Human Monitor)")
 
         args = {"command-line": cmd}
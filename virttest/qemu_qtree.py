@@ -13,7 +13,7 @@ import re
 import six
 from six.moves import xrange
 
-from . import arch, data_dir, storage, utils_misc
+from . import arch, data_dir, qemu_monitor, storage, utils_misc
 
 LOG = logging.getLogger("avocado." + __name__)
 
@@ -24,6 +24,10 @@ _RE_CLASS = re.compile(
     r"^class ([^,]*), addr (\w\w:\w\w.\w+), pci id "
     "(\w{4}:\w{4}) \(sub (\w{4}:\w{4})\)"
 )
+# QOM children which can't contain any qdev device or bus
+_QOM_SKIP_TYPES = ("qemu:memory-region", "irq")
+# Generic QOM properties of devices which are not part of 'info qtree'
+_QOM_SKIP_PROPS = ("type", "realized", "hotplugged", "hotpluggable")
 
 
 class IncompatibleTypeError(TypeError):
@@ -238,6 +242,36 @@ class QtreeDisk(QtreeDev):
         return re.sub("['\"]", "", self.qtree.get("drive"))
 
 
+def _hook_usb2_disk(node):
+    """
+    usb2 disk - from point of qtree - is scsi disk inside the
+    usb-storage device.
+    """
+    # We're looking for scsi disk with grand-grand parent of
+    # usb storage type
+    if not isinstance(node, QtreeDisk):
+        return  # Not a disk
+    if not node.get_qtree().get("type").startswith("scsi"):
+        return  # Not scsi disk
+    if not (node.get_parent() and node.get_parent().get_parent()):
+        return  # Doesn't have grand-grand parent
+    if not (node.get_parent().get_parent().get_qtree().get("type") == "usb-storage"):
+        return  # grand-grand parent is not usb-storage
+    # This disk is not scsi disk, it's virtual usb-storage drive
+    node.update_qtree_prop("type", "usb2")
+
+
+def _qom_to_qtree_value(value):
+    """
+    Converts value returned by ``qom-get`` into 'info qtree'-like string.
+    """
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    if value is None or value == "":
+        return "<null>"
+    return "%s" % value
+
+
 class QtreeContainer(object):
     """Container for Qtree"""
 
@@ -273,26 +307,6 @@ class QtreeContainer(object):
                 new.add_child(child)
             return new
 
-        def _hook_usb2_disk(node):
-            """
-            usb2 disk - from point of qtree - is scsi disk inside the
-            usb-storage device.
-            """
-            # We're looking for scsi disk with grand-grand parent of
-            # usb storage type
-            if not isinstance(node, QtreeDisk):
-                return  # Not a disk
-            if not node.get_qtree().get("type").startswith("scsi"):
-                return  # Not scsi disk
-            if not (node.get_parent() and node.get_parent().get_parent()):
-                return  # Doesn't have grand-grand parent
-            if not (
-                node.get_parent().get_parent().get_qtree().get("type") == "usb-storage"
-            ):
-                return  # grand-grand parent is not usb-storage
-            # This disk is not scsi disk, it's virtual usb-storage drive
-            node.update_qtree_prop("type", "usb2")
-
         info = info.split("\n")
         current = None
         offset = 0
@@ -385,6 +399,124 @@ class QtreeContainer(object):
         for i in xrange(len(self.nodes)):
             _hook_usb2_disk(self.nodes[i])
 
+    def parse_qom_tree(self, monitor, root="/machine"):
+        """
+        Builds the qtree out of the QOM composition tree. Creates list of
+        self.nodes the same way as ``parse_info_qtree`` does (last node is
+        the main-system-bus) but uses only QMP so it does not depend on the
+        format of the human monitor output.
+
+        The tree is walked by ``qom-list`` one level at a time and the qdev
+        properties of all devices are read by ``qom-get``, each step being
+        sent to the monitor as a single batch of commands.
+
+        :param monitor: QMP monitor of the VM
+        :param root: QOM path to start the walk from
+        """
+
+        def _walk(node):
+            for child in node.get_children():
+                for _ in _walk(child):
+                    yield _
+            yield node
+
+        # Walk the composition tree, objects = [(path, qom_type, props), ..]
+        objects = []
+        level = [(root, None)]
+        while level:
+            cmds = [("qom-list", {"path": path}) for path, _ in level]
+            outs = monitor.cmd_many(cmds, debug=False)
+            next_level = []
+            for (path, qom_type), out in zip(level, outs):
+                if isinstance(out, qemu_monitor.QMPCmdError):
+                    LOG.debug("Skipping QOM object %s: %s", path, out)
+                    continue
+                objects.append((path, qom_type, out))
+                for prop in out:
+                    child_type = prop["type"]
+                    if not child_type.startswith("child<"):
+                        continue
+                    child_type = child_type[6:-1]
+                    if child_type in _QOM_SKIP_TYPES:
+                        continue
+                    next_level.append(("%s/%s" % (path, prop["name"]), child_type))
+            level = next_level
+
+        # Devices are linked to their bus, buses are children of the device
+        devices = []
+        buses = {}
+        gets = []
+        for path, qom_type, props in objects:
+            names = [prop["name"] for prop in props]
+            if "parent_bus" in names:
+                devices.append((path, qom_type))
+                gets.append((path, "parent_bus"))
+                for prop in props:
+                    if prop["name"] in _QOM_SKIP_PROPS:
+                        continue
+                    if prop["type"].startswith(("child<", "link<")):
+                        continue
+                    gets.append((path, prop["name"]))
+            elif "hotplug-handler" in names and "realized" in names:
+                buses[path] = qom_type
+        cmds = [("qom-get", {"path": path, "property": name}) for path, name in gets]
+        values = {}
+        for (path, name), out in zip(gets, monitor.cmd_many(cmds, debug=False)):
+            if isinstance(out, qemu_monitor.QMPCmdError):
+                LOG.debug("Unable to get %s of %s: %s", name, path, out)
+                continue
+            values.setdefault(path, {})[name] = out
+
+        nodes = {}
+        for path, qom_type in six.iteritems(buses):
+            node = QtreeBus()
+            if qom_type == "System":
+                # sysbus is the only bus whose name differs from QOM name
+                node.set_qtree_prop("id", "main-system-bus")
+            else:
+                node.set_qtree_prop("id", path.rsplit("/", 1)[1])
+            node.set_qtree_prop("type", qom_type)
+            nodes[path] = node
+        for path, qom_type in devices:
+            props = values.get(path, {})
+            bus = nodes.get(props.pop("parent_bus", None))
+            if bus is None:
+                continue  # Not plugged into any bus (cpus, ...)
+            qtree = {"type": qom_type}
+            if path.startswith("/machine/peripheral/"):
+                qtree["id"] = path.rsplit("/", 1)[1]
+            for name, value in six.iteritems(props):
+                if (
+                    name == "addr"
+                    and isinstance(value, int)
+                    and bus.get_qtree()["type"] in ("PCI", "PCIE")
+                ):
+                    # pci devfn is shown as slot.function in qtree
+                    value = "%02x.%x" % (value >> 3, value & 7)
+                qtree[name] = _qom_to_qtree_value(value)
+            node = QtreeDev()
+            node.set_qtree(qtree)
+            node = node.guess_type()()
+            node.set_qtree(qtree)
+            node.set_parent(bus)
+            bus.add_child(node)
+            nodes[path] = node
+        for path in buses:
+            parent = nodes.get(path.rsplit("/", 1)[0])
+            if isinstance(parent, QtreeDev):
+                nodes[path].set_parent(parent)
+                parent.add_child(nodes[path])
+
+        self.nodes = []
+        roots = [nodes[path] for path in buses if nodes[path].get_parent() is None]
+        # main-system-bus has to be the last one
+        roots.sort(key=lambda node: node.get_qtree()["type"] == "System")
+        for root_node in roots:
+            self.nodes.extend(_walk(root_node))
+        # This is the place to put HOOKs for nasty qtree devices
+        for node in self.nodes:
+            _hook_usb2_disk(node)
+
 
 class QtreeDisksContainer(object):
     """
@@ -431,6 +563,39 @@ class QtreeDisksContainer(object):
                 additional += 1
         return (additional, missing)
 
+    def parse_query_block(self, monitor):
+        """
+        Extracts all information about self.disks from QMP and fills them in.
+
+        ``query-block`` and ``query-named-block-nodes`` are sent as one
+        batch; block backends are matched by their name as well as by the
+        node-name of their root node, named nodes cover disks attached to
+        a node which is not the root of any backend (-blockdev).
+
+        :param monitor: QMP monitor of the VM
+        :return: the same as ``parse_info_block``
+        """
+        cmds = [("query-block", None), ("query-named-block-nodes", None)]
+        blocks, named_nodes = monitor.cmd_many(cmds, debug=False)
+        if isinstance(blocks, qemu_monitor.QMPCmdError):
+            raise blocks
+        info = {}
+        if not isinstance(named_nodes, qemu_monitor.QMPCmdError):
+            for node in named_nodes:
+                if node.get("node-name"):
+                    info[node["node-name"]] = dict(node)
+        for block in blocks:
+            block = dict(block)
+            inserted = block.pop("inserted", None)
+            props = dict(inserted or {})
+            if inserted is None:
+                props["not-inserted"] = True
+            props.update(block)
+            for name in (block.get("device"), props.get("node-name")):
+                if name:
+                    info[name] = props
+        return self.parse_info_block(info)
+
     def generate_params(self):
         """
         Generate params from current self.qtree and self.block info.
@@ -7,6 +7,7 @@ Utility classes and functions to handle Virtual Machine creation using qemu.
 from __future__ import division
 
 import ast
+import collections
 import fcntl
 import json
 import logging
@@ -16,6 +17,7 @@ import random
 import re
 import shutil
 import sys
+import threading
 import time
 from functools import partial, reduce
 from operator import mul
@@ -34,9 +36,11 @@ from virttest import (
     data_dir,
     error_context,
     error_event,
+    guest_agent,
     qemu_migration,
     qemu_monitor,
     qemu_virtio_port,
+    qemu_vm_template,
     storage,
     test_setup,
     utils_logfile,
@@ -115,12 +119,75 @@ class ImageUnbootableError(virt_vm.VMError):
         )
 
 
+class QemuOutputWatcher(object):
+    """
+    Output function of the qemu process which logs its output and scans
+    each new line once for failures, instead of searching the whole output
+    again and again. Only the last lines are kept.
+    """
+
+    # The first line matching each pattern is recorded
+    PATTERNS = (
+        ("kvm_init", r"Could not initialize KVM"),
+        ("hugepage", r"alloc_mem_area"),
+        ("migration_proto", r"unknown migration protocol"),
+        ("core_dumped", r"\(core dumped\)"),
+        ("kvm_internal", r"KVM internal error\."),
+    )
+    # Failures which make the VM creation fail
+    CREATE_FAILURES = ("kvm_init", "hugepage", "migration_proto")
+    _REGEX = re.compile("|".join("(?P<%s>%s)" % _ for _ in PATTERNS), re.IGNORECASE)
+
+    def __init__(self, prefix="", max_lines=1000):
+        """
+        :param prefix: Prefix of the logged lines
+        :param max_lines: Number of the last lines kept
+        """
+        self.prefix = prefix
+        self.lines = collections.deque(maxlen=max_lines)
+        self.line_count = 0
+        # {name: (line number, offset of the match, line)}
+        self.matches = {}
+
+    def __call__(self, line):
+        _picklable_logger(self.prefix + line)
+        self.lines.append(line)
+        self.line_count += 1
+        match = self._REGEX.search(line)
+        if match and match.lastgroup not in self.matches:
+            self.matches[match.lastgroup] = (self.line_count, match.start(), line)
+
+    def get_output(self):
+        """:return: The last lines of the output"""
+        return "\n".join(self.lines)
+
+    def get_output_since(self, name):
+        """
+        :param name: Name of the pattern
+        :return: The output from the first match of the pattern on (the
+                 kept lines only) or None when it didn't match
+        """
+        if name not in self.matches:
+            return None
+        line_number, offset, line = self.matches[name]
+        first = self.line_count - len(self.lines) + 1
+        lines = list(self.lines)[max(line_number - first + 1, 0) :]
+        return "\n".join([line[offset:]] + lines)
+
+    def has_create_failure(self):
+        """:return: True when the output shows the VM creation failed"""
+        return any(_ in self.matches for _ in self.CREATE_FAILURES)
+
+
 def clean_tmp_files():
     if os.path.isfile(CREATE_LOCK_FILENAME):
         os.unlink(CREATE_LOCK_FILENAME)
 
 
 CREATE_LOCK_FILENAME = os.path.join(data_dir.get_tmp_dir(), "avocado-vt-vm-create.lock")
+# The lock file only serializes processes, the VMs of a test can be created
+# by several threads
+CREATE_THREAD_LOCK = threading.RLock()
 
 
 def qemu_proc_term_handler(vm, monitor_exit_status, exit_status):
@@ -195,6 +262,12 @@ class VM(virt_vm.BaseVM):
             self.remote_sessions = []
             self.logsessions = {}
             self.deferral_incoming = False
+            self.migration_events = False
+            self.migration_timeline = []
+            # (protocol, params, VM) of the destination of the next migration
+            self.prespawned_dest = None
+            # Image params of the overlays a pooled VM runs on
+            self.pool_overlays = None
 
         self.name = name
         self.params = params
@@ -355,10 +428,64 @@ class VM(virt_vm.BaseVM):
                 'Unexpected VM status: "%s"' % self.monitor.get_status()
             )
 
+    def _get_output_watcher(self):
+        """
+        :return: The QemuOutputWatcher of the qemu process or None when the
+                 process output isn't watched
+        """
+        watcher = getattr(self.process, "output_func", None)
+        if isinstance(watcher, QemuOutputWatcher):
+            return watcher
+        return None
+
+    def _sync_output_watcher(self, timeout=5):
+        """
+        Wait until the watcher saw the whole output of a terminated qemu.
+
+        :param timeout: Time (seconds) to wait for the tail thread
+        :return: The QemuOutputWatcher or None
+        """
+        watcher = self._get_output_watcher()
+        thread = getattr(self.process, "tail_thread", None)
+        if (
+            watcher is not None
+            and thread is not None
+            and thread is not threading.current_thread()
+            and not self.process.is_alive()
+        ):
+            thread.join(timeout)
+        return watcher
+
+    def _get_create_error(self, qemu_command, migration_mode=None):
+        """
+        Check the qemu output seen so far for failures of its creation.
+
+        :param qemu_command: The qemu command line
+        :param migration_mode: Migration mode of the incoming VM
+        :return: The VMCreateError to raise or None
+        """
+        watcher = self._sync_output_watcher()
+        if watcher is None:
+            return None
+        if "kvm_init" in watcher.matches:
+            return virt_vm.VMKVMInitError(qemu_command, watcher.get_output())
+        if "hugepage" in watcher.matches:
+            return virt_vm.VMHugePageError(qemu_command, watcher.get_output())
+        if migration_mode is not None and "migration_proto" in watcher.matches:
+            return VMMigrateProtoUnsupportedError(
+                migration_mode, watcher.get_output().strip()
+            )
+        return None
+
     def verify_userspace_crash(self):
         """
         Verify if the userspace component (qemu) crashed.
         """
+        watcher = self._sync_output_watcher()
+        if watcher is not None:
+            if "core_dumped" in watcher.matches:
+                raise QemuSegFaultError(watcher.matches["core_dumped"][2])
+            return
         if "(core dumped)" in self.process.get_output():
             for line in self.process.get_output().splitlines():
                 if "(core dumped)" in line:
@@ -368,6 +495,11 @@ class VM(virt_vm.BaseVM):
         """
         Verify KVM internal error.
         """
+        watcher = self._sync_output_watcher()
+        if watcher is not None:
+            if "kvm_internal" in watcher.matches:
+                raise KVMInternalError(watcher.get_output_since("kvm_internal"))
+            return
         if "KVM internal error." in self.process.get_output():
             out = self.process.get_output()
             out = out[out.find("KVM internal error.") :]
@@ -1839,6 +1971,7 @@ class VM(virt_vm.BaseVM):
             params.get("strict_mode"),
             params.get("workaround_qemu_qmp_crash"),
             params.get("allow_hotplugged_vm"),
+            params.get("qemu_caps_cache", "yes"),
         )
         StrDev = qdevices.QStringDevice
         QDevice = qdevices.QDevice
@@ -2402,6 +2535,9 @@ class VM(virt_vm.BaseVM):
                     dev, self._get_cmdline_format_cfg(), "monitors"
                 )
                 devices.insert(dev)
+            elif monitor_params.get("hmp_over_qmp"):
+                # Served through human-monitor-command of a QMP monitor
+                continue
             else:
                 cmd = add_human_monitor(devices, monitor_name, monitor_filename)
                 dev = StrDev("HMP-%s" % monitor_name, cmdline=cmd)
@@ -3323,7 +3459,7 @@ class VM(virt_vm.BaseVM):
         self.serial_console = aexpect.ShellSession(
             "nc -U %s" % file_name,
             auto_close=False,
-            output_func=utils_logfile.log_line,
+            output_func=virt_vm.KernelCrashDetector(utils_logfile.log_line),
             output_params=(log_name,),
             prompt=self.params.get("shell_prompt", "[\#\$]"),
             status_test_command=self.params.get("status_test_command", "echo $?"),
@@ -3457,22 +3593,55 @@ class VM(virt_vm.BaseVM):
         )
         return self.spice_options.get("spice_tls_port")
 
+    def _get_daemons(self):
+        """Return the daemon devices of qemu device."""
+        if not self.devices:
+            return []
+        return [dev for dev in self.devices if isinstance(dev, qdevices.QDaemonDev)]
+
     def _start_daemons(self):
-        """Start the daemons of qemu device."""
-        if self.devices:
-            for dev in self.devices:
-                if isinstance(dev, qdevices.QDaemonDev):
-                    dev.start_daemon()
+        """
+        Start the daemons of qemu device.
+
+        The daemons don't depend on each other, they are started concurrently
+        so the VM waits for the slowest one instead of the sum of them. When
+        any of them fails, the started ones are stopped and the first error
+        is raised.
+        """
+        daemons = self._get_daemons()
+        if len(daemons) < 2:
+            for dev in daemons:
+                dev.start_daemon()
+            return
+        threads = [utils_misc.InterruptedThread(dev.start_daemon) for dev in daemons]
+        for thread in threads:
+            thread.start()
+        error = None
+        for thread in threads:
+            try:
+                thread.join()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            self._stop_daemons()
+            six.reraise(*error)
 
     def _stop_daemons(self):
-        """Stop the daemons of qemu device."""
-        if self.devices:
-            for dev in self.devices:
-                if isinstance(dev, qdevices.QDaemonDev):
-                    try:
-                        dev.stop_daemon()
-                    except DeviceError as err:
-                        LOG.error("Failed to stop daemon: %s", err)
+        """Stop the daemons of qemu device concurrently."""
+
+        def _stop_daemon(dev):
+            try:
+                dev.stop_daemon()
+            except DeviceError as err:
+                LOG.error("Failed to stop daemon: %s", err)
+
+        daemons = self._get_daemons()
+        if len(daemons) < 2:
+            for dev in daemons:
+                _stop_daemon(dev)
+            return
+        utils_misc.parallel([(_stop_daemon, (dev,)) for dev in daemons])
 
     @error_context.context_aware
     def create(
@@ -3503,6 +3672,9 @@ class VM(virt_vm.BaseVM):
         :param mac_source: A VM object from which to copy MAC addresses. If not
                 specified, new addresses will be generated.
 
+        When "vm_template = yes" the VM is restored from the saved state of
+        the same configuration, see :class:`qemu_vm_template.VMTemplate`.
+
         :raise VMCreateError: If qemu terminates unexpectedly
         :raise VMKVMInitError: If KVM initialization fails
         :raise VMHugePageError: If hugepage initialization fails
@@ -3531,6 +3703,13 @@ class VM(virt_vm.BaseVM):
         name = self.name
         params = self.params
         root_dir = self.root_dir
+
+        if migration_mode is None and params.get("vm_template") == "yes":
+            template = qemu_vm_template.VMTemplate(self, params)
+            if template.is_usable():
+                template.create_vm(timeout)
+                return
+
         pass_fds = []
         if migration_fd:
             pass_fds.append(int(migration_fd))
@@ -3589,8 +3768,13 @@ class VM(virt_vm.BaseVM):
 
         # Make sure the following code is not executed by more than one thread
         # at the same time
-        lockfile = open(CREATE_LOCK_FILENAME, "w+")
-        fcntl.lockf(lockfile, fcntl.LOCK_EX)
+        CREATE_THREAD_LOCK.acquire()
+        try:
+            lockfile = open(CREATE_LOCK_FILENAME, "w+")
+            fcntl.lockf(lockfile, fcntl.LOCK_EX)
+        except Exception:
+            CREATE_THREAD_LOCK.release()
+            raise
 
         try:
             # Handle port redirections
@@ -3859,11 +4043,15 @@ class VM(virt_vm.BaseVM):
                 monitor_exit_status = params.get_boolean(
                     "vm_monitor_exit_status", False
                 )
+                # Failures are spotted as soon as qemu prints them
                 self.process = aexpect.run_tail(
                     qemu_command,
                     partial(qemu_proc_term_handler, self, monitor_exit_status),
-                    _picklable_logger,
-                    "[qemu output] ",
+                    QemuOutputWatcher(
+                        "[qemu output] ",
+                        int(params.get("vm_output_watcher_lines", 1000)),
+                    ),
+                    "",
                     auto_close=False,
                     pass_fds=pass_fds,
                 )
@@ -3904,20 +4092,27 @@ class VM(virt_vm.BaseVM):
 
             # Make sure the process was started successfully
             if not self.process.is_alive():
-                status = self.process.get_status()
-                output = self.process.get_output().strip()
-                migration_in_course = migration_mode is not None
-                unknown_protocol = "unknown migration protocol" in output
-                if migration_in_course and unknown_protocol:
-                    e = VMMigrateProtoUnsupportedError(migration_mode, output)
-                else:
-                    e = virt_vm.VMCreateError(qemu_command, status, output)
+                e = self._get_create_error(qemu_command, migration_mode)
+                if e is None:
+                    status = self.process.get_status()
+                    output = self.process.get_output().strip()
+                    migration_in_course = migration_mode is not None
+                    unknown_protocol = "unknown migration protocol" in output
+                    if migration_in_course and unknown_protocol:
+                        e = VMMigrateProtoUnsupportedError(migration_mode, output)
+                    else:
+                        e = virt_vm.VMCreateError(qemu_command, status, output)
                 self.destroy()
                 raise e
 
-            # Establish monitor connections
+            # Establish monitor connections, human monitors served by a QMP
+            # monitor can only be bound once the QMP monitors are connected
             self.monitors = []
-            for m_name in params.objects("monitors"):
+            m_order = params.objects("monitors")
+            m_names = sorted(
+                m_order, key=lambda m: bool(params.object_params(m).get("hmp_over_qmp"))
+            )
+            for m_name in m_names:
                 m_params = params.object_params(m_name)
                 if m_params.get("debugonly", "no") == "yes":
                     continue
@@ -3926,6 +4121,10 @@ class VM(virt_vm.BaseVM):
                         self, m_name, m_params, timeout
                     )
                 except qemu_monitor.MonitorConnectError as detail:
+                    e = self._get_create_error(qemu_command, migration_mode)
+                    if e is not None:
+                        self.destroy()
+                        raise e
                     if self.process.is_alive():
                         LOG.error(detail)
                         self.destroy()
@@ -3938,18 +4137,19 @@ class VM(virt_vm.BaseVM):
 
                 # Add this monitor to the list
                 self.monitors.append(monitor)
-
-            # Get the output so far, to see if we have any problems with
-            # KVM modules or with hugepage setup.
-            output = self.process.get_output()
-
-            if re.search("Could not initialize KVM", output, re.IGNORECASE):
-                e = virt_vm.VMKVMInitError(qemu_command, self.process.get_output())
-                self.destroy()
-                raise e
-
-            if "alloc_mem_area" in output:
-                e = virt_vm.VMHugePageError(qemu_command, self.process.get_output())
+            # Keep the order of the "monitors" param, it selects the main one
+            self.monitors.sort(key=lambda m: m_order.index(m.name))
+
+            # See if we have any problems with KVM modules or with hugepage
+            # setup so far.
+            e = self._get_create_error(qemu_command)
+            if e is None and self._get_output_watcher() is None:
+                output = self.process.get_output()
+                if re.search("Could not initialize KVM", output, re.IGNORECASE):
+                    e = virt_vm.VMKVMInitError(qemu_command, output)
+                elif "alloc_mem_area" in output:
+                    e = virt_vm.VMHugePageError(qemu_command, output)
+            if e is not None:
                 self.destroy()
                 raise e
 
@@ -3984,7 +4184,7 @@ class VM(virt_vm.BaseVM):
 
             # Wait for IO channels setting up completely,
             # such as serial console.
-            time.sleep(1)
+            self._wait_for_io_channels(float(params.get("vm_io_channels_timeout", 5)))
 
             if is_preconfig:
                 return
@@ -4003,6 +4203,70 @@ class VM(virt_vm.BaseVM):
         finally:
             fcntl.lockf(lockfile, fcntl.LOCK_UN)
             lockfile.close()
+            CREATE_THREAD_LOCK.release()
+
+    def _get_disconnected_chardevs(self, paths):
+        """
+        :param paths: Socket paths of chardevs
+        :return: The paths whose chardevs have no client connected
+        """
+        info = self.monitor.info("chardev", debug=False)
+        if isinstance(info, six.string_types):
+            filenames = re.findall(r"filename=(\S+)", info)
+        else:
+            filenames = [_.get("filename", "") for _ in info]
+        disconnected = [_ for _ in filenames if _.startswith("disconnected:")]
+        return [path for path in paths if any(path in _ for _ in disconnected)]
+
+    def _wait_for_io_channels(self, timeout):
+        """
+        Wait until the serial console and the log sessions are connected to
+        their chardevs, so the guest output isn't lost once it's resumed.
+
+        :param timeout: Time (seconds) to wait
+        """
+        paths = list(self.logs.values())
+        if self.serial_console is not None:
+            paths.append(self.get_serial_console_filename(self.serial_session_device))
+        if not paths:
+            return
+        start_time = time.time()
+        try:
+            connected = utils_misc.wait_for(
+                lambda: not self._get_disconnected_chardevs(paths), timeout, step=0.05
+            )
+        except Exception as details:
+            LOG.debug("Can't query the chardevs, waiting 1s instead: %s", details)
+            time.sleep(1)
+            return
+        if connected:
+            LOG.debug("IO channels connected in %.2fs", time.time() - start_time)
+        else:
+            LOG.warning(
+                "IO channels of VM %s are not connected after %ss", self.name, timeout
+            )
+
+    def _wait_ready_guest_agent(self, timeout, nic_index=0):
+        """Wait until the guest agent responds to guest-ping"""
+        name = self.params.get("gagent_name", "org.qemu.guest_agent.0")
+        serial_type = self.params.get("gagent_serial_type", "virtio")
+        gagent_params = {"monitor_filename": self.get_serial_console_filename(name)}
+        end_time = time.time() + timeout
+        while True:
+            agent = None
+            try:
+                agent = guest_agent.QemuAgent(self, name, serial_type, gagent_params)
+                # Blocks until the agent in the guest answers
+                agent.cmd("guest-ping", timeout=max(min(end_time - time.time(), 10), 1))
+                return
+            except qemu_monitor.MonitorError:
+                if time.time() >= end_time:
+                    raise virt_vm.VMNotReadyError("guest_agent", timeout)
+                # The socket was refused, the port isn't set up yet
+                time.sleep(0.1)
+            finally:
+                if agent is not None:
+                    agent.close()
 
     def wait_for_status(self, status, timeout, first=0.0, step=1.0, text=None):
         """
@@ -4122,6 +4386,7 @@ class VM(virt_vm.BaseVM):
         if self.process:
             self.process.close()
         self.cleanup_serial_console()
+        self.close_ssh_connections()
         if self.logsessions:
             for key in self.logsessions:
                 self.logsessions[key].close()
@@ -4235,6 +4500,7 @@ class VM(virt_vm.BaseVM):
                     "VM %s (PID %s) is a zombie!", self.name, self.process.get_pid()
                 )
         finally:
+            self._destroy_prespawned_dest()
             self._stop_daemons()
             self._cleanup(free_mac_addresses)
 
@@ -4478,6 +4744,7 @@ class VM(virt_vm.BaseVM):
                 self.params.get("strict_mode"),
                 self.params.get("workaround_qemu_qmp_crash"),
                 self.params.get("allow_hotplugged_vm"),
+                self.params.get("qemu_caps_cache", "yes"),
             )
             if devices.has_device("pcie-pci-bridge"):
                 bridge_type = "pcie-pci-bridge"
@@ -4989,19 +5256,21 @@ class VM(virt_vm.BaseVM):
             self.monitor.cmd("getfd", args={"fdname": fd_name}, fd=fd)
         error_context.context()
 
-    def mig_finished(self):
-        ret = True
-        if (
+    def _spice_seamless_migration(self):
+        return (
             self.params["display"] == "spice"
             and self.get_spice_var("spice_seamless_migration") == "on"
-        ):
-            s = self.monitor.info("spice")
-            if isinstance(s, six.string_types):
-                ret = len(re.findall("migrated: true", s, re.I)) > 0
-            else:
-                ret = len(re.findall("true", str(s.get("migrated")), re.I)) > 0
-        if ret is False:
-            return ret
+        )
+
+    def _spice_migrated(self):
+        s = self.monitor.info("spice")
+        if isinstance(s, six.string_types):
+            return len(re.findall("migrated: true", s, re.I)) > 0
+        return len(re.findall("true", str(s.get("migrated")), re.I)) > 0
+
+    def mig_finished(self):
+        if self._spice_seamless_migration() and not self._spice_migrated():
+            return False
         o = self.monitor.info("migrate")
         if self._mig_pre_switchover(o):
             self.monitor.migrate_continue("pre-switchover")
@@ -5059,14 +5328,197 @@ class VM(virt_vm.BaseVM):
     def mig_pre_switchover(self):
         return self._mig_pre_switchover(self.monitor.info("migrate"))
 
+    def enable_migration_events(self):
+        """
+        Turn on the "events" migrate capability of the source monitor.
+
+        Once enabled, QEMU reports the migration progress through the
+        MIGRATION and MIGRATION_PASS events and wait_for_migration() wakes up
+        on them instead of polling "info migrate".
+
+        :return: True if migration events are enabled, False otherwise
+        """
+        self.migration_events = False
+        self.migration_timeline = []
+        if self.params.get("migrate_wait_by_events", "yes") != "yes":
+            return False
+        if self.monitor.protocol != "qmp":
+            return False
+        try:
+            self.monitor.set_migrate_capability(
+                True, "events", self.DISABLE_AUTO_X_MIG_OPTS
+            )
+        except qemu_monitor.MonitorError as details:
+            LOG.debug("Migration events unavailable, fall back to polling: %s", details)
+            return False
+        self.monitor.clear_event("MIGRATION")
+        self.monitor.clear_event("MIGRATION_PASS")
+        self.migration_events = True
+        return True
+
+    def _record_migration_event(self, event):
+        """
+        Record the QEMU timestamp of a MIGRATION/MIGRATION_PASS event.
+
+        :param event: The event object
+        :return: The status ("pass <N>" for MIGRATION_PASS) of the event
+        """
+        data = event.get("data", {})
+        if event["event"] == "MIGRATION_PASS":
+            status = "pass %s" % data.get("pass")
+        else:
+            status = data.get("status")
+        stamp = event.get("timestamp", {})
+        if stamp:
+            when = stamp["seconds"] + stamp["microseconds"] / 1000000.0
+        else:
+            when = time.time()
+        self.migration_timeline.append((when, status))
+        return status
+
+    def wait_for_migration_event(self, statuses, timeout):
+        """
+        Wait until the migration reaches one of the given statuses.
+
+        MIGRATION_PASS events received in the meantime are recorded in
+        self.migration_timeline.
+
+        :param statuses: List of MIGRATION event statuses to wait for
+        :param timeout: Time to wait
+        :return: The status reached, or None if timeout expires
+        """
+        end_time = time.time() + timeout
+        while True:
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return None
+            event = self.monitor.wait_for_event(
+                ["MIGRATION", "MIGRATION_PASS"], remaining
+            )
+            if event is None:
+                return None
+            status = self._record_migration_event(event)
+            if status in statuses:
+                return status
+
+    def _log_migration_timeline(self):
+        timeline = self.migration_timeline
+        if len(timeline) < 2:
+            return
+        start = timeline[0][0]
+        for when, status in timeline:
+            LOG.debug("Migration %s at +%.3fs", status, when - start)
+        passes = [when for when, status in timeline if status.startswith("pass ")]
+        if passes:
+            LOG.info(
+                "Migration took %.3fs in %d pass(es), last pass %.3fs",
+                timeline[-1][0] - start,
+                len(passes),
+                timeline[-1][0] - passes[-1],
+            )
+
+    def _wait_for_migration_by_events(self, timeout):
+        end_time = time.time() + timeout
+        finished = ["completed", "failed", "cancelled"]
+        if self.migration_timeline and self.migration_timeline[-1][1] in finished:
+            # Already consumed while waiting for an intermediate status
+            status = self.migration_timeline[-1][1]
+        else:
+            while True:
+                status = self.wait_for_migration_event(
+                    ["pre-switchover"] + finished, end_time - time.time()
+                )
+                if status != "pre-switchover":
+                    break
+                self.monitor.migrate_continue("pre-switchover")
+        self._log_migration_timeline()
+        if status is None:
+            return False
+        if status == "completed" and self._spice_seamless_migration():
+            return utils_misc.wait_for(
+                self._spice_migrated, end_time - time.time(), 0, 0.5
+            )
+        return True
+
     def wait_for_migration(self, timeout):
-        if not utils_misc.wait_for(
-            self.mig_finished, timeout, 2, 2, "Waiting for migration to complete"
-        ):
+        if self.migration_events:
+            finished = self._wait_for_migration_by_events(timeout)
+        else:
+            finished = utils_misc.wait_for(
+                self.mig_finished, timeout, 2, 2, "Waiting for migration to complete"
+            )
+        if not finished:
             raise virt_vm.VMMigrateTimeoutError(
                 "Timeout expired while waiting" " for migration to finish"
             )
 
+    def _get_migration_dest_params(self):
+        """
+        :return: Params of the destination VM of a migration of this VM
+        """
+        params = self.params.copy()
+        if self.params.get("qemu_dst_binary", None) is not None:
+            params["qemu_binary"] = utils_misc.get_qemu_dst_binary(self.params)
+        # "preconfig" is meaningless for dest, remove it whatever the value is
+        if "qemu_preconfig" in params:
+            del params["qemu_preconfig"]
+        return params
+
+    def _prespawn_migration_dest(self, protocol):
+        """
+        Start the destination VM of the next migration of this VM, waiting
+        for the incoming migration, so the next migrate() doesn't have to
+        create it. It's done while this VM is the destination of the
+        current migration, and it shares the MAC addresses of this VM.
+
+        :param protocol: Migration protocol
+        """
+        params = self._get_migration_dest_params()
+        dest = self.clone(params=params.copy())
+        LOG.debug("Pre-spawning the next migration destination of VM %s", self.name)
+        try:
+            dest.create(migration_mode=protocol, mac_source=self)
+        except Exception as details:
+            LOG.warning(
+                "Failed to pre-spawn the migration destination of VM %s: %s",
+                self.name,
+                details,
+            )
+            dest.destroy(gracefully=False, free_mac_addresses=False)
+            return
+        self.prespawned_dest = (protocol, params, dest)
+
+    def _take_prespawned_dest(self, protocol):
+        """
+        :param protocol: Migration protocol
+        :return: The pre-spawned destination VM if it's still usable for a
+                 migration with the current params, None otherwise
+        """
+        prespawned_dest = getattr(self, "prespawned_dest", None)
+        if prespawned_dest is None:
+            return None
+        self.prespawned_dest = None
+        dest_protocol, params, dest = prespawned_dest
+        if (
+            dest_protocol == protocol
+            and params == self._get_migration_dest_params()
+            and dest.is_alive()
+        ):
+            LOG.debug("Using the pre-spawned migration destination of %s", self.name)
+            return dest
+        LOG.debug("Pre-spawned migration destination of %s is outdated", self.name)
+        dest.destroy(gracefully=False, free_mac_addresses=False)
+        return None
+
+    def _destroy_prespawned_dest(self):
+        """
+        Destroy the pre-spawned destination of the next migration, if any.
+        """
+        prespawned_dest = getattr(self, "prespawned_dest", None)
+        if prespawned_dest is not None:
+            self.prespawned_dest = None
+            prespawned_dest[2].destroy(gracefully=False, free_mac_addresses=False)
+
     @error_context.context_aware
     def migrate(
         self,
@@ -5164,15 +5616,24 @@ class VM(virt_vm.BaseVM):
             self.send_fd(fd_src, mig_fd_name)
             os.close(fd_src)
 
-        clone = self.clone()
-        if self.params.get("qemu_dst_binary", None) is not None:
-            clone.params["qemu_binary"] = utils_misc.get_qemu_dst_binary(self.params)
+        # The destination may have been started by the previous migration
+        prespawn = (
+            local
+            and protocol in ("tcp", "unix")
+            and not (stable_check or cancel_delay or not_wait_for_migration)
+            and "tpms" not in self.params
+            and self.params.get("migration_prespawn_dest") == "yes"
+        )
+        clone = None
+        if prespawn:
+            clone = self._take_prespawned_dest(protocol)
+        else:
+            self._destroy_prespawned_dest()
+        prespawned = clone is not None
+        if not prespawned:
+            clone = self.clone(params=self._get_migration_dest_params())
         if env:
             env.register_vm("%s_clone" % clone.name, clone)
-
-        # "preconfig" is meaningless for dest, remove it whatever the value is
-        if "qemu_preconfig" in clone.params:
-            del clone.params["qemu_preconfig"]
         # FIXME: localhost migration should handle all devices params automatically
         if "tpms" in clone.params:
             swtpm_dir = os.path.join(data_dir.get_data_dir(), "swtpm")
@@ -5202,8 +5663,10 @@ class VM(virt_vm.BaseVM):
                 clone.params["tpms"] = " ".join(tpms_copy)
 
         try:
-            if local and not (
-                migration_exec_cmd_src and "gzip" in migration_exec_cmd_src
+            if (
+                local
+                and not prespawned
+                and not (migration_exec_cmd_src and "gzip" in migration_exec_cmd_src)
             ):
                 error_context.context("creating destination VM")
                 if stable_check:
@@ -5393,6 +5856,7 @@ class VM(virt_vm.BaseVM):
                     _uri = uri.split(":")
                     _uri = ":[::]:".join((_uri[0], _uri[-1]))
                 clone.monitor.migrate_incoming(_uri)
+            self.enable_migration_events()
             self.monitor.migrate(uri)
 
             if mig_inner_funcs:
@@ -5405,9 +5869,15 @@ class VM(virt_vm.BaseVM):
                     elif func == "continue_pre_switchover":
                         # trigger a continue pre-switchover after the status of
                         # migration is "pre-switchover"
-                        if not utils_misc.wait_for(
-                            self.mig_pre_switchover, timeout=param, first=2, step=1
-                        ):
+                        if self.migration_events:
+                            reached = self.wait_for_migration_event(
+                                ["pre-switchover"], param
+                            )
+                        else:
+                            reached = utils_misc.wait_for(
+                                self.mig_pre_switchover, timeout=param, first=2, step=1
+                            )
+                        if not reached:
                             err = (
                                 "Timeout for waiting status of migration "
                                 "to be pre-switchover"
@@ -5437,7 +5907,18 @@ class VM(virt_vm.BaseVM):
                     raise virt_vm.VMMigrateCancelError("Cannot cancel migration")
                 return
 
-            self.wait_for_migration(timeout)
+            # Start the destination of the next migration meanwhile
+            prespawn_thread = None
+            if prespawn:
+                prespawn_thread = utils_misc.InterruptedThread(
+                    clone._prespawn_migration_dest, (protocol,)
+                )
+                prespawn_thread.start()
+            try:
+                self.wait_for_migration(timeout)
+            finally:
+                if prespawn_thread is not None:
+                    prespawn_thread.join()
 
             if local and (migration_exec_cmd_src and "gzip" in migration_exec_cmd_src):
                 error_context.context("creating destination VM")
@@ -0,0 +1,281 @@
+"""
+Pool of alive qemu VMs kept across tests.
+
+With "vm_pool = yes" a VM which doesn't match the configuration of the next
+test is parked in the pool instead of being destroyed, a later test with
+the same configuration (the fingerprint of its qemu command) takes it back
+after a cheap reset instead of starting qemu and booting the guest again.
+
+Pooled VMs run on per-VM qcow2 overlays of their images, so the parked VMs
+never hold the images open for writing, and taking a VM back discards what
+the previous test wrote to its overlays by reverting to the snapshot saved
+when it was started. VMs whose images can't be overlaid are not pooled.
+The pool is stored in the env, the least recently used VMs are destroyed
+when it exceeds "vm_pool_size" VMs or "vm_pool_mem_budget" MB of guest
+memory.
+"""
+
+import logging
+import os
+
+from virttest import data_dir, qemu_vm_template
+
+LOG = logging.getLogger("avocado." + __name__)
+
+# Internal snapshot of the freshly started VM used by "vm_pool_reset = loadvm"
+SNAPSHOT_TAG = "vm_pool"
+
+
+def overlay_params(params, overlays):
+    """
+    Return a copy of the params using the overlays.
+
+    :param params: A dict containing VM params
+    :param overlays: dict of the image params using the overlays
+    """
+    params = params.copy()
+    params.update(overlays)
+    return params
+
+
+def create_overlays(vm, params):
+    """
+    Create the per-VM overlays a pooled VM is started on.
+
+    :param vm: The qemu VM object
+    :param params: A dict containing VM params
+    :return: dict of the image params using the overlays, None when the
+             images can't be overlaid and the VM can't be pooled
+    """
+    try:
+        images = qemu_vm_template.get_local_images(params)
+    except ValueError as details:
+        LOG.warning("VM %s can't be pooled: %s", vm.name, details)
+        return None
+    directory = params.get(
+        "vm_pool_dir", os.path.join(data_dir.get_tmp_dir(), "vm_pool")
+    )
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return qemu_vm_template.create_overlays(
+        params,
+        directory,
+        vm.instance,
+        dict(
+            (name, (image["filename"], image["format"]))
+            for name, image in images.items()
+        ),
+    )
+
+
+def remove_overlays(vm):
+    """
+    Remove the overlays of a destroyed pooled VM.
+
+    :param vm: The qemu VM object
+    """
+    for key, overlay in (getattr(vm, "pool_overlays", None) or {}).items():
+        if key.startswith("image_name_") and os.path.exists(overlay + ".qcow2"):
+            os.remove(overlay + ".qcow2")
+
+
+def get_fingerprint(vm, name=None, params=None, basedir=None):
+    """
+    Fingerprint of a qemu VM configuration.
+
+    :param vm: The qemu VM object
+    :param name: The name of the VM, the VM one by default
+    :param params: A dict containing VM params, the VM ones by default
+    :param basedir: Base directory for relative filenames
+    :return: The qemu command line without the instance specific values
+    """
+    if params is not None:
+        # The pooled VMs run on qcow2 overlays, their paths are normalized
+        params = overlay_params(
+            params,
+            dict(("image_format_%s" % _, "qcow2") for _ in params.objects("images")),
+        )
+    devices = vm.make_create_command(name, params, basedir)[0]
+    return qemu_vm_template.normalize_cmdline(devices.cmdline())
+
+
+def prepare_vm(vm, params):
+    """
+    Save the snapshot a freshly created VM is reverted to when it's taken
+    out of the pool, once its guest is ready.
+
+    The VM runs unpooled (its pool overlays are forgotten) when the
+    snapshot can't be saved, e.g. the guest isn't ready or a device
+    doesn't support snapshots (raw pflash, migration blockers).
+
+    :param vm: The qemu VM object, started on the overlays
+    :param params: A dict containing VM params
+    """
+    if params.get("vm_pool_reset", "loadvm") != "loadvm":
+        return
+    try:
+        if params.get("paused_after_start_vm") == "yes":
+            raise ValueError("the guest wasn't started")
+        if not params.get("vm_ready_conditions"):
+            # The ready conditions were already waited for
+            login_timeout = int(params.get("vm_pool_login_timeout", 360))
+            vm.wait_for_login(timeout=login_timeout).close()
+        vm.pause()
+        try:
+            # Not vm.savevm(), it resets the guest after saving
+            output = vm.monitor.human_monitor_cmd("savevm %s" % SNAPSHOT_TAG)
+            if SNAPSHOT_TAG not in vm.monitor.human_monitor_cmd("info snapshots"):
+                raise ValueError(output.strip() or "snapshot not saved")
+        finally:
+            vm.resume()
+    except Exception as details:
+        LOG.warning(
+            "Can't save the pool snapshot of VM %s, not pooling it: %s",
+            vm.name,
+            details,
+        )
+        vm.pool_overlays = None
+
+
+class VMPool(object):
+    """
+    Alive VMs parked by previous tests, the least recently used first.
+    """
+
+    def __init__(self):
+        # [(fingerprint, vm)]
+        self.entries = []
+
+    @classmethod
+    def get(cls, env):
+        """
+        Return the pool stored in the env, create it when missing.
+
+        :param env: The environment (a dict-like object)
+        """
+        pool = env.get("vm_pool")
+        if pool is None:
+            pool = env["vm_pool"] = cls()
+        return pool
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, vm, params):
+        """
+        Park a VM in the pool.
+
+        :param vm: The qemu VM object, it's not registered in the env anymore
+        :param params: A dict containing the pool params of the current test
+        :return: True when the VM was parked, False when it was destroyed
+        """
+        try:
+            if not vm.is_alive():
+                return False
+            if not getattr(vm, "pool_overlays", None):
+                raise ValueError("it doesn't run on pool overlays")
+            fingerprint = get_fingerprint(vm)
+        except Exception as details:
+            LOG.warning("Not parking VM %s in the pool: %s", vm.name, details)
+            self._destroy(vm, gracefully=False)
+            return False
+        LOG.debug("Parking VM %s (PID %s) in the pool", vm.name, vm.get_pid())
+        self.entries.append((fingerprint, vm))
+        self.evict(params)
+        return True
+
+    def take(self, vm, name, params, basedir):
+        """
+        Take a VM matching the requested configuration out of the pool.
+
+        :param vm: VM object used to fingerprint the requested configuration
+        :param name: The name of the VM
+        :param params: A dict containing VM params
+        :param basedir: Base directory for relative filenames
+        :return: The alive VM or None when there is no matching VM
+        """
+        if not self.entries:
+            return None
+        try:
+            fingerprint = get_fingerprint(vm, name, params, basedir)
+        except Exception as details:
+            LOG.warning("Can't look up VM %s in the pool: %s", name, details)
+            return None
+        for entry in reversed(self.entries):
+            if entry[0] != fingerprint:
+                continue
+            candidate = entry[1]
+            if not candidate.is_alive():
+                self.entries.remove(entry)
+                self._destroy(candidate)
+                continue
+            requested = overlay_params(params, candidate.pool_overlays)
+            # The fingerprint doesn't cover everything (e.g. networking)
+            if candidate.needs_restart(name=name, params=requested, basedir=basedir):
+                continue
+            self.entries.remove(entry)
+            LOG.info("Reusing VM %s (PID %s) from the pool", name, candidate.get_pid())
+            self.reset(candidate, requested)
+            return candidate
+        return None
+
+    @staticmethod
+    def reset(vm, params):
+        """
+        Reset a VM taken out of the pool.
+
+        "vm_pool_reset" selects the method, "loadvm" (default) reverts the
+        VM including its overlays to the internal snapshot taken after it
+        was created, "system_reset" only resets the guest and "none" leaves
+        it as the previous test left it, both keep what was written to the
+        overlays.
+
+        :param vm: The qemu VM object
+        :param params: A dict containing VM params
+        """
+        method = params.get("vm_pool_reset", "loadvm")
+        if method == "loadvm":
+            vm.pause()
+            vm.loadvm(SNAPSHOT_TAG)
+            vm.resume()
+        elif method == "system_reset":
+            vm.monitor.system_reset()
+        vm.params = params
+
+    @staticmethod
+    def _destroy(vm, gracefully=False):
+        """Destroy a pooled VM and remove its overlays"""
+        try:
+            vm.destroy(gracefully=gracefully)
+        except Exception as details:
+            LOG.warning("Failed to destroy VM %s: %s", vm.name, details)
+        else:
+            remove_overlays(vm)
+
+    def evict(self, params):
+        """
+        Destroy the least recently used VMs exceeding the pool limits.
+
+        :param params: A dict containing the pool params of the current test
+        """
+        size = int(params.get("vm_pool_size", 2))
+        mem_budget = int(params.get("vm_pool_mem_budget", 0))
+
+        def _mem():
+            return sum(int(_[1].params.get("mem", 0)) for _ in self.entries)
+
+        while self.entries and (
+            len(self.entries) > size or (mem_budget and _mem() > mem_budget)
+        ):
+            vm = self.entries.pop(0)[1]
+            LOG.debug("Evicting VM %s (PID %s) from the pool", vm.name, vm.get_pid())
+            self._destroy(vm)
+
+    def destroy(self, gracefully=False):
+        """
+        Destroy all the VMs in the pool.
+
+        :param gracefully: Whether to try shutting the guests down first
+        """
+        while self.entries:
+            self._destroy(self.entries.pop()[1], gracefully)
@@ -0,0 +1,322 @@
+"""
+Boot-once, restore-many qemu VM templates.
+
+When "vm_template = yes" the guest is booted once for each VM configuration
+(the fingerprint of its qemu command), its state is saved after the login
+prompt and the following VMs with the same configuration are started from
+the saved state with "-incoming" on fresh qcow2 overlays instead of booting
+the guest again.
+
+The images are never written to. The template boot runs on a "template
+disk" overlay backed by the image, which is frozen once the state is saved,
+and every restore runs on a new overlay backed by the template disk.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+
+from avocado.utils import process
+
+from virttest import data_dir, storage, utils_misc, virt_vm
+
+LOG = logging.getLogger("avocado." + __name__)
+
+# Values which differ between instances of the same VM configuration and
+# don't change what the guest sees, they are left out of the fingerprint
+_VOLATILE_PARAMS_RE = re.compile(
+    r"\b(path|file|filename|mac|id|netdev|fd|fds|vhostfd|vhostfds|ifname|"
+    r"script|downscript|hostfwd)=[^,\s]+"
+)
+_VOLATILE_OPTIONS_RE = re.compile(r" -(vnc|spice|pidfile)\s+\S+")
+# Image backends which can't be used as backing files of the overlays
+_NETWORK_BACKENDS = ("curl", "nbd", "iscsi", "gluster", "ceph", "nvme", "ssh")
+
+
+def normalize_cmdline(cmdline):
+    """
+    Remove the instance specific values from the qemu command line.
+
+    :param cmdline: qemu command line
+    :return: command line shared by all instances of the configuration
+    """
+    cmdline = _VOLATILE_PARAMS_RE.sub(r"\1=*", cmdline)
+    cmdline = _VOLATILE_OPTIONS_RE.sub(r" -\1 *", cmdline)
+    return " ".join(cmdline.split())
+
+
+def get_local_images(params):
+    """
+    Describe the images of a VM, which have to be local files able to back
+    qcow2 overlays.
+
+    :param params: A dict containing VM params
+    :return: dict {image_name: {"filename", "format", "size", "mtime"}}
+    :raise ValueError: When an image is not a local file
+    """
+    base_dir = params.get("images_base_dir", data_dir.get_data_dir())
+    images = {}
+    for image_name in params.objects("images"):
+        image_params = params.object_params(image_name)
+        if image_params.get("storage_type") or any(
+            image_params.get("enable_%s" % _) == "yes" for _ in _NETWORK_BACKENDS
+        ):
+            raise ValueError("image %s is not a local file" % image_name)
+        if image_params.get("image_raw_device") == "yes":
+            raise ValueError("image %s is a raw device" % image_name)
+        filename = storage.get_image_filename(image_params, base_dir)
+        if not filename or not os.path.isfile(filename):
+            raise ValueError("image %s (%s) doesn't exist" % (image_name, filename))
+        stat = os.stat(filename)
+        images[image_name] = {
+            "filename": os.path.realpath(filename),
+            "format": image_params.get("image_format", "qcow2"),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+    return images
+
+
+def create_overlays(params, directory, suffix, backing_files):
+    """
+    Create qcow2 overlays of the images.
+
+    :param params: A dict containing VM params
+    :param directory: Directory of the overlays
+    :param suffix: Suffix of the overlay file names
+    :param backing_files: dict {image_name: (filename, format)}
+    :return: dict of the image params using the overlays
+    """
+    qemu_img = utils_misc.get_qemu_img_binary(params)
+    overlays = {}
+    for image_name, (backing_file, backing_format) in backing_files.items():
+        overlay = os.path.join(directory, "%s-%s" % (image_name, suffix))
+        if os.path.exists(overlay + ".qcow2"):
+            os.remove(overlay + ".qcow2")
+        process.run(
+            "%s create -f qcow2 -b %s -F %s %s.qcow2"
+            % (qemu_img, backing_file, backing_format, overlay)
+        )
+        overlays["image_name_%s" % image_name] = overlay
+        overlays["image_format_%s" % image_name] = "qcow2"
+    return overlays
+
+
+class VMTemplate(object):
+    """
+    Saved state of a booted VM configuration.
+    """
+
+    def __init__(self, vm, params):
+        """
+        :param vm: The qemu VM object, its create command is fingerprinted.
+        :param params: A dict containing VM params.
+        """
+        self.vm = vm
+        self.params = params
+        self.images = {}
+        self.macs = {}
+        # {address cache key: IP address} of the nics
+        self.addresses = {}
+        self.cmdline = None
+        self.template_dir = None
+        self.state_file = None
+        self.metadata_file = None
+
+    def _fingerprint(self):
+        """Find the template directory of the VM configuration"""
+        self.cmdline = normalize_cmdline(self.vm.make_create_command()[0].cmdline())
+        fingerprint = hashlib.sha1(self.cmdline.encode()).hexdigest()
+        templates_dir = self.params.get(
+            "vm_templates_dir", os.path.join(data_dir.get_tmp_dir(), "vm_templates")
+        )
+        self.template_dir = os.path.join(
+            templates_dir, "%s-%s" % (self.vm.name, fingerprint[:16])
+        )
+        self.state_file = os.path.join(self.template_dir, "state")
+        self.metadata_file = os.path.join(self.template_dir, "metadata.json")
+
+    @property
+    def name(self):
+        """Name used when the MAC addresses are copied from the template"""
+        return os.path.basename(self.template_dir)
+
+    def get_mac_address(self, nic_name):
+        """
+        Return the MAC address the guest got when the template was saved.
+
+        :param nic_name: Name of the nic
+        :raise VMMACAddressMissingError: When the template has no such nic
+        """
+        try:
+            return self.macs[nic_name]
+        except KeyError:
+            raise virt_vm.VMMACAddressMissingError(nic_name)
+
+    def is_usable(self):
+        """
+        Check all the images are local files which can back the overlays and
+        find the template of the VM configuration.
+
+        :return: True when the VM can be started from a template
+        """
+        try:
+            self.images = get_local_images(self.params)
+        except ValueError as details:
+            LOG.warning("VM %s can't use templates: %s", self.vm.name, details)
+            return False
+        if not self.images:
+            return False
+        try:
+            self._fingerprint()
+        except Exception as details:
+            LOG.warning(
+                "Can't fingerprint the configuration of VM %s, not using "
+                "templates: %s",
+                self.vm.name,
+                details,
+            )
+            return False
+        return True
+
+    def is_saved(self):
+        """
+        Check the state of the same configuration was saved.
+
+        :return: True when the saved state can be restored, False when there
+                 is no state or it was saved for different devices or images.
+        """
+        try:
+            with open(self.metadata_file) as metadata_file:
+                metadata = json.load(metadata_file)
+        except (IOError, ValueError):
+            return False
+        if metadata.get("cmdline") != self.cmdline:
+            LOG.warning(
+                "Device configuration of VM %s differs from template %s, not "
+                "reusing it",
+                self.vm.name,
+                self.template_dir,
+            )
+            return False
+        if metadata.get("images") != self.images:
+            LOG.warning(
+                "Images of VM %s changed since template %s was saved, not "
+                "reusing it",
+                self.vm.name,
+                self.template_dir,
+            )
+            return False
+        if not os.path.isfile(self.state_file):
+            return False
+        self.macs = metadata["macs"]
+        self.addresses = metadata.get("addresses", {})
+        return True
+
+    def _create_overlays(self, suffix, backing_files):
+        """
+        Create qcow2 overlays of the images.
+
+        :param suffix: Suffix of the overlay file names
+        :param backing_files: dict {image_name: (filename, format)}
+        :return: params using the overlays
+        """
+        params = self.params.copy()
+        params["vm_template"] = "no"
+        params.update(
+            create_overlays(self.params, self.template_dir, suffix, backing_files)
+        )
+        return params
+
+    def _template_disks(self):
+        """:return: dict {image_name: (template disk, format)}"""
+        return dict(
+            (_, (os.path.join(self.template_dir, "%s-template.qcow2" % _), "qcow2"))
+            for _ in self.images
+        )
+
+    def save(self, timeout):
+        """
+        Boot the guest on the template disks and save its state after login.
+
+        :param timeout: Timeout of the VM creation
+        """
+        LOG.info("Saving template of VM %s to %s", self.vm.name, self.template_dir)
+        if not os.path.isdir(self.template_dir):
+            os.makedirs(self.template_dir)
+        if os.path.exists(self.metadata_file):
+            os.remove(self.metadata_file)
+        params = self._create_overlays(
+            "template",
+            dict(
+                (name, (image["filename"], image["format"]))
+                for name, image in self.images.items()
+            ),
+        )
+        vm = self.vm
+        vm.create(params=params, timeout=timeout)
+        try:
+            login_timeout = int(self.params.get("vm_template_login_timeout", 360))
+            vm.wait_for_login(timeout=login_timeout).close()
+            vm.pause()
+            vm.save_to_file(self.state_file + ".tmp")
+            self.macs = dict(
+                (nic.nic_name, vm.get_mac_address(nic.nic_name)) for nic in vm.virtnet
+            )
+            # The restored guests keep their leases without asking DHCP again
+            self.addresses = {}
+            for mac in self.macs.values():
+                for key in (mac.lower(), "%s_6" % mac.lower()):
+                    if vm.address_cache.get(key):
+                        self.addresses[key] = vm.address_cache.get(key)
+        finally:
+            vm.destroy(gracefully=False, free_mac_addresses=False)
+        os.rename(self.state_file + ".tmp", self.state_file)
+        with open(self.metadata_file, "w") as metadata_file:
+            json.dump(
+                {
+                    "cmdline": self.cmdline,
+                    "images": self.images,
+                    "macs": self.macs,
+                    "addresses": self.addresses,
+                },
+                metadata_file,
+            )
+
+    def restore(self, timeout):
+        """
+        Start the VM from the saved state on fresh overlays.
+
+        :param timeout: Timeout of the VM creation
+        :raise VMTemplateRestoreError: When the state isn't loaded in time
+        """
+        LOG.info("Restoring VM %s from template %s", self.vm.name, self.template_dir)
+        params = self._create_overlays("run", self._template_disks())
+        vm = self.vm
+        vm.create(
+            params=params,
+            timeout=timeout,
+            migration_mode="exec",
+            migration_exec_cmd="cat %s" % self.state_file,
+            mac_source=self,
+        )
+        for key, address in self.addresses.items():
+            vm.address_cache[key] = address
+        if not utils_misc.wait_for(
+            lambda: not vm.monitor.verify_status("inmigrate"), timeout, step=0.5
+        ):
+            raise virt_vm.VMTemplateRestoreError(vm.name, self.state_file, timeout)
+        if vm.params.get("paused_after_start_vm") != "yes":
+            vm.resume()
+
+    def create_vm(self, timeout):
+        """
+        Start the VM from the template, save the template first if needed.
+
+        :param timeout: Timeout of the VM creation
+        """
+        if not self.is_saved():
+            self.save(timeout)
+        self.restore(timeout)
@@ -15,6 +15,7 @@ import aexpect
 from aexpect.remote import *
 from avocado.core import exceptions
 from avocado.utils import process
+from six.moves import shlex_quote
 
 from virttest import data_dir, utils_logfile
 from virttest.remote_commander import messenger, remote_master
@@ -108,6 +109,106 @@ def remote_commander(
     return cmd
 
 
+def ssh_mux_options(control_path, persist=300):
+    """
+    Options sharing one ssh connection through a control socket.
+
+    The first ssh (or scp) using the socket authenticates and becomes the
+    master, the following ones reuse its connection without a handshake.
+    The master stays in the background for $persist idle seconds.
+
+    :param control_path: Path of the control socket
+    :param persist: Idle seconds before the master exits
+    :return: ssh/scp command line options
+    """
+    return "-o ControlMaster=auto -o ControlPath=%s -o ControlPersist=%s" % (
+        control_path,
+        persist,
+    )
+
+
+def ssh_mux_exit(control_path):
+    """
+    Stop the ssh master of a control socket.
+
+    :param control_path: Path of the control socket
+    """
+    if os.path.exists(control_path):
+        process.run(
+            "ssh -o ControlPath=%s -O exit mux" % control_path,
+            ignore_status=True,
+            verbose=False,
+        )
+    if os.path.exists(control_path):
+        os.unlink(control_path)
+
+
+def scp_mux(
+    control_path,
+    host,
+    port,
+    username,
+    password,
+    source,
+    destination,
+    to_remote=True,
+    limit="",
+    log_filename=None,
+    log_function=None,
+    timeout=600,
+    interface=None,
+):
+    """
+    Copy files to/from a remote host through scp multiplexed over the
+    connection of the control socket.
+
+    :param control_path: Path of the control socket
+    :param host: Hostname or IP address
+    :param port: Port
+    :param username: Username (if required)
+    :param password: Password (if required, only without a master)
+    :param source: Path to copy from
+    :param destination: Path to copy to
+    :param to_remote: True when copying to the remote host
+    :param limit: Speed limit of file transfer.
+    :param log_filename: If specified, log all output to this file
+    :param log_function: If specified, log all output using this function
+    :param timeout: The time duration (in seconds) to wait for the transfer
+                    to complete.
+    :param interface: The interface the neighbours attach to (only use when
+                      using ipv6 linklocal address).
+    """
+    if host and host.lower().startswith("fe80"):
+        if not interface:
+            raise SCPError(
+                "When using ipv6 linklocal address must assign",
+                "the interface the neighbour attache",
+            )
+        host = "%s%%%s" % (host, interface)
+
+    def _quote(path):
+        if isinstance(path, list):
+            return " ".join(shlex_quote(_) for _ in path)
+        return shlex_quote(path)
+
+    remote = r"%s@\[%s\]:" % (username, host)
+    if to_remote:
+        paths = "%s %s%s" % (_quote(source), remote, _quote(destination))
+    else:
+        paths = "%s%s %s" % (remote, _quote(source), _quote(destination))
+    command = (
+        "scp -r -v -o UserKnownHostsFile=/dev/null -o StrictHostKeyChecking=no "
+        "-o PreferredAuthentications=password %s %s -P %s %s"
+        % (
+            ssh_mux_options(control_path),
+            "-l %s" % limit if limit else "",
+            port,
+            paths,
+        )
+    )
+    remote_copy(command, [password], log_filename, log_function, timeout)
+
+
 def run_remote_cmd(cmd, params, remote_runner=None, ignore_status=True):
     """
     A function to run a command on remote host.
@@ -80,11 +80,13 @@ class scheduler:
             elif cmd[0] == "cleanup":
                 env_filename = os.path.join(self.bindir, self_dict["env"])
                 env = utils_env.Env(env_filename)
+                vms = []
                 for obj in list(env.values()):
                     if isinstance(obj, virt_vm.BaseVM):
-                        obj.destroy()
+                        vms.append(obj)
                     elif isinstance(obj, aexpect.Spawn):
                         obj.close()
+                virt_vm.destroy_all(vms)
                 env.save()
                 w.write("cleanup_done\n")
                 w.write("ready\n")
@@ -118,10 +118,13 @@ class Env(IterableUserDict):
         Destroy all objects registered in this Env object.
         """
         self.stop_ip_sniffing()
-        for key in self.data:
+        try:
+            virt_vm.destroy_all(self.get_all_vms(), gracefully=False)
+        except Exception:
+            pass
+        if "vm_pool" in self.data:
             try:
-                if key.startswith("vm__"):
-                    self.data[key].destroy(gracefully=False)
+                self.data["vm_pool"].destroy(gracefully=False)
             except Exception:
                 pass
         self.data = {}
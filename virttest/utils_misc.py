@@ -592,6 +592,84 @@ def wait_for(func, timeout, first=0.0, step=1.0, text=None, ignore_errors=False)
     return None
 
 
+# inotify(7) constants
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_IN_CREATE = 0x00000100
+_IN_MOVED_TO = 0x00000080
+
+
+def _inotify_watch_dirs(dirs):
+    """
+    Create an inotify instance watching files created in the directories.
+
+    :param dirs: List of directories to watch
+    :return: The inotify file descriptor, or None if inotify is unavailable
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd < 0:
+        return None
+    for directory in dirs:
+        if inotify_add_watch(fd, directory.encode(), _IN_CREATE | _IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+    return fd
+
+
+def wait_for_path(paths, timeout, step=0.1, abort=None):
+    """
+    Wait until all the given paths exist.
+
+    The parent directories are watched with inotify so the function returns
+    as soon as the last path is created (e.g. a unix socket bound by QEMU or
+    a helper daemon), it falls back to polling every $step seconds when
+    inotify can't be used.
+
+    :param paths: Path or list of paths to wait for
+    :param timeout: Timeout in seconds
+    :param step: Time to sleep between polling attempts in seconds
+    :param abort: Function called every $step seconds, the wait is given up
+                  when it returns True (e.g. the process died)
+    :return: True if all the paths exist, False if timeout expires or the
+             wait is aborted
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    end_time = time.time() + float(timeout)
+    dirs = set(os.path.dirname(os.path.abspath(path)) for path in paths)
+    fd = None
+    if all(os.path.isdir(directory) for directory in dirs):
+        # Watch before checking so no creation can be missed in between
+        fd = _inotify_watch_dirs(dirs)
+    try:
+        while True:
+            if all(os.path.exists(path) for path in paths):
+                return True
+            remaining = end_time - time.time()
+            if remaining <= 0 or (abort is not None and abort()):
+                return False
+            if abort is not None:
+                remaining = min(step, remaining)
+            if fd is None:
+                time.sleep(min(step, remaining))
+            elif select.select([fd], [], [], remaining)[0]:
+                try:
+                    # Drain the pending events, only the paths matter
+                    while os.read(fd, 4096):
+                        pass
+                except OSError:
+                    pass
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
 def get_hash_from_file(hash_path, dvd_basename):
     """
     Get the a hash from a given DVD image from a hash file
@@ -15,6 +15,7 @@ import signal
 import socket
 import struct
 import sys
+import threading
 import time
 import uuid
 
@@ -3034,14 +3035,16 @@ class ParamsNet(VMNet):
             proplist = list(self.container_class().__all_slots__)
             # nic_name was already set, remove from __slots__ list copy
             del proplist[proplist.index("nic_name")]
+            try:
+                existing_nic = self[nic_name]
+            except IndexError:
+                existing_nic = None
             for propertea in proplist:
                 # Merge existing propertea values if they exist
                 try:
-                    existing_value = getattr(self[nic_name], propertea, None)
+                    existing_value = getattr(existing_nic, propertea, None)
                 except ValueError:
                     existing_value = None
-                except IndexError:
-                    existing_value = None
 
                 # FIXME: We need a mapping handler to map cartesian params
                 # to nic attributes, here is just a workaround to map
@@ -3123,6 +3126,11 @@ class ParamsNet(VMNet):
         nic.ip = new_ip
 
 
+# The database lock file only serializes processes, the VMs of a test can
+# allocate and free their addresses from several threads
+DB_THREAD_LOCK = threading.RLock()
+
+
 class DbNet(VMNet):
     """
     Networking information from database
@@ -3155,17 +3163,23 @@ class DbNet(VMNet):
         for db_nic in entry:
             nic_name = db_nic["nic_name"]
             if nic_name in nic_name_list:
+                nic = self[nic_name]
                 for propertea in proplist:
                     # only set properties in db but not in self
                     if propertea in db_nic:
-                        self[nic_name].set_if_none(propertea, db_nic[propertea])
+                        nic.set_if_none(propertea, db_nic[propertea])
         if entry:
             VMNet.__init__(self, self.container_class, entry)
         # Assume self.update_db() called elsewhere
 
     def lock_db(self):
         if not hasattr(self, "lock"):
-            self.lock = utils_misc.lock_file(self.db_lockfile)
+            DB_THREAD_LOCK.acquire()
+            try:
+                self.lock = utils_misc.lock_file(self.db_lockfile)
+            except Exception:
+                DB_THREAD_LOCK.release()
+                raise
             if not hasattr(self, "db"):
                 self.db = shelve.open(self.db_filename)
             else:
@@ -3180,6 +3194,7 @@ class DbNet(VMNet):
             if hasattr(self, "lock"):
                 utils_misc.unlock_file(self.lock)
                 del self.lock
+                DB_THREAD_LOCK.release()
             else:
                 raise DbNoLockError
         else:
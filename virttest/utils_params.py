@@ -1,3 +1,4 @@
+import copy
 from threading import Lock
 
 try:
@@ -21,6 +22,13 @@ class Params(IterableUserDict):
     """
 
     lock = Lock()
+    # {"_suffix": [keys ending with "_suffix"]} used by object_params, it's
+    # built on demand, shared by copies and dropped whenever a key is
+    # removed. Keys added later are tracked separately in _added_keys.
+    _suffixes = None
+    _added_keys = ()
+    # rebuild the index once that many keys were added
+    _max_added_keys = 64
 
     def __getitem__(self, key):
         """overrides the error messages of missing params[$key]"""
@@ -32,6 +40,24 @@ class Params(IterableUserDict):
                 "Check your cfg files for typos/mistakes" % key
             )
 
+    def __setitem__(self, key, value):
+        if self._suffixes is not None and key not in self.data:
+            if len(self._added_keys) < self._max_added_keys:
+                self._added_keys = self._added_keys + (key,)
+            else:
+                self._suffixes = None
+        IterableUserDict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._suffixes = None
+        IterableUserDict.__delitem__(self, key)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_suffixes", None)
+        state.pop("_added_keys", None)
+        return state
+
     def get(self, key, default=None):
         """overrides the behavior to catch ParamNotFound error"""
         try:
@@ -44,6 +70,15 @@ class Params(IterableUserDict):
             self[key] = failobj
         return self[key]
 
+    def copy(self):
+        """
+        Return a shallow copy, the data dict is copied at once instead of
+        setting the keys one by one.
+        """
+        new_dict = copy.copy(self)
+        new_dict.data = self.data.copy()
+        return new_dict
+
     def objects(self, key):
         """
         Return the names of objects defined using a given key.
@@ -75,13 +110,36 @@ class Params(IterableUserDict):
         suffix = "_" + obj_name
         self.lock.acquire()
         new_dict = self.copy()
+        keys = self._get_suffix_keys(suffix)
         self.lock.release()
-        for key in list(new_dict.keys()):
-            if key.endswith(suffix):
-                new_key = key.split(suffix)[0]
-                new_dict[new_key] = new_dict[key]
+        for key in keys:
+            new_dict[key.split(suffix)[0]] = self.data[key]
         return new_dict
 
+    def _get_suffix_keys(self, suffix):
+        """
+        Return keys ending with the suffix.
+
+        The keys are indexed by all their suffixes starting with '_', so
+        the params of each object are found without going through all the
+        keys.  Params returned by object_params only add a few keys, they
+        keep using the index of the params they were created from and check
+        the added keys one by one.
+        """
+        if self._suffixes is None:
+            suffixes = {}
+            for key in self.data:
+                index = key.find("_")
+                while index != -1:
+                    suffixes.setdefault(key[index:], []).append(key)
+                    index = key.find("_", index + 1)
+            self._suffixes = suffixes
+            self._added_keys = ()
+        keys = self._suffixes.get(suffix, [])
+        if self._added_keys:
+            keys = keys + [_ for _ in self._added_keys if _.endswith(suffix)]
+        return keys
+
     def object_counts(self, count_key, base_name):
         """
         This is a generator method: to give it the name of a count key and a
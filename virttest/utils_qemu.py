@@ -2,16 +2,299 @@
 QEMU related utility functions.
 """
 
+import binascii
+import hashlib
 import json
+import logging
+import os
 import re
+import struct
+import tempfile
+import threading
 
 from avocado.utils import process
 
+from virttest import data_dir
+
+LOG = logging.getLogger("avocado." + __name__)
+
 QEMU_VERSION_RE = re.compile(
     r"QEMU (?:PC )?emulator version\s" r"([0-9]+\.[0-9]+\.[0-9]+)" r"(?:\s\((.*?)\))?"
 )
 DEVICE_CATEGORY_RE = re.compile(r"([A-Z]\S+) devices:")
 
+# Bump whenever the format of the cached probe results changes
+CAPS_CACHE_VERSION = 2
+# Directory of the persistent capability caches (data dir when not set)
+CAPS_CACHE_DIR = None
+CAPS_CACHE_ENABLED = True
+
+_caps_caches = {}
+_caps_caches_lock = threading.Lock()
+
+
+def _get_build_id(bin_path):
+    """
+    Return the GNU build id of an ELF binary
+
+    :param bin_path: Path to the binary
+    :return: Build id as a hex string, None when it is not available
+    """
+    try:
+        with open(bin_path, "rb") as elf:
+            ident = bytearray(elf.read(16))
+            if ident[:4] != bytearray(b"\x7fELF"):
+                return None
+            is_64 = ident[4] == 2
+            endian = "<" if ident[5] == 1 else ">"
+            if is_64:
+                elf.seek(0x20)
+                phoff = struct.unpack(endian + "Q", elf.read(8))[0]
+                elf.seek(0x36)
+            else:
+                elf.seek(0x1C)
+                phoff = struct.unpack(endian + "I", elf.read(4))[0]
+                elf.seek(0x2A)
+            phentsize, phnum = struct.unpack(endian + "HH", elf.read(4))
+            for i in range(phnum):
+                elf.seek(phoff + i * phentsize)
+                if is_64:
+                    p_type, _, p_offset, _, _, p_filesz = struct.unpack(
+                        endian + "IIQQQQ", elf.read(40)
+                    )
+                else:
+                    p_type, p_offset, _, _, p_filesz = struct.unpack(
+                        endian + "IIIII", elf.read(20)
+                    )
+                if p_type != 4:  # PT_NOTE
+                    continue
+                elf.seek(p_offset)
+                notes = elf.read(p_filesz)
+                pos = 0
+                while pos + 12 <= len(notes):
+                    namesz, descsz, n_type = struct.unpack_from(
+                        endian + "III", notes, pos
+                    )
+                    pos += 12
+                    name = notes[pos : pos + namesz]
+                    pos += (namesz + 3) & ~3
+                    desc = notes[pos : pos + descsz]
+                    pos += (descsz + 3) & ~3
+                    if n_type == 3 and name.rstrip(b"\0") == b"GNU":
+                        return binascii.hexlify(desc).decode()
+    except (IOError, OSError, struct.error):
+        pass
+    return None
+
+
+def get_binary_fingerprint(bin_path):
+    """
+    Return data identifying one build of a binary
+
+    :param bin_path: Path to the binary
+    :raise OSError: If the binary does not exist
+    :return: A dict of the real path, inode, size, mtime and build id
+    """
+    real_path = os.path.realpath(bin_path)
+    stat = os.stat(real_path)
+    return {
+        "path": real_path,
+        "inode": stat.st_ino,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "build_id": _get_build_id(real_path),
+    }
+
+
+class UncachedResult(object):
+    """
+    Result of a probe which must not be cached, e.g. the output of a qemu
+    command which failed or timed out.
+    """
+
+    def __init__(self, value):
+        """
+        :param value: The probed value
+        """
+        self.value = value
+
+
+def unwrap_result(value):
+    """:return: value, taken out of an UncachedResult if needed"""
+    if isinstance(value, UncachedResult):
+        return value.value
+    return value
+
+
+class CapsCache(object):
+    """
+    Persistent cache of data probed from one qemu binary.
+
+    The entries are stored in a json file named after the fingerprint of the
+    binary, so a rebuilt or replaced binary never reuses stale results. The
+    file is shared by all processes and replaced atomically on every update.
+    """
+
+    def __init__(self, bin_path, cache_dir=None):
+        """
+        :param bin_path: Path to qemu binary
+        :param cache_dir: Directory of the cache files
+        :raise OSError: If the binary does not exist
+        """
+        self.fingerprint = get_binary_fingerprint(bin_path)
+        if cache_dir is None:
+            cache_dir = CAPS_CACHE_DIR or os.path.join(
+                data_dir.get_data_dir(), "qemu_caps"
+            )
+        self.cache_dir = cache_dir
+        digest = hashlib.sha1(
+            json.dumps(self.fingerprint, sort_keys=True).encode()
+        ).hexdigest()
+        self.path = os.path.join(
+            cache_dir,
+            "%s-%s.json" % (os.path.basename(self.fingerprint["path"]), digest),
+        )
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        """:return: Entries stored on disk, empty dict when not usable"""
+        try:
+            with open(self.path, "r") as cache_file:
+                data = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != CAPS_CACHE_VERSION
+            or data.get("fingerprint") != self.fingerprint
+        ):
+            return {}
+        return data.get("entries", {})
+
+    def _save(self):
+        """Merge the entries with the ones on disk and replace the file"""
+        entries = self._load()
+        entries.update(self._entries)
+        data = {
+            "version": CAPS_CACHE_VERSION,
+            "fingerprint": self.fingerprint,
+            "entries": entries,
+        }
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=".%s." % os.path.basename(self.path), dir=self.cache_dir
+            )
+            try:
+                with os.fdopen(fd, "w") as tmp_file:
+                    json.dump(data, tmp_file)
+                os.chmod(tmp_path, 0o644)
+                os.rename(tmp_path, self.path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+        except (IOError, OSError) as details:
+            LOG.debug(
+                "Unable to store qemu capability cache %s: %s", self.path, details
+            )
+            return
+        self._entries = entries
+
+    def get(self, key, default=None):
+        """
+        :param key: Key of the entry
+        :param default: Value returned when the entry is not cached
+        :return: The cached value
+        """
+        return self._entries.get(key, default)
+
+    def set(self, key, value):
+        """
+        Store one entry
+
+        :param key: Key of the entry
+        :param value: Json serializable value
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._save()
+
+    def invalidate(self):
+        """Drop all entries, including the stored ones"""
+        with self._lock:
+            self._entries = {}
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def probe(self, key, func, *args, **kwargs):
+        """
+        Return the cached value of key, call func to get it when missing
+
+        :param key: Key of the entry
+        :param func: Function returning a json serializable value, None
+                     results and UncachedResult objects are not stored so
+                     failed probes get retried
+        :return: The (cached) value
+        """
+        if key in self._entries:
+            return self._entries[key]
+        value = func(*args, **kwargs)
+        if isinstance(value, UncachedResult):
+            return value.value
+        if value is not None:
+            self.set(key, value)
+        return value
+
+
+def get_caps_cache(bin_path):
+    """
+    Return the capability cache of a qemu binary
+
+    :param bin_path: Path to qemu binary
+    :return: CapsCache object, None when caching is disabled or not possible
+    """
+    if not CAPS_CACHE_ENABLED:
+        return None
+    try:
+        stat = os.stat(bin_path)
+    except OSError:
+        return None
+    key = (
+        os.path.realpath(bin_path),
+        stat.st_ino,
+        stat.st_size,
+        stat.st_mtime,
+        CAPS_CACHE_DIR,
+    )
+    with _caps_caches_lock:
+        cache = _caps_caches.get(key)
+        if cache is None:
+            try:
+                cache = CapsCache(bin_path)
+            except OSError:
+                return None
+            _caps_caches[key] = cache
+    return cache
+
+
+def probe_cached(bin_path, key, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) unless its result for bin_path is cached
+
+    :param bin_path: Path to qemu binary the result belongs to
+    :param key: Key of the cache entry
+    :param func: Function returning a json serializable value
+    :return: The (cached) value
+    """
+    cache = get_caps_cache(bin_path)
+    if cache is None:
+        return unwrap_result(func(*args, **kwargs))
+    return cache.probe(key, func, *args, **kwargs)
+
 
 def _get_info(bin_path, options, include_stderr=False):
     """
@@ -23,12 +306,19 @@ def _get_info(bin_path, options, include_stderr=False):
                            stdout)
     :return: Command stdout
     """
-    qemu_cmd = "%s %s" % (bin_path, options)
-    result = process.run(qemu_cmd, verbose=False, ignore_status=True)
-    output = result.stdout_text.strip()
-    if include_stderr:
-        output += result.stderr_text.strip()
-    return output
+
+    def _run():
+        qemu_cmd = "%s %s" % (bin_path, options)
+        result = process.run(qemu_cmd, verbose=False, ignore_status=True)
+        output = result.stdout_text.strip()
+        if include_stderr:
+            output += result.stderr_text.strip()
+        if result.exit_status:
+            return UncachedResult(output)
+        return output
+
+    key = "info:%s:%s" % (options, include_stderr)
+    return probe_cached(bin_path, key, _run)
 
 
 def get_qemu_version(bin_path):
@@ -136,30 +426,177 @@ def find_supported_devices(bin_path, pattern, category=None):
     return devices
 
 
-def get_maxcpus_hard_limit(bin_path, machine_type):
+def _run_qmp_commands(bin_path, commands, timeout=60):
     """
-    Return maximum limit CPUs supported by specified machine type
+    Execute QMP commands in a single "-machine none" qemu process
 
     :param bin_path: Path to qemu binary
-    :param machine_type: One machine type supported by qemu
-    :raise ValueError: If unable to get that
-    :return: Maximum value of vCPU
+    :param commands: List of (command, arguments) tuples, arguments might
+                     be None
+    :param timeout: Timeout of the qemu process
+    :return: A dict of the command name to its return value, failed
+             commands are not included
     """
-    # TODO: Extract the process of executing QMP as a separate method
+    requests = [{"execute": "qmp_capabilities"}]
+    for cmd, args in commands:
+        request = {"execute": cmd, "id": cmd}
+        if args:
+            request["arguments"] = args
+        requests.append(request)
+    requests.append({"execute": "quit"})
     output = process.run(
-        "echo -e '"
-        '{ "execute": "qmp_capabilities" }\n'
-        '{ "execute": "query-machines", "id": "TEMP-INST" }\n'
-        '{ "execute": "quit" }\''
-        "| %s -M none -nodefaults -nographic -S -qmp stdio "
-        "| grep return | grep TEMP-INST" % bin_path,
+        "echo '%s' | %s -machine none -nodefaults -nographic -S -qmp stdio"
+        % ("\n".join(json.dumps(_) for _ in requests), bin_path),
+        timeout=timeout,
         ignore_status=True,
         shell=True,
         verbose=False,
     ).stdout_text
-    machines = json.loads(output)["return"]
+    results = {}
+    for line in output.splitlines():
+        try:
+            response = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(response, dict) and "return" in response:
+            if response.get("id") is not None:
+                results[response["id"]] = response["return"]
+    return results
+
+
+def _probe_qmp_info(bin_path):
+    """
+    Query all the QMP probed information of the qemu binary
+
+    :param bin_path: Path to qemu binary
+    :return: Dict of the query results, None if qemu could not be queried
+    """
+    results = _run_qmp_commands(
+        bin_path,
+        [
+            ("query-version", None),
+            ("query-commands", None),
+            ("query-qmp-schema", None),
+            ("qom-list-types", {"implements": "user-creatable", "abstract": False}),
+            ("query-machines", None),
+            ("query-command-line-options", None),
+            ("human-monitor-command", {"command-line": "help"}),
+        ],
+    )
+    if "query-commands" not in results:
+        return None
+    version = results.get("query-version", {}).get("qemu")
+    if version:
+        version = "%(major)d.%(minor)d.%(micro)d" % version
+    return {
+        "version": version,
+        "commands": [cmd["name"] for cmd in results["query-commands"]],
+        "schema": results.get("query-qmp-schema"),
+        "types": [_type["name"] for _type in results.get("qom-list-types", [])],
+        "machines": results.get("query-machines"),
+        "cmdline_options": results.get("query-command-line-options"),
+        "hmp_help": results.get("human-monitor-command"),
+    }
+
+
+def get_qmp_info(bin_path):
+    """
+    Return the information of the qemu binary probed through QMP
+
+    All of it comes from one "-machine none -qmp stdio" process and is kept
+    in the capabilities cache of the binary.
+
+    :param bin_path: Path to qemu binary
+    :return: A dict with "version", "commands" (query-commands), "schema"
+             (query-qmp-schema), "types" (user creatable qom types),
+             "machines" (query-machines), "cmdline_options"
+             (query-command-line-options) and "hmp_help" (output of HMP
+             'help') keys, the value of a key is None when the command is
+             not supported. None if qemu could not be queried at all.
+    """
+    return probe_cached(bin_path, "qmp_info", _probe_qmp_info, bin_path)
+
+
+class QMPSchema(object):
+    """Lookups in the QMP schema introspection data (query-qmp-schema)."""
+
+    def __init__(self, schema):
+        """
+        :param schema: Return value of query-qmp-schema
+        """
+        self._entities = {}
+        self._commands = {}
+        self._events = set()
+        for entity in schema or []:
+            self._entities[entity["name"]] = entity
+            if entity.get("meta-type") == "command":
+                self._commands[entity["name"]] = entity
+            elif entity.get("meta-type") == "event":
+                self._events.add(entity["name"])
+
+    def __bool__(self):
+        return bool(self._entities)
+
+    __nonzero__ = __bool__
+
+    def has_command(self, cmd):
+        """
+        :param cmd: QMP command name
+        :return: True if the command is part of the schema
+        """
+        return cmd in self._commands
+
+    def has_event(self, event):
+        """
+        :param event: QMP event name
+        :return: True if the event is part of the schema
+        """
+        return event in self._events
+
+    def get_members(self, type_name):
+        """
+        :param type_name: Name of an object type in the schema
+        :return: List of member names, including the ones of all the
+                 variants of the type
+        """
+        entity = self._entities.get(type_name, {})
+        members = [member["name"] for member in entity.get("members", [])]
+        for variant in entity.get("variants", []):
+            members.extend(self.get_members(variant["type"]))
+        return members
+
+    def get_command_args(self, cmd):
+        """
+        :param cmd: QMP command name
+        :return: List of the argument names of the command
+        """
+        command = self._commands.get(cmd)
+        if command is None:
+            return []
+        return self.get_members(command.get("arg-type"))
+
+    def has_command_arg(self, cmd, arg):
+        """
+        :param cmd: QMP command name
+        :param arg: Argument name
+        :return: True if the command accepts the argument
+        """
+        return arg in self.get_command_args(cmd)
+
+
+def get_maxcpus_hard_limit(bin_path, machine_type):
+    """
+    Return maximum limit CPUs supported by specified machine type
+
+    :param bin_path: Path to qemu binary
+    :param machine_type: One machine type supported by qemu
+    :raise ValueError: If unable to get that
+    :return: Maximum value of vCPU
+    """
+    info = get_qmp_info(bin_path) or {}
+    machines = info.get("machines") or []
+    machines_info = {machine["name"]: machine for machine in machines}
     try:
-        machines_info = {machine.pop("name"): machine for machine in machines}
         return machines_info[machine_type]["cpu-max"]
     except KeyError:
         raise ValueError(
@@ -29,7 +29,7 @@ from avocado.utils.data_structures import DataSize
 
 from virttest import data_dir, env_process
 from virttest import error_context as error
-from virttest import qemu_migration, storage, utils_misc, utils_test
+from virttest import qemu_migration, storage, utils_misc, utils_test, virt_vm
 
 try:
     import aexpect
@@ -137,9 +137,18 @@ def migrate(
             return o.get("status") == "cancelled" or o.get("status") == "canceled"
 
     def wait_for_migration():
-        if not utils_misc.wait_for(
-            mig_finished, mig_timeout, 2, 2, "Waiting for migration to finish"
-        ):
+        if vm.migration_events:
+            try:
+                vm.wait_for_migration(mig_timeout)
+            except virt_vm.VMMigrateTimeoutError:
+                finished = False
+            else:
+                finished = mig_finished()
+        else:
+            finished = utils_misc.wait_for(
+                mig_finished, mig_timeout, 2, 2, "Waiting for migration to finish"
+            )
+        if not finished:
             raise exceptions.TestFail(
                 "Timeout expired while waiting for migration " "to finish"
             )
@@ -169,6 +178,7 @@ def migrate(
 
             if offline:
                 vm.pause()
+            vm.enable_migration_events()
             vm.monitor.migrate(uri)
 
             if mig_cancel:
@@ -1,7 +1,10 @@
 from __future__ import division
 
+import collections
+import contextlib
 import functools
 import glob
+import hashlib
 import logging
 import os
 import re
@@ -328,6 +331,34 @@ class VMStatusError(VMError):
     pass
 
 
+class VMTemplateRestoreError(VMError):
+    def __init__(self, name, state_file, timeout):
+        VMError.__init__(self, name, state_file, timeout)
+        self.name = name
+        self.state_file = state_file
+        self.timeout = timeout
+
+    def __str__(self):
+        return "VM %s is still restoring %s after %ss" % (
+            self.name,
+            self.state_file,
+            self.timeout,
+        )
+
+
+class VMNotReadyError(VMError):
+    def __init__(self, condition, timeout):
+        VMError.__init__(self, condition, timeout)
+        self.condition = condition
+        self.timeout = timeout
+
+    def __str__(self):
+        return "VM readiness condition '%s' didn't hold within %ss" % (
+            self.condition,
+            self.timeout,
+        )
+
+
 class VMRemoveError(VMError):
     pass
 
@@ -525,6 +556,78 @@ class CpuInfo(object):
         self.books = books
 
 
+class KernelCrashDetector(object):
+    """
+    Output function of a serial console session which spots kernel crashes
+    as the guest prints them, so they don't need to be searched for in the
+    whole console output later.
+
+    Only the last lines are kept, the crash patterns are only searched for
+    from the first crash start marker in these lines on once a line which
+    may end a crash arrives.
+    """
+
+    PANIC_RE = re.compile(
+        "|".join(
+            (
+                r"BUG:.*---\[ end trace .* \]---",
+                r"----------\[ cut here.*\[ end trace .* \]---",
+                r"general protection fault:.* RSP.*>",
+            )
+        ),
+        re.DOTALL | re.MULTILINE | re.I,
+    )
+    START_RE = re.compile(r"BUG:|----------\[ cut here|general protection fault:", re.I)
+    END_RE = re.compile(r"\[ end trace .* \]---|>", re.I)
+
+    def __init__(self, output_func=None, max_lines=500):
+        """
+        :param output_func: Function called with the arguments of each call,
+                            e.g. utils_logfile.log_line
+        :param max_lines: Number of the last lines kept
+        """
+        self.output_func = output_func
+        self.lines = collections.deque(maxlen=max_lines)
+        self.line_count = 0
+        # Number of the first line of the unfinished crash
+        self.start = None
+        self.crash = None
+
+    def __call__(self, *args):
+        """
+        :param args: The output params of the session followed by the line
+        """
+        if self.output_func is not None:
+            self.output_func(*args)
+        if self.crash is None:
+            self.feed(args[-1])
+
+    def feed(self, line):
+        """
+        :param line: Line printed on the console
+        :return: The crash message once a crash was seen, None otherwise
+        """
+        self.lines.append(line)
+        self.line_count += 1
+        first = self.line_count - len(self.lines) + 1
+        if self.start is not None and self.start < first:
+            # The crash start was dropped, look for another one
+            self.start = None
+            for number, kept in enumerate(self.lines, first):
+                if self.START_RE.search(kept):
+                    self.start = number
+                    break
+        elif self.start is None and self.START_RE.search(line):
+            self.start = self.line_count
+        if self.start is not None and self.END_RE.search(line):
+            lines = list(self.lines)[self.start - first :]
+            match = self.PANIC_RE.search("\n".join(lines))
+            if match:
+                self.crash = match.group(0)
+                LOG.error("Kernel crash found on the serial console")
+        return self.crash
+
+
 def session_handler(func):
     """
     decorator method to handle uri and session for libvirt
@@ -552,6 +655,69 @@ def session_handler(func):
     return manage_session
 
 
+def destroy_all(vms, gracefully=True, timeout=None, free_mac_addresses=True):
+    """
+    Destroy several VMs at once.
+
+    The graceful shutdown of all the VMs is started at once and waited for
+    until a common deadline, only the VMs which are still alive then are
+    ended with a 'quit' or a kill signal (in parallel as well).
+
+    :param vms: List of VM objects
+    :param gracefully: If True, first attempt to shutdown the VMs with a
+            shell command
+    :param timeout: Time (seconds) to wait for the graceful shutdown of all
+            the VMs, by default the longest kill_timeout of them
+    :param free_mac_addresses: If True, the MAC addresses used by the VMs
+            will be freed.
+    :raise: The first error raised while destroying a VM, once all of them
+            were destroyed
+    """
+    vms = [vm for vm in vms if vm is not None]
+    shutdown_vms = []
+    if gracefully:
+        shutdown_vms = [
+            vm for vm in vms if hasattr(vm, "graceful_shutdown") and not vm.is_dead()
+        ]
+    if shutdown_vms:
+        if timeout is None:
+            timeout = max(
+                int(vm.params.get("kill_timeout", "60")) for vm in shutdown_vms
+            )
+        end_time = time.time() + timeout
+        threads = []
+        for vm in shutdown_vms:
+            LOG.debug("Shutting down VM %s (PID %s)", vm.name, vm.get_pid())
+            thread = utils_misc.InterruptedThread(vm.graceful_shutdown, (timeout,))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for vm, thread in zip(shutdown_vms, threads):
+            thread.join(max(end_time - time.time(), 0), suppress_exception=True)
+            if not vm.is_dead():
+                LOG.debug("VM %s failed to go down (shell)", vm.name)
+
+    threads = []
+    for vm in vms:
+        # The graceful shutdown of the stragglers isn't tried again
+        kwargs = {
+            "gracefully": gracefully and vm not in shutdown_vms,
+            "free_mac_addresses": free_mac_addresses,
+        }
+        thread = utils_misc.InterruptedThread(vm.destroy, kwargs=kwargs)
+        thread.start()
+        threads.append(thread)
+    errors = []
+    for vm, thread in zip(vms, threads):
+        try:
+            thread.join()
+        except Exception as details:
+            LOG.error("Failed to destroy VM %s: %s", vm.name, details)
+            errors.append(details)
+    if errors:
+        raise errors[0]
+
+
 class BaseVM(object):
     """
     Base class for all hypervisor specific VM subclasses.
@@ -624,6 +790,10 @@ class BaseVM(object):
             self.cpuinfo = CpuInfo()
         if not hasattr(self, "console_manager"):
             self.console_manager = vt_console.ConsoleManager()
+        if not hasattr(self, "ssh_control_paths"):
+            self.ssh_control_paths = set()
+        if not hasattr(self, "idle_sessions"):
+            self.idle_sessions = {}
 
     def _generate_unique_id(self):
         """
@@ -933,7 +1103,25 @@ class BaseVM(object):
             except (VMIPAddressMissingError, VMAddressVerificationError) as e:
                 return False
 
-        ipaddr = utils_misc.wait_for(_get_address, timeout, step=interval)
+        mac_pattern = "%s_6" if ip_version == "ipv6" else "%s"
+        # Sleep until the ip sniffer reports the lease of the nic instead of
+        # polling, unless the address of another nic may be used
+        notify = (
+            hasattr(self.address_cache, "wait_for")
+            and self.params.get("flexible_nic_index") != "yes"
+        )
+        end_time = time.time() + timeout
+        ipaddr = _get_address()
+        while not ipaddr and time.time() < end_time:
+            remaining = end_time - time.time()
+            if notify:
+                key = mac_pattern % self.get_mac_address(nic_index).lower()
+            if notify and self.address_cache.get(key) is None:
+                self.address_cache.wait_for(key, remaining)
+            else:
+                # The address is known but it isn't verified yet
+                time.sleep(min(interval, remaining))
+            ipaddr = _get_address()
         if not ipaddr:
             # Read guest address via serial console and update VM address
             # cache to avoid get out-dated address.
@@ -1006,16 +1194,17 @@ class BaseVM(object):
         :raise: VMDeadKernelCrashError, in case a kernel crash message was
                 found.
         """
-        panic_re = [r"BUG:.*---\[ end trace .* \]---"]
-        panic_re.append(r"----------\[ cut here.*\[ end trace .* \]---")
-        panic_re.append(r"general protection fault:.* RSP.*>")
-        panic_re = "|".join(panic_re)
         if self.serial_console:
+            detector = getattr(self.serial_console, "output_func", None)
+            if isinstance(detector, KernelCrashDetector):
+                if detector.crash is not None:
+                    raise VMDeadKernelCrashError(detector.crash)
+                return
             data = self.serial_console.get_output()
             if data is None:
                 LOG.warning("Unable to read serial console")
                 return
-            match = re.search(panic_re, data, re.DOTALL | re.MULTILINE | re.I)
+            match = KernelCrashDetector.PANIC_RE.search(data)
             if match:
                 raise VMDeadKernelCrashError(match.group(0))
 
@@ -1094,6 +1283,27 @@ class BaseVM(object):
         """
         return os.path.join(data_dir.get_tmp_dir(), "testlog-%s" % self.instance)
 
+    def _get_ssh_control_path(self, address, port, username):
+        """
+        Return the control socket multiplexing the ssh and scp connections
+        to the guest or None when they're not multiplexed, which is the
+        default ("ssh_control_master = no").
+
+        :param address: Address of the guest
+        :param port: Port of the ssh server
+        :param username: Username
+        """
+        if self.params.get("ssh_control_master", "no") != "yes":
+            return None
+        key = "%s-%s-%s-%s" % (self.instance, address, port, username)
+        # Short name, unix socket paths are limited to ~100 characters
+        control_path = os.path.join(
+            data_dir.get_tmp_dir(),
+            "ssh-%s" % hashlib.sha1(key.encode()).hexdigest()[:16],
+        )
+        self.ssh_control_paths.add(control_path)
+        return control_path
+
     @error_context.context_aware
     def login(self, nic_index=0, timeout=LOGIN_TIMEOUT, username=None, password=None):
         """
@@ -1130,6 +1340,11 @@ class BaseVM(object):
         )
         log_filename = utils_logfile.get_log_filename(log_filename)
         log_function = utils_logfile.log_line
+        extra = {}
+        if client == "ssh":
+            control_path = self._get_ssh_control_path(address, port, username)
+            if control_path:
+                extra["extra_cmdline"] = remote_old.ssh_mux_options(control_path)
         try:
             session = remote.remote_login(
                 client,
@@ -1143,6 +1358,7 @@ class BaseVM(object):
                 log_function,
                 timeout,
                 neigh_attach_if,
+                **extra
             )
         except Exception:
             utils_logfile.close_log_file(log_filename)
@@ -1291,7 +1507,11 @@ class BaseVM(object):
                 if serial:
                     break
                 raise
+            except remote.LoginTimeoutError as err:
+                # The attempt already waited for internal_timeout, retry now
+                error = err
             except Exception as err:
+                # e.g. connection refused, the server isn't listening yet
                 time.sleep(0.5)
                 error = err
             not_tried = False
@@ -1306,6 +1526,125 @@ class BaseVM(object):
             "exceeded %s s timeout, last " "failure: %s" % (timeout, error)
         )
 
+    def wait_until_ready(
+        self, conditions=None, timeout=LOGIN_WAIT_TIMEOUT, nic_index=0
+    ):
+        """
+        Wait until the guest is ready, each condition returns as soon as it
+        holds instead of polling at fixed intervals:
+
+        * "serial": the serial console output matches the
+          "vm_ready_serial_pattern" param (the login prompt by default)
+        * "address": the ip sniffer reported the address of the NIC
+        * "guest_agent": the guest agent responds to guest-ping (qemu only)
+        * "login": remote login succeeds
+
+        :param conditions: List of the conditions, by default the
+                "vm_ready_conditions" param or "login"
+        :param timeout: Time (seconds) to wait for all of them
+        :param nic_index: The index of the NIC used by "address" and "login"
+        :return: dict {condition: seconds since the VM start until it held}
+        :raise VMNotReadyError: When a condition didn't hold in time
+        """
+        if conditions is None:
+            conditions = self.params.objects("vm_ready_conditions") or ["login"]
+        start_time = getattr(self, "start_monotonic_time", 0.0)
+        if not start_time:
+            start_time = utils_misc.monotonic_time()
+        end_time = time.time() + timeout
+        ready = {}
+        for condition in conditions:
+            wait = getattr(self, "_wait_ready_%s" % condition, None)
+            if wait is None:
+                raise ValueError("Unknown VM readiness condition '%s'" % condition)
+            wait(max(end_time - time.time(), 0), nic_index)
+            ready[condition] = utils_misc.monotonic_time() - start_time
+            LOG.info(
+                "VM %s is ready (%s) %.2fs after it was started",
+                self.name,
+                condition,
+                ready[condition],
+            )
+        return ready
+
+    def _wait_ready_serial(self, timeout, nic_index):
+        """Wait for the readiness pattern on the serial console"""
+        pattern = self.params.get("vm_ready_serial_pattern", r"login:\s*$")
+        if self.serial_console is None:
+            raise VMNotReadyError("serial", timeout)
+        if re.search(pattern, self.serial_console.get_output() or "", re.M):
+            return
+        try:
+            self.serial_console.read_until_output_matches([pattern], timeout=timeout)
+        except ExpectError:
+            raise VMNotReadyError("serial", timeout)
+
+    def _wait_ready_address(self, timeout, nic_index):
+        """Wait for the ip address of the NIC"""
+        try:
+            self.wait_for_get_address(
+                nic_index, timeout=timeout, ip_version=self.ip_version
+            )
+        except (VMIPAddressMissingError, VMAddressVerificationError):
+            raise VMNotReadyError("address", timeout)
+
+    def _wait_ready_login(self, timeout, nic_index):
+        """Wait until remote login succeeds"""
+        try:
+            self.wait_for_login(nic_index, timeout=timeout).close()
+        except (
+            remote.LoginTimeoutError,
+            VMIPAddressMissingError,
+            VMAddressVerificationError,
+        ):
+            raise VMNotReadyError("login", timeout)
+
+    @contextlib.contextmanager
+    def borrow_session(self, nic_index=0, timeout=LOGIN_WAIT_TIMEOUT):
+        """
+        Borrow a logged in shell session, an idle one when there is one.
+
+        The session goes back to the idle ones when it's returned without
+        an exception and fewer than "vm_session_pool_size" (0 by default)
+        are idle, otherwise it's closed.
+
+        :param nic_index: The index of the NIC to connect to.
+        :param timeout: Time (seconds) to keep trying to log in.
+        """
+        idle = self.idle_sessions.setdefault(nic_index, [])
+        session = None
+        while idle and session is None:
+            session = idle.pop()
+            if not (session.is_alive() and session.is_responsive()):
+                session.close()
+                session = None
+        if session is None:
+            session = self.wait_for_login(nic_index, timeout=timeout)
+        try:
+            yield session
+        except Exception:
+            session.close()
+            raise
+        if session.is_alive() and len(idle) < int(
+            self.params.get("vm_session_pool_size", 0)
+        ):
+            idle.append(session)
+        else:
+            session.close()
+
+    def close_ssh_connections(self):
+        """
+        Close the idle sessions and stop the ssh masters of the guest.
+        """
+        # VMs pickled by older versions have neither
+        for sessions in getattr(self, "idle_sessions", {}).values():
+            for session in sessions:
+                session.close()
+        self.idle_sessions = {}
+        for control_path in getattr(self, "ssh_control_paths", ()):
+            remote_old.ssh_mux_exit(control_path)
+        self.ssh_control_paths = set()
+
     @error_context.context_aware
     def copy_files_to(
         self,
@@ -1348,22 +1687,42 @@ class BaseVM(object):
             utils_misc.generate_random_string(4),
         )
         log_function = utils_logfile.log_line
-        remote.copy_files_to(
-            address,
-            client,
-            username,
-            password,
-            port,
-            host_path,
-            guest_path,
-            limit=limit,
-            log_filename=log_filename,
-            log_function=log_function,
-            verbose=verbose,
-            timeout=timeout,
-            interface=neigh_attach_if,
-            filesize=filesize,
-        )
+        control_path = None
+        if client == "scp":
+            control_path = self._get_ssh_control_path(address, port, username)
+        if control_path:
+            remote_old.scp_mux(
+                control_path,
+                address,
+                port,
+                username,
+                password,
+                host_path,
+                guest_path,
+                to_remote=True,
+                limit=limit,
+                log_filename=log_filename,
+                log_function=log_function,
+                timeout=timeout,
+                interface=neigh_attach_if,
+            )
+        else:
+            remote.copy_files_to(
+                address,
+                client,
+                username,
+                password,
+                port,
+                host_path,
+                guest_path,
+                limit=limit,
+                log_filename=log_filename,
+                log_function=log_function,
+                verbose=verbose,
+                timeout=timeout,
+                interface=neigh_attach_if,
+                filesize=filesize,
+            )
         utils_logfile.close_log_file(log_filename)
 
     @error_context.context_aware
@@ -1408,22 +1767,42 @@ class BaseVM(object):
             utils_misc.generate_random_string(4),
         )
         log_function = utils_logfile.log_line
-        remote.copy_files_from(
-            address,
-            client,
-            username,
-            password,
-            port,
-            guest_path,
-            host_path,
-            limit=limit,
-            log_filename=log_filename,
-            log_function=log_function,
-            verbose=verbose,
-            timeout=timeout,
-            interface=neigh_attach_if,
-            filesize=filesize,
-        )
+        control_path = None
+        if client == "scp":
+            control_path = self._get_ssh_control_path(address, port, username)
+        if control_path:
+            remote_old.scp_mux(
+                control_path,
+                address,
+                port,
+                username,
+                password,
+                guest_path,
+                host_path,
+                to_remote=False,
+                limit=limit,
+                log_filename=log_filename,
+                log_function=log_function,
+                timeout=timeout,
+                interface=neigh_attach_if,
+            )
+        else:
+            remote.copy_files_from(
+                address,
+                client,
+                username,
+                password,
+                port,
+                guest_path,
+                host_path,
+                limit=limit,
+                log_filename=log_filename,
+                log_function=log_function,
+                verbose=verbose,
+                timeout=timeout,
+                interface=neigh_attach_if,
+                filesize=filesize,
+            )
         utils_logfile.close_log_file(log_filename)
 
     def _create_serial_console(self):
@@ -1,5 +1,6 @@
 """AUTOtest implementation of iothread manager classes for QEMU."""
 
+import heapq
 import itertools
 
 from virttest.qemu_devices.qdevices import QIOThread
@@ -49,6 +50,14 @@ class IOThreadManagerBase(object):
         except KeyError:
             raise KeyError("iothread %s not exists" % iothread_id)
 
+    def update_iothread(self, iothread):
+        """
+        Notify the manager that devices were detached from the iothread.
+
+        :param iothread: iothread object whose devices changed
+        """
+        pass
+
 
 class PredefinedManager(IOThreadManagerBase):
     """
@@ -73,23 +82,71 @@ class PredefinedManager(IOThreadManagerBase):
 class RoundRobinManager(IOThreadManagerBase):
     """Dispatch iothread object in round-robin way."""
 
+    def __init__(self, iothreads=None):
+        """
+        Initialize iothread manager.
+
+        :param iothreads: list of iothread objects, its id must conform to
+                          ID_PATTERN.
+        """
+        super(RoundRobinManager, self).__init__(iothreads)
+        # heap of (cmpkey, version, iothread_id), entries whose version
+        # differs from self._versions are outdated and skipped
+        self._heap = []
+        self._versions = {}
+        for iothread in iothreads or []:
+            self._push(iothread)
+
     @staticmethod
     def _iothread_cmpkey_getter(iothread):
         """Extract compare key for iothread object."""
         return (len(iothread.iothread_bus), iothread.get_aid())
 
+    def _push(self, iothread, replace=False):
+        """
+        Put iothread into the heap with its current compare key.
+
+        :param iothread: iothread object
+        :param replace: replace the top of the heap instead of adding
+        """
+        iothread_id = iothread.get_aid()
+        version = self._versions.get(iothread_id, 0) + 1
+        self._versions[iothread_id] = version
+        entry = (self._iothread_cmpkey_getter(iothread), version, iothread_id)
+        if replace:
+            heapq.heapreplace(self._heap, entry)
+        else:
+            heapq.heappush(self._heap, entry)
+
     def request_iothread(self, iothread):
         """Return iothread with least device attached."""
         if iothread == "AUTO" or iothread == "auto":
-            try:
-                return min(
-                    self._iothread_finder.values(), key=self._iothread_cmpkey_getter
-                )
-            except ValueError:
-                raise KeyError("No available iothread to allocate")
+            while self._heap:
+                key, version, iothread_id = self._heap[0]
+                iothread = self._iothread_finder.get(iothread_id)
+                if iothread is None or self._versions[iothread_id] != version:
+                    heapq.heappop(self._heap)  # released or outdated
+                elif self._iothread_cmpkey_getter(iothread) != key:
+                    # devices were attached since it was pushed
+                    self._push(iothread, replace=True)
+                else:
+                    return iothread
+            raise KeyError("No available iothread to allocate")
         else:
             raise ValueError("Not support request specific iothread")
 
+    def update_iothread(self, iothread):
+        """
+        Notify the manager that devices were detached from the iothread.
+
+        Attached devices are noticed by ``request_iothread`` itself, but an
+        iothread whose load dropped has to be moved up in the heap.
+
+        :param iothread: iothread object whose devices changed
+        """
+        if iothread.get_aid() in self._iothread_finder:
+            self._push(iothread)
+
 
 class OTOManager(IOThreadManagerBase):
     """Always dispatch new iothread object."""